@@ -0,0 +1,7 @@
+-- Trigram index over the same text projection used by the flow list `search` filter.
+-- pg_trgm extracts the literal trigrams required by a regular expression, so a
+-- regex search only rechecks the payloads containing them instead of the whole table.
+-- `./start.py migrate` builds this index concurrently on a running database.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS "raw_blob_trgm_idx" ON "raw" USING GIN ((ENCODE("blob", 'escape')) gin_trgm_ops);
@@ -0,0 +1,22 @@
+-- Keyset pagination of the flow list on (ts_start, id), newest first.
+-- It replaces "flow_ts_start_idx", which it covers.
+CREATE INDEX IF NOT EXISTS "flow_ts_start_id_idx" ON "flow" ("ts_start" DESC, "id" DESC);
+DROP INDEX IF EXISTS "flow_ts_start_idx";
+
+-- Insertion order of flows, used as the "since" cursor of the flow list.
+-- Flows are written when they end, so ts_start cannot tell which ones are new.
+-- Adding the column without a default then setting it does not rewrite the table,
+-- flows written before this migration keep a NULL seq.
+CREATE SEQUENCE IF NOT EXISTS "flow_seq_seq";
+ALTER TABLE "flow" ADD COLUMN IF NOT EXISTS "seq" BIGINT;
+ALTER TABLE "flow" ALTER COLUMN "seq" SET DEFAULT nextval('flow_seq_seq');
+ALTER SEQUENCE "flow_seq_seq" OWNED BY "flow"."seq";
+CREATE INDEX IF NOT EXISTS "flow_seq_idx" ON "flow" ("seq");
+
+-- Transaction that wrote each flow. Writers commit batches concurrently, so a "since"
+-- cursor also keeps the transactions still running when it was read, and their flows,
+-- which may become visible below it, are looked up by transaction id. Ids grow with
+-- insertion order, a BRIN index stays a few pages and is cheap to maintain.
+ALTER TABLE "flow" ADD COLUMN IF NOT EXISTS "xid" BIGINT;
+ALTER TABLE "flow" ALTER COLUMN "xid" SET DEFAULT pg_current_xact_id()::text::bigint;
+CREATE INDEX IF NOT EXISTS "flow_xid_idx" ON "flow" USING BRIN ("xid");
@@ -0,0 +1,66 @@
+-- Distinct values shown as flow list filters: application protocols and alert tags.
+-- Maintained by statement-level triggers on ingest, so the frontend does not group
+-- whole tables on every request. `facet_version` is bumped when a new value appears.
+CREATE TABLE IF NOT EXISTS "facet" (
+    "id" SERIAL NOT NULL,
+    "kind" TEXT NOT NULL,
+    "value" TEXT NOT NULL,
+    "color" TEXT,
+
+    CONSTRAINT "facet_pkey" PRIMARY KEY ("id")
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS "facet_kind_value_color_key" ON "facet" ("kind", "value", COALESCE("color", ''));
+
+CREATE SEQUENCE IF NOT EXISTS "facet_version";
+
+CREATE OR REPLACE FUNCTION flow_facet_fn() RETURNS trigger AS $$
+DECLARE
+    added INTEGER;
+BEGIN
+    WITH ins AS (
+        INSERT INTO facet (kind, value)
+        SELECT DISTINCT 'app_proto', app_proto FROM new_rows WHERE app_proto IS NOT NULL AND app_proto <> 'failed'
+        ON CONFLICT (kind, value, COALESCE(color, '')) DO NOTHING
+        RETURNING 1
+    )
+    SELECT count(*) INTO added FROM ins;
+    IF added > 0 THEN
+        PERFORM nextval('facet_version');
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION alert_facet_fn() RETURNS trigger AS $$
+DECLARE
+    added INTEGER;
+BEGIN
+    WITH ins AS (
+        INSERT INTO facet (kind, value, color)
+        SELECT DISTINCT 'tag', tag, color FROM new_rows WHERE tag IS NOT NULL
+        ON CONFLICT (kind, value, COALESCE(color, '')) DO NOTHING
+        RETURNING 1
+    )
+    SELECT count(*) INTO added FROM ins;
+    IF added > 0 THEN
+        PERFORM nextval('facet_version');
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS flow_facet ON flow;
+CREATE TRIGGER flow_facet AFTER INSERT ON flow REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE flow_facet_fn();
+
+DROP TRIGGER IF EXISTS alert_facet ON alert;
+CREATE TRIGGER alert_facet AFTER INSERT ON alert REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE alert_facet_fn();
+
+-- Existing values
+INSERT INTO facet (kind, value)
+SELECT DISTINCT 'app_proto', app_proto FROM flow WHERE app_proto IS NOT NULL AND app_proto <> 'failed'
+ON CONFLICT (kind, value, COALESCE(color, '')) DO NOTHING;
+INSERT INTO facet (kind, value, color)
+SELECT DISTINCT 'tag', tag, color FROM alert WHERE tag IS NOT NULL
+ON CONFLICT (kind, value, COALESCE(color, '')) DO NOTHING;
+SELECT nextval('facet_version');
@@ -0,0 +1,107 @@
+-- Per-second rollups of flows and "FLAG OUT" alerts, maintained on ingest.
+-- The frontend groups them by tick, so the stats view cost does not grow with the game length.
+-- "FLAG OUT" alerts are counted on their own timestamp in "flag_out_alert_rollup", and on their
+-- flow start with the flow destination in "flag_out_rollup", for the per service view.
+-- An alert is counted per destination once, by the first transaction seeing both the alert and
+-- its flow. An alert whose flow is not visible yet is queued in "flag_out_pending", then counted
+-- by the flow trigger. When the flow and the alert are committed concurrently, neither trigger
+-- sees the other row, the alert stays queued until the next flows are written.
+CREATE TABLE IF NOT EXISTS "flow_rollup" (
+    "bucket" BIGINT NOT NULL,
+    "flows" BIGINT NOT NULL DEFAULT 0,
+
+    CONSTRAINT "flow_rollup_pkey" PRIMARY KEY ("bucket")
+);
+
+CREATE TABLE IF NOT EXISTS "flag_out_rollup" (
+    "bucket" BIGINT NOT NULL,
+    "dest_ipport" TEXT NOT NULL,
+    "flags" BIGINT NOT NULL DEFAULT 0,
+
+    CONSTRAINT "flag_out_rollup_pkey" PRIMARY KEY ("bucket", "dest_ipport")
+);
+
+CREATE TABLE IF NOT EXISTS "flag_out_alert_rollup" (
+    "bucket" BIGINT NOT NULL,
+    "flags" BIGINT NOT NULL DEFAULT 0,
+
+    CONSTRAINT "flag_out_alert_rollup_pkey" PRIMARY KEY ("bucket")
+);
+
+CREATE TABLE IF NOT EXISTS "flag_out_pending" (
+    "flow_id" BIGINT NOT NULL,
+    "timestamp" BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "flag_out_pending_flow_id_idx" ON "flag_out_pending" ("flow_id");
+
+CREATE OR REPLACE FUNCTION flow_rollup_fn() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO flow_rollup (bucket, flows)
+    SELECT ts_start / 1000000, count(*) FROM new_rows GROUP BY 1
+    ON CONFLICT (bucket) DO UPDATE SET flows = flow_rollup.flows + EXCLUDED.flows;
+
+    -- Alerts written before these flows, or committed concurrently with earlier flows
+    PERFORM flag_out_reconcile();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Counting and queuing use the same snapshot, so that a flow committed in between is not missed
+CREATE OR REPLACE FUNCTION alert_rollup_fn() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO flag_out_alert_rollup (bucket, flags)
+    SELECT timestamp / 1000000, count(*) FROM new_rows WHERE tag = 'FLAG OUT' GROUP BY 1
+    ON CONFLICT (bucket) DO UPDATE SET flags = flag_out_alert_rollup.flags + EXCLUDED.flags;
+
+    WITH flag AS (
+        SELECT a.flow_id, a.timestamp, f.id IS NOT NULL AS found, f.ts_start, f.dest_ipport
+        FROM new_rows a LEFT JOIN flow f ON f.id = a.flow_id
+        WHERE a.tag = 'FLAG OUT'
+    ), queued AS (
+        INSERT INTO flag_out_pending (flow_id, timestamp)
+        SELECT flow_id, timestamp FROM flag WHERE NOT found
+    )
+    INSERT INTO flag_out_rollup (bucket, dest_ipport, flags)
+    SELECT ts_start / 1000000, COALESCE(dest_ipport, ''), count(*) FROM flag WHERE found GROUP BY 1, 2
+    ON CONFLICT (bucket, dest_ipport) DO UPDATE SET flags = flag_out_rollup.flags + EXCLUDED.flags;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Count the queued alerts whose flow is now visible.
+-- Rows are deleted as they are counted, concurrent callers count each alert once and skip
+-- the alerts being counted by another writer instead of waiting for it.
+CREATE OR REPLACE FUNCTION flag_out_reconcile() RETURNS void AS $$
+    WITH found AS (
+        SELECT p.ctid, f.ts_start, f.dest_ipport
+        FROM flag_out_pending p JOIN flow f ON f.id = p.flow_id
+        FOR UPDATE OF p SKIP LOCKED
+    ), moved AS (
+        DELETE FROM flag_out_pending p USING found WHERE p.ctid = found.ctid
+        RETURNING found.ts_start, found.dest_ipport
+    )
+    INSERT INTO flag_out_rollup (bucket, dest_ipport, flags)
+    SELECT ts_start / 1000000, COALESCE(dest_ipport, ''), count(*) FROM moved GROUP BY 1, 2
+    ON CONFLICT (bucket, dest_ipport) DO UPDATE SET flags = flag_out_rollup.flags + EXCLUDED.flags;
+$$ LANGUAGE sql;
+
+DROP TRIGGER IF EXISTS flow_rollup ON flow;
+CREATE TRIGGER flow_rollup AFTER INSERT ON flow REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE flow_rollup_fn();
+
+DROP TRIGGER IF EXISTS alert_rollup ON alert;
+CREATE TRIGGER alert_rollup AFTER INSERT ON alert REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE alert_rollup_fn();
+
+-- Existing rows, creating the triggers above blocks inserts until this migration is committed
+TRUNCATE flow_rollup, flag_out_rollup, flag_out_alert_rollup, flag_out_pending;
+INSERT INTO flow_rollup (bucket, flows)
+SELECT ts_start / 1000000, count(*) FROM flow GROUP BY 1;
+INSERT INTO flag_out_rollup (bucket, dest_ipport, flags)
+SELECT f.ts_start / 1000000, COALESCE(f.dest_ipport, ''), count(*)
+FROM alert a JOIN flow f ON f.id = a.flow_id
+WHERE a.tag = 'FLAG OUT'
+GROUP BY 1, 2;
+INSERT INTO flag_out_alert_rollup (bucket, flags)
+SELECT timestamp / 1000000, count(*) FROM alert WHERE tag = 'FLAG OUT' GROUP BY 1;
+INSERT INTO flag_out_pending (flow_id, timestamp)
+SELECT a.flow_id, a.timestamp FROM alert a
+WHERE a.tag = 'FLAG OUT' AND NOT EXISTS (SELECT 1 FROM flow f WHERE f.id = a.flow_id);
@@ -0,0 +1,208 @@
+-- Range partitioning of flows, payloads and flow events on their timestamp (microseconds),
+-- one partition per hour. Recent partitions and their indexes stay small and hot in cache,
+-- and `./start.py prune --older-than` drops old partitions instead of deleting rows.
+-- Writers create the partitions they write to with `create_time_partitions`.
+-- Rows written before this migration are kept in one "legacy" partition per table, covering
+-- every timestamp up to the hour following the most recent row. Filling the start of legacy
+-- payloads and building the new primary keys are the only steps proportional to the tables size.
+-- Alerts are few and unique per flow and tag, they stay in a regular table.
+
+-- Payloads are partitioned on the start of their flow, so that reading the payloads of a
+-- flow only scans one partition. Legacy payloads are given the start of their flow, those of
+-- flows not written yet (still active) keep 0 and are read from the legacy partition.
+ALTER TABLE "raw" ADD COLUMN IF NOT EXISTS "ts_start" BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE "raw" ALTER COLUMN "ts_start" DROP DEFAULT;
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'raw'::regclass) <> 'p' THEN
+        UPDATE raw SET ts_start = flow.ts_start FROM flow WHERE raw.flow_id = flow.id AND raw.ts_start = 0;
+    END IF;
+END
+$$;
+
+-- Rename a table and its indexes to "<name>_legacy", then create the partitioned table in place.
+CREATE FUNCTION pg_temp.partition_by_time(tbl TEXT, key TEXT) RETURNS BOOLEAN AS $$
+DECLARE
+    idx RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = tbl::regclass) = 'p' THEN
+        RETURN false;
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', tbl, tbl || '_legacy');
+    FOR idx IN SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = (tbl || '_legacy')::regclass LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname, idx.relname || '_legacy');
+    END LOOP;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY RANGE (%I)', tbl, tbl || '_legacy', key);
+    RETURN true;
+END
+$$ LANGUAGE plpgsql;
+
+-- Attach the legacy table as the partition of every timestamp up to the hour following its
+-- most recent row, or drop it when empty.
+CREATE FUNCTION pg_temp.attach_legacy(tbl TEXT, key TEXT) RETURNS void AS $$
+DECLARE
+    last_ts BIGINT;
+BEGIN
+    IF to_regclass(tbl || '_legacy') IS NULL OR EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = (tbl || '_legacy')::regclass) THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format('SELECT max(%I) FROM %I', key, tbl || '_legacy') INTO last_ts;
+    IF last_ts IS NULL THEN
+        EXECUTE format('DROP TABLE %I', tbl || '_legacy');
+    ELSE
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (MINVALUE) TO (%s)',
+            tbl, tbl || '_legacy', (last_ts / 3600000000 + 1) * 3600000000);
+    END IF;
+END
+$$ LANGUAGE plpgsql;
+
+-- Triggers are recreated on the partitioned table
+DROP TRIGGER IF EXISTS set_ipport ON flow;
+DROP TRIGGER IF EXISTS flow_facet ON flow;
+DROP TRIGGER IF EXISTS flow_rollup ON flow;
+
+SELECT pg_temp.partition_by_time('flow', 'ts_start');
+SELECT pg_temp.partition_by_time('raw', 'ts_start');
+SELECT pg_temp.partition_by_time('app_event', 'timestamp');
+SELECT pg_temp.partition_by_time('fileinfo', 'timestamp');
+SELECT pg_temp.partition_by_time('anomaly', 'timestamp');
+
+-- Unique indexes of partitioned tables include the partition key.
+-- A flow and its payloads always have the same start, so uniqueness is unchanged.
+ALTER TABLE "flow" DROP CONSTRAINT IF EXISTS "flow_pkey";
+ALTER TABLE "flow" ADD CONSTRAINT "flow_pkey" PRIMARY KEY ("id", "ts_start");
+CREATE INDEX IF NOT EXISTS "flow_ts_start_id_idx" ON "flow" ("ts_start" DESC, "id" DESC);
+CREATE INDEX IF NOT EXISTS "flow_seq_idx" ON "flow" ("seq");
+CREATE INDEX IF NOT EXISTS "flow_xid_idx" ON "flow" USING BRIN ("xid");
+CREATE INDEX IF NOT EXISTS "flow_app_proto_idx" ON "flow" ("app_proto");
+CREATE INDEX IF NOT EXISTS "flow_src_ipport_idx" ON "flow" ("src_ipport");
+CREATE INDEX IF NOT EXISTS "flow_dest_ipport_idx" ON "flow" ("dest_ipport");
+ALTER SEQUENCE "flow_seq_seq" OWNED BY "flow"."seq";
+
+ALTER TABLE "raw" DROP CONSTRAINT IF EXISTS "raw_pkey";
+ALTER TABLE "raw" ADD CONSTRAINT "raw_pkey" PRIMARY KEY ("id", "ts_start");
+CREATE INDEX IF NOT EXISTS "raw_flow_id_idx" ON "raw" ("flow_id");
+CREATE UNIQUE INDEX IF NOT EXISTS "raw_flow_id_count_key" ON "raw" ("flow_id", "count", "ts_start");
+CREATE INDEX IF NOT EXISTS "raw_blob_trgm_idx" ON "raw" USING GIN ((ENCODE("blob", 'escape')) gin_trgm_ops);
+ALTER SEQUENCE "raw_id_seq" OWNED BY "raw"."id";
+
+ALTER TABLE "app_event" DROP CONSTRAINT IF EXISTS "app_event_pkey";
+ALTER TABLE "app_event" ADD CONSTRAINT "app_event_pkey" PRIMARY KEY ("id", "timestamp");
+CREATE INDEX IF NOT EXISTS "app_event_flow_id_idx" ON "app_event" ("flow_id");
+CREATE UNIQUE INDEX IF NOT EXISTS "app_event_flow_id_app_proto_timestamp_key" ON "app_event" ("flow_id", "app_proto", "timestamp");
+ALTER SEQUENCE "app_event_id_seq" OWNED BY "app_event"."id";
+
+ALTER TABLE "fileinfo" DROP CONSTRAINT IF EXISTS "fileinfo_pkey";
+ALTER TABLE "fileinfo" ADD CONSTRAINT "fileinfo_pkey" PRIMARY KEY ("id", "timestamp");
+CREATE INDEX IF NOT EXISTS "fileinfo_flow_id_idx" ON "fileinfo" ("flow_id");
+CREATE UNIQUE INDEX IF NOT EXISTS "fileinfo_flow_id_timestamp_key" ON "fileinfo" ("flow_id", "timestamp");
+ALTER SEQUENCE "fileinfo_id_seq" OWNED BY "fileinfo"."id";
+
+ALTER TABLE "anomaly" DROP CONSTRAINT IF EXISTS "anomaly_pkey";
+ALTER TABLE "anomaly" ADD CONSTRAINT "anomaly_pkey" PRIMARY KEY ("id", "timestamp");
+CREATE INDEX IF NOT EXISTS "anomaly_flow_id_idx" ON "anomaly" ("flow_id");
+CREATE UNIQUE INDEX IF NOT EXISTS "anomaly_flow_id_timestamp_key" ON "anomaly" ("flow_id", "timestamp");
+ALTER SEQUENCE "anomaly_id_seq" OWNED BY "anomaly"."id";
+
+SELECT pg_temp.attach_legacy('flow', 'ts_start');
+SELECT pg_temp.attach_legacy('raw', 'ts_start');
+SELECT pg_temp.attach_legacy('app_event', 'timestamp');
+SELECT pg_temp.attach_legacy('fileinfo', 'timestamp');
+SELECT pg_temp.attach_legacy('anomaly', 'timestamp');
+
+CREATE TRIGGER set_ipport BEFORE INSERT OR UPDATE OF src_ip, src_port, dest_ip, dest_port ON flow FOR EACH ROW EXECUTE PROCEDURE set_ipport_fn();
+CREATE TRIGGER flow_facet AFTER INSERT ON flow REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE flow_facet_fn();
+CREATE TRIGGER flow_rollup AFTER INSERT ON flow REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE flow_rollup_fn();
+
+DROP FUNCTION pg_temp.partition_by_time(TEXT, TEXT);
+DROP FUNCTION pg_temp.attach_legacy(TEXT, TEXT);
+
+-- Create the partitions of the hour containing `ts`, if missing.
+-- Hours already covered, e.g. by a legacy partition, are skipped.
+CREATE OR REPLACE FUNCTION create_time_partitions(ts BIGINT) RETURNS void AS $$
+DECLARE
+    part_start BIGINT := ts - ts % 3600000000;
+    suffix TEXT := to_char(to_timestamp(part_start / 1000000) AT TIME ZONE 'UTC', 'YYYYMMDDHH24');
+    tbl TEXT;
+BEGIN
+    IF to_regclass('anomaly_p' || suffix) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    -- Concurrent writers create the same partitions
+    PERFORM pg_advisory_xact_lock(hashtext('create_time_partitions'));
+    FOREACH tbl IN ARRAY ARRAY['flow', 'raw', 'app_event', 'fileinfo', 'anomaly'] LOOP
+        IF to_regclass(tbl || '_p' || suffix) IS NULL THEN
+            BEGIN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%s) TO (%s)',
+                    tbl || '_p' || suffix, tbl, part_start, part_start + 3600000000);
+            EXCEPTION
+                -- Overlaps the legacy partition
+                WHEN invalid_object_definition THEN NULL;
+                WHEN duplicate_table THEN NULL;
+            END;
+        END IF;
+    END LOOP;
+END
+$$ LANGUAGE plpgsql;
+
+-- `./start.py prune` detaches partitions one at a time with DETACH CONCURRENTLY, then drops them
+-- with `drop_time_partition` (see the raw_blob_dedup migration). Partitions are dropped up to
+-- the last hour whose flows all ended before the cutoff.
+-- Flow events are partitioned on their own timestamp, flows and payloads on the flow start:
+-- events of dropped flows are all in dropped hours, and events of kept flows are all kept.
+
+-- Start of the first hour to keep for `cutoff`: the last hour boundary before `cutoff` such
+-- that every flow starting before it also ended before it, NULL when no hour can be dropped.
+-- Only the partitions before `cutoff` are scanned.
+CREATE OR REPLACE FUNCTION time_partitions_cutoff(cutoff BIGINT) RETURNS BIGINT AS $$
+DECLARE
+    part RECORD;
+    part_end BIGINT;
+    last_end BIGINT;
+    safe BIGINT;
+BEGIN
+    cutoff := cutoff - cutoff % 3600000000;
+    FOR part IN
+        SELECT c.relname, substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''?(-?[0-9]+)''?\)')::BIGINT AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'flow'::regclass
+        ORDER BY 2
+    LOOP
+        EXIT WHEN part.bound > cutoff;
+        EXECUTE format('SELECT max(ts_end) FROM %I', part.relname) INTO part_end;
+        last_end := GREATEST(last_end, part_end);
+        IF last_end IS NULL OR last_end < part.bound THEN
+            safe := part.bound;
+        END IF;
+    END LOOP;
+    RETURN safe;
+END
+$$ LANGUAGE plpgsql;
+
+-- Partitions holding only timestamps before `cutoff`, see `time_partitions_cutoff`,
+-- with partitions left detached or pending detach by an interrupted prune.
+CREATE OR REPLACE FUNCTION time_partitions_before(cutoff BIGINT)
+RETURNS TABLE (parent TEXT, name TEXT, detach_pending BOOLEAN) AS $$
+    SELECT p.relname::TEXT, c.relname::TEXT, i.inhdetachpending
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent
+    WHERE p.relname IN ('flow', 'raw', 'app_event', 'fileinfo', 'anomaly')
+        AND substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''?(-?[0-9]+)''?\)')::BIGINT <= cutoff
+    UNION ALL
+    SELECT NULL, c.relname::TEXT, false
+    FROM pg_class c
+    WHERE c.relkind = 'r' AND NOT c.relispartition AND c.relnamespace = 'public'::regnamespace
+        AND c.relname ~ '^(flow|raw|app_event|fileinfo|anomaly)_(p[0-9]{10}|legacy)$'
+    ORDER BY 2
+$$ LANGUAGE sql;
+
+-- Delete the alerts and rollups of the dropped hours.
+CREATE OR REPLACE FUNCTION delete_time_rows(cutoff BIGINT) RETURNS void AS $$
+    DELETE FROM alert WHERE timestamp < cutoff;
+    DELETE FROM flag_out_pending WHERE timestamp < cutoff;
+    DELETE FROM flow_rollup WHERE bucket < cutoff / 1000000;
+    DELETE FROM flag_out_rollup WHERE bucket < cutoff / 1000000;
+    DELETE FROM flag_out_alert_rollup WHERE bucket < cutoff / 1000000;
+$$ LANGUAGE sql;
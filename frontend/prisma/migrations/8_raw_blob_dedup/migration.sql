@@ -0,0 +1,67 @@
+-- Content-addressed payload storage: checkers and exploits send the same chunks over and over,
+-- each distinct chunk is stored once in "raw_blob", keyed by its SHA-256.
+-- Payload rows reference it with "blob_hash" and leave "blob" NULL.
+-- Payloads written before this migration keep their "blob", `./start.py migrate` moves them.
+CREATE TABLE IF NOT EXISTS "raw_blob" (
+    "hash" BYTEA NOT NULL,
+    "blob" BYTEA NOT NULL,
+
+    CONSTRAINT "raw_blob_pkey" PRIMARY KEY ("hash")
+);
+
+-- Chunks are compressed with lz4 as soon as the row exceeds 128 bytes, instead of 2 kB by default.
+ALTER TABLE "raw_blob" ALTER COLUMN "blob" SET COMPRESSION lz4;
+ALTER TABLE "raw_blob" SET (toast_tuple_target = 128);
+
+-- Search matches distinct chunks only
+CREATE INDEX IF NOT EXISTS "raw_blob_blob_trgm_idx" ON "raw_blob" USING GIN ((ENCODE("blob", 'escape')) gin_trgm_ops);
+
+ALTER TABLE "raw" ADD COLUMN IF NOT EXISTS "blob_hash" BYTEA;
+CREATE INDEX IF NOT EXISTS "raw_blob_hash_idx" ON "raw" ("blob_hash");
+
+-- Chunks referenced by dropped payloads are queued in "raw_blob_gc", in the transaction dropping
+-- them, then `./start.py prune` collects the unreferenced ones in small batches: only these
+-- chunks are checked instead of the whole "raw_blob" table.
+-- Payload writers hold a key share lock on the existing chunks they reference until they commit,
+-- chunks locked by a writer are referenced again and left out of the batch.
+CREATE TABLE IF NOT EXISTS "raw_blob_gc" (
+    "hash" BYTEA NOT NULL,
+
+    CONSTRAINT "raw_blob_gc_pkey" PRIMARY KEY ("hash")
+);
+
+-- Drop a detached partition, queuing the chunks of dropped payloads.
+CREATE OR REPLACE FUNCTION drop_time_partition(part TEXT) RETURNS void AS $$
+BEGIN
+    IF part LIKE 'raw\_%' THEN
+        EXECUTE format('INSERT INTO raw_blob_gc (hash) SELECT DISTINCT blob_hash FROM %I WHERE blob_hash IS NOT NULL ON CONFLICT DO NOTHING', part);
+    END IF;
+    EXECUTE format('DROP TABLE %I', part);
+END
+$$ LANGUAGE plpgsql;
+
+-- Delete up to `batch_size` queued chunks no longer referenced by a payload,
+-- returning the number of queued chunks checked, 0 once the queue is empty.
+CREATE OR REPLACE FUNCTION collect_raw_blobs(batch_size INT) RETURNS INT AS $$
+DECLARE
+    queued BYTEA[];
+    locked BYTEA[];
+BEGIN
+    WITH batch AS (
+        DELETE FROM raw_blob_gc WHERE hash IN (SELECT hash FROM raw_blob_gc LIMIT batch_size FOR UPDATE SKIP LOCKED)
+        RETURNING hash
+    )
+    SELECT array_agg(hash) INTO queued FROM batch;
+    IF queued IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Chunks locked by a writer are being referenced
+    SELECT array_agg(hash) INTO locked
+    FROM (SELECT hash FROM raw_blob WHERE hash = ANY(queued) FOR UPDATE SKIP LOCKED) b;
+
+    -- Payloads committed before the locks above were granted are visible to this statement
+    DELETE FROM raw_blob b WHERE b.hash = ANY(locked) AND NOT EXISTS (SELECT 1 FROM raw WHERE raw.blob_hash = b.hash);
+    RETURN cardinality(queued);
+END
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,9 @@
+-- Latest counters of each ingest process (EVE output, payload writers), read by `./start.py top`.
+-- Rows are overwritten every second, so the table is not WAL-logged.
+CREATE UNLOGGED TABLE IF NOT EXISTS "ingest_stats" (
+    "source" TEXT NOT NULL,
+    "stats" JSONB NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+    CONSTRAINT "ingest_stats_pkey" PRIMARY KEY ("source")
+);
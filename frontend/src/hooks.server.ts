@@ -1,8 +1,25 @@
 import type { Handle } from "@sveltejs/kit";
 import "dotenv/config";
+import { CTF_CONFIG_FILE, watchConfig } from "$lib/server/config";
+import { observeRequest } from "$lib/server/metrics";
+import { PCAP_DUMPS_DIR, watchPcapDir } from "$lib/server/pcap";
+import fs from "node:fs";
+import path from "node:path";
 
 
+// Keep the index of live captures up to date for flow pcap extraction
+if (fs.existsSync(PCAP_DUMPS_DIR)) {
+    watchPcapDir();
+}
+
+// Pick up config changes pushed to a running web server
+if (fs.existsSync(path.dirname(CTF_CONFIG_FILE))) {
+    watchConfig();
+}
+
 export const handle: Handle = async ({ event, resolve }) => {
+    const start = performance.now();
     const response = await resolve(event);
+    observeRequest(event.route.id ?? "unmatched", event.request.method, response.status, (performance.now() - start) / 1000);
     return response;
-};
\ No newline at end of file
+};
@@ -0,0 +1,57 @@
+import { describe, expect, it } from "vitest";
+import { encodeRawFrame, readRawFrames, toBase64, type RawChunk } from "./raw";
+
+const CHUNKS: RawChunk[] = [
+    { count: 0, server_to_client: 0, data: new TextEncoder().encode("GET / HTTP/1.1\r\n\r\n") },
+    { count: 1, server_to_client: 1, data: Uint8Array.from({ length: 70000 }, (_, i) => i % 256) },
+    { count: 2, server_to_client: 0, data: new Uint8Array(0) }
+];
+
+function concat(parts: Uint8Array[]) {
+    const out = new Uint8Array(parts.reduce((n, p) => n + p.length, 0));
+    let offset = 0;
+    for (const p of parts) {
+        out.set(p, offset);
+        offset += p.length;
+    }
+    return out;
+}
+
+/**
+ * Stream `bytes` in reads of `size` bytes.
+ */
+function streamOf(bytes: Uint8Array, size: number) {
+    let offset = 0;
+    return new ReadableStream<Uint8Array>({
+        pull(controller) {
+            if (offset >= bytes.length) {
+                controller.close();
+                return;
+            }
+            controller.enqueue(bytes.slice(offset, offset + size));
+            offset += size;
+        }
+    });
+}
+
+describe("readRawFrames", () => {
+    it("decodes frames whatever the read boundaries", async () => {
+        const bytes = concat(CHUNKS.map(encodeRawFrame));
+        for (const size of [1, 5, 9, 4096, bytes.length]) {
+            expect(await readRawFrames(streamOf(bytes, size))).toEqual(CHUNKS);
+        }
+    });
+
+    it("ignores a truncated last frame", async () => {
+        const bytes = concat(CHUNKS.map(encodeRawFrame));
+        expect(await readRawFrames(streamOf(bytes.subarray(0, bytes.length - 1), 4096))).toEqual(CHUNKS.slice(0, 2));
+    });
+});
+
+describe("toBase64", () => {
+    it("encodes large buffers", () => {
+        const data = CHUNKS[1].data;
+        expect(toBase64(data)).toBe(Buffer.from(data).toString("base64"));
+        expect(toBase64(new Uint8Array(0))).toBe("");
+    });
+});
@@ -0,0 +1,83 @@
+// Raw payload chunks are sent by `/api/flow/[flow]/raw` as length-prefixed binary frames:
+// `count` (int32), `server_to_client` (uint8) and the data length (uint32), big endian, then the data.
+const FRAME_HEADER_SIZE = 9;
+
+export type RawChunk = {
+    count: number,
+    // 0 for client to server chunks
+    server_to_client: number,
+    data: Uint8Array
+};
+
+/**
+ * Encode one raw payload chunk as a frame.
+ * @param chunk Raw payload chunk.
+ * @returns Uint8Array
+ */
+export function encodeRawFrame({ count, server_to_client, data }: RawChunk) {
+    const frame = new Uint8Array(FRAME_HEADER_SIZE + data.length);
+    const view = new DataView(frame.buffer);
+    view.setInt32(0, count);
+    view.setUint8(4, server_to_client);
+    view.setUint32(5, data.length);
+    frame.set(data, FRAME_HEADER_SIZE);
+    return frame;
+}
+
+/**
+ * Decode the frames of a raw payload stream, whatever the boundaries of its reads.
+ * A truncated last frame is ignored.
+ * @param body Response body.
+ * @returns Raw payload chunks
+ */
+export async function readRawFrames(body: ReadableStream<Uint8Array>) {
+    const reader = body.getReader();
+    const chunks: RawChunk[] = [];
+    let buf = new Uint8Array(0);
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        if (buf.length > 0) {
+            const joined = new Uint8Array(buf.length + value.length);
+            joined.set(buf);
+            joined.set(value, buf.length);
+            buf = joined;
+        }
+        else {
+            buf = value;
+        }
+
+        let offset = 0;
+        while (buf.length - offset >= FRAME_HEADER_SIZE) {
+            const view = new DataView(buf.buffer, buf.byteOffset + offset, FRAME_HEADER_SIZE);
+            const end = offset + FRAME_HEADER_SIZE + view.getUint32(5);
+            if (end > buf.length) {
+                break;
+            }
+            chunks.push({
+                count: view.getInt32(0),
+                server_to_client: view.getUint8(4),
+                data: buf.slice(offset + FRAME_HEADER_SIZE, end)
+            });
+            offset = end;
+        }
+        buf = buf.subarray(offset);
+    }
+    return chunks;
+}
+
+/**
+ * Encode bytes as base64, e.g. for generated replay scripts.
+ * @param data Bytes.
+ * @returns string
+ */
+export function toBase64(data: Uint8Array) {
+    let binary = "";
+    // Bounded arguments per call
+    for (let i = 0; i < data.length; i += 0x8000) {
+        binary += String.fromCharCode(...data.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+}
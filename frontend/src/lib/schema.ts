@@ -12,6 +12,11 @@ export const flowsListFilters = z.object({
 
 export type FlowsListFilters = z.infer<typeof flowsListFilters>;
 
+export const flowsListCursor = z.object({
+    before: z.string().regex(/^\d+:\d+$/).optional(),
+    since: z.string().regex(/^\d+(:\d+(,\d+)*)?$/).optional()
+});
+
 export type Flow = {
     id: string,
     ts_start: string,
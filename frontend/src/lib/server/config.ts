@@ -1,56 +1,86 @@
 import { ctfConfig, type CtfConfig } from "$lib/schema";
+import { env } from "$env/dynamic/private";
 import fs from "node:fs";
+import path from "node:path";
 
 
-/**
- * Load services configuration from JSON file.
- * @param path Path of the file containing services config.
- * @returns CtfConfig
- */
-export function loadConfig(path = "./ctf_config.json") {
+// Config file, in the `config` directory shared with `./start.py config set` in Docker.
+export const CTF_CONFIG_FILE = env.CTF_CONFIG_FILE ?? "./ctf_config.json";
+// Delay between a change of the config file and its reload, changes often come in bursts, in milliseconds.
+const CONFIG_RELOAD_DELAY = 100;
+
+function defaultConfig(): CtfConfig {
+    let end_date = new Date();
+    end_date.setTime(end_date.getTime() + 8 * 60 * 60 * 1000)
+    return {
+        start_date: new Date().toISOString().slice(0, -8),
+        end_date: end_date.toISOString().slice(0, -8),
+        tick_length: 120,
+        refresh_rate: 120,
+        services: {}
+    };
+}
+
+function readConfig(path: string) {
     if (!fs.existsSync(path)) {
-        let end_date = new Date();
-        end_date.setTime(end_date.getTime() + 8 * 60 * 60 * 1000)
-        return {
-            start_date: new Date().toISOString().slice(0, -8),
-            end_date: end_date.toISOString().slice(0, -8),
-            tick_length: 120,
-            refresh_rate: 120,
-            services: {}
-        };
+        return undefined;
     }
 
     try {
-        let data = ctfConfig.parse(JSON.parse(fs.readFileSync(path, "utf-8")));
-        return data;
+        return ctfConfig.parse(JSON.parse(fs.readFileSync(path, "utf-8")));
     }
     catch (e) {
-        console.error("Error parsing services config, returning default values.");
-        let end_date = new Date();
-        end_date.setTime(end_date.getTime() + 8 * 60 * 60 * 1000)
-        return {
-            start_date: new Date().toISOString().slice(0, -8),
-            end_date: end_date.toISOString().slice(0, -8),
-            tick_length: 120,
-            refresh_rate: 120,
-            services: {}
-        };
+        console.error("Error parsing services config.", e);
+        return undefined;
     }
 }
 
 /**
- * Save services configuration to JSON file with file locking.
+ * Load services configuration from JSON file.
+ * @param path Path of the file containing services config.
+ * @returns CtfConfig, default values if the file is missing or invalid.
+ */
+export function loadConfig(path = CTF_CONFIG_FILE) {
+    return readConfig(path) ?? defaultConfig();
+}
+
+/**
+ * Save services configuration to JSON file.
+ * The file is replaced atomically, so that concurrent readers never see a partial file.
  * @param data Config to save in the file.
  * @param path Path where to save the file.
  */
-export function saveConfig(data: CtfConfig, path = "./ctf_config.json") {
+export function saveConfig(data: CtfConfig, path = CTF_CONFIG_FILE) {
     try {
-        fs.writeFileSync(path, JSON.stringify(data));
+        fs.writeFileSync(`${path}.tmp`, JSON.stringify(data));
+        fs.renameSync(`${path}.tmp`, path);
     }
     catch (e) {
         console.error("Error writing to services config file.", e);
     }
 }
 
+/**
+ * Reload `CTF_CONFIG` when its file changes, e.g. with `./start.py config set`.
+ * The directory is watched, files replaced atomically get a new inode.
+ * An invalid file keeps the current config.
+ * @param file Path of the config file.
+ */
+export function watchConfig(file = CTF_CONFIG_FILE) {
+    let timer: NodeJS.Timeout | undefined;
+    fs.watch(path.dirname(file), (_event, filename) => {
+        if (filename !== path.basename(file)) {
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            const config = readConfig(file);
+            if (config) {
+                CTF_CONFIG = config;
+            }
+        }, CONFIG_RELOAD_DELAY);
+    }).unref();
+}
+
 
-export let CTF_CONFIG: CtfConfig = loadConfig();
\ No newline at end of file
+export let CTF_CONFIG: CtfConfig = loadConfig();
@@ -0,0 +1,50 @@
+import type { Tags } from "$lib/schema";
+import prisma from "$lib/server/prisma";
+
+
+// Minimum delay between two checks of `facet_version`, in milliseconds.
+const FACETS_CHECK_INTERVAL = 2000;
+
+type Facets = {
+    version: bigint,
+    appProto: string[],
+    tags: Tags
+};
+
+let cache: Facets | undefined;
+let checkedAt = 0;
+let pending: Promise<Facets> | undefined;
+
+/**
+ * Get application protocols and alert tags shown as flow list filters.
+ * Facets are kept in memory and reloaded when the `facet_version` sequence, bumped by ingest triggers, changes.
+ * Concurrent requests share the same check.
+ * @returns Facets
+ */
+export async function getFacets() {
+    if (cache && Date.now() - checkedAt < FACETS_CHECK_INTERVAL) {
+        return cache;
+    }
+    pending ??= refreshFacets().finally(() => {
+        pending = undefined;
+    });
+    return pending;
+}
+
+async function refreshFacets() {
+    const [{ version }] = await prisma.$queryRaw<{ version: bigint }[]>`SELECT last_value AS version FROM facet_version`;
+    checkedAt = Date.now();
+    if (cache && cache.version === version) {
+        return cache;
+    }
+
+    const rows = await prisma.facet.findMany({
+        orderBy: [{ color: "asc" }, { value: "asc" }]
+    });
+    cache = {
+        version,
+        appProto: rows.filter((r) => r.kind === "app_proto").map((r) => r.value),
+        tags: rows.filter((r) => r.kind === "tag").map((r) => ({ tag: r.value, color: r.color ?? "" }))
+    };
+    return cache;
+}
@@ -0,0 +1,139 @@
+import fs from "node:fs";
+import os from "node:os";
+import path from "node:path";
+import { afterAll, beforeAll, describe, expect, it } from "vitest";
+import { serveFile } from "./files";
+
+const CONTENT = Buffer.from("0123456789abcdef");
+
+let dir: string;
+let root: string;
+
+beforeAll(async () => {
+    dir = await fs.promises.mkdtemp(path.join(os.tmpdir(), "files-spec-"));
+    root = path.join(dir, "root");
+    await fs.promises.mkdir(path.join(root, "sub"), { recursive: true });
+    await fs.promises.writeFile(path.join(root, "dump.pcap"), CONTENT);
+    await fs.promises.writeFile(path.join(root, "empty.pcap"), "");
+    await fs.promises.writeFile(path.join(dir, "secret.txt"), "secret");
+    // Sibling directory sharing the prefix of the root
+    await fs.promises.mkdir(path.join(dir, "root2"));
+    await fs.promises.writeFile(path.join(dir, "root2", "dump.pcap"), CONTENT);
+});
+
+afterAll(async () => {
+    await fs.promises.rm(dir, { recursive: true, force: true });
+});
+
+function get(relPath: string, headers: { [name: string]: string } = {}) {
+    return serveFile(root, relPath, new Request("http://localhost/", { headers }));
+}
+
+async function body(response: Response) {
+    return Buffer.from(await response.arrayBuffer()).toString();
+}
+
+describe("serveFile", () => {
+    it("serves the whole file", async () => {
+        const response = await get("dump.pcap");
+        expect(response.status).toBe(200);
+        expect(response.headers.get("content-type")).toBe("application/vnd.tcpdump.pcap");
+        expect(response.headers.get("content-length")).toBe("16");
+        expect(response.headers.get("accept-ranges")).toBe("bytes");
+        expect(await body(response)).toBe(CONTENT.toString());
+    });
+
+    it("serves an empty file", async () => {
+        const response = await get("empty.pcap");
+        expect(response.status).toBe(200);
+        expect(response.headers.get("content-length")).toBe("0");
+        expect(await body(response)).toBe("");
+    });
+
+    it("serves a bounded range", async () => {
+        const response = await get("dump.pcap", { range: "bytes=2-5" });
+        expect(response.status).toBe(206);
+        expect(response.headers.get("content-range")).toBe("bytes 2-5/16");
+        expect(response.headers.get("content-length")).toBe("4");
+        expect(await body(response)).toBe("2345");
+    });
+
+    it("serves bytes=N- up to the end", async () => {
+        const response = await get("dump.pcap", { range: "bytes=10-" });
+        expect(response.status).toBe(206);
+        expect(response.headers.get("content-range")).toBe("bytes 10-15/16");
+        expect(await body(response)).toBe("abcdef");
+    });
+
+    it("serves the last N bytes with bytes=-N", async () => {
+        const response = await get("dump.pcap", { range: "bytes=-3" });
+        expect(response.status).toBe(206);
+        expect(response.headers.get("content-range")).toBe("bytes 13-15/16");
+        expect(await body(response)).toBe("def");
+    });
+
+    it("serves the whole file when the suffix is longer", async () => {
+        const response = await get("dump.pcap", { range: "bytes=-100" });
+        expect(response.status).toBe(206);
+        expect(response.headers.get("content-range")).toBe("bytes 0-15/16");
+        expect(await body(response)).toBe(CONTENT.toString());
+    });
+
+    it("clamps the end of a range to the file size", async () => {
+        const response = await get("dump.pcap", { range: "bytes=14-100" });
+        expect(response.status).toBe(206);
+        expect(response.headers.get("content-range")).toBe("bytes 14-15/16");
+        expect(await body(response)).toBe("ef");
+    });
+
+    it("rejects ranges starting past the end", async () => {
+        for (const range of ["bytes=16-", "bytes=100-200", "bytes=-0"]) {
+            const response = await get("dump.pcap", { range });
+            expect(response.status).toBe(416);
+            expect(response.headers.get("content-range")).toBe("bytes */16");
+        }
+    });
+
+    it("ignores multiple, invalid and unknown ranges", async () => {
+        for (const range of ["bytes=0-1,4-5", "bytes=5-2", "bytes=-", "items=0-1", "bytes=a-b"]) {
+            const response = await get("dump.pcap", { range });
+            expect(response.status).toBe(200);
+            expect(response.headers.get("content-range")).toBeNull();
+            expect(await body(response)).toBe(CONTENT.toString());
+        }
+    });
+
+    it("ignores the range when If-Range does not match", async () => {
+        const response = await get("dump.pcap", { "range": "bytes=0-1", "if-range": "\"stale\"" });
+        expect(response.status).toBe(200);
+        expect(await body(response)).toBe(CONTENT.toString());
+
+        const etag = (await get("dump.pcap")).headers.get("etag")!;
+        const ranged = await get("dump.pcap", { "range": "bytes=0-1", "if-range": etag });
+        expect(ranged.status).toBe(206);
+        expect(await body(ranged)).toBe("01");
+    });
+
+    it("answers conditional requests with 304", async () => {
+        const response = await get("dump.pcap");
+        const etag = response.headers.get("etag")!;
+        const lastModified = response.headers.get("last-modified")!;
+
+        expect((await get("dump.pcap", { "if-none-match": etag })).status).toBe(304);
+        expect((await get("dump.pcap", { "if-none-match": `"other", ${etag}` })).status).toBe(304);
+        expect((await get("dump.pcap", { "if-modified-since": lastModified })).status).toBe(304);
+        // If-None-Match takes precedence
+        expect((await get("dump.pcap", { "if-none-match": "\"other\"", "if-modified-since": lastModified })).status).toBe(200);
+    });
+
+    it("rejects paths outside of the root", async () => {
+        for (const relPath of ["../secret.txt", "sub/../../secret.txt", "../root2/dump.pcap", path.join(dir, "secret.txt"), "", "."]) {
+            await expect(get(relPath)).rejects.toMatchObject({ status: 404 });
+        }
+    });
+
+    it("rejects missing files and directories", async () => {
+        await expect(get("missing.pcap")).rejects.toMatchObject({ status: 404 });
+        await expect(get("sub")).rejects.toMatchObject({ status: 404 });
+    });
+});
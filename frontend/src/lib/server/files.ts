@@ -0,0 +1,95 @@
+import { error } from "@sveltejs/kit";
+import fs from "node:fs";
+import path from "node:path";
+import { Readable } from "node:stream";
+
+
+const CONTENT_TYPES: { [ext: string]: string } = {
+    ".pcap": "application/vnd.tcpdump.pcap",
+    ".pcapng": "application/vnd.tcpdump.pcap"
+};
+
+/**
+ * Stream a file from a directory, supporting HTTP Range, ETag and Last-Modified.
+ * The file is read by chunks, so large pcaps are neither buffered nor block the event loop.
+ * @param root Directory served.
+ * @param relPath Path of the file relative to `root`.
+ * @param request Incoming request, for conditional and range headers.
+ * @returns Response
+ */
+export async function serveFile(root: string, relPath: string, request: Request) {
+    const rootPath = path.resolve(root);
+    const filePath = path.resolve(rootPath, relPath);
+    if (!filePath.startsWith(rootPath + path.sep)) {
+        error(404);
+    }
+
+    let stat: fs.Stats;
+    try {
+        stat = await fs.promises.stat(filePath);
+    }
+    catch {
+        error(404);
+    }
+    if (!stat.isFile()) {
+        error(404);
+    }
+
+    const etag = `"${stat.size.toString(16)}-${Math.floor(stat.mtimeMs).toString(16)}"`;
+    const lastModified = stat.mtime.toUTCString();
+    const headers = new Headers({
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",
+        "Content-Type": CONTENT_TYPES[path.extname(filePath)] ?? "application/octet-stream",
+        "ETag": etag,
+        "Last-Modified": lastModified
+    });
+
+    // Conditional request, If-None-Match takes precedence over If-Modified-Since
+    const ifNoneMatch = request.headers.get("if-none-match");
+    const ifModifiedSince = request.headers.get("if-modified-since");
+    const notModified = ifNoneMatch !== null
+        ? ifNoneMatch.split(",").some((t) => t.trim() === etag || t.trim() === "*")
+        : ifModifiedSince !== null && Math.floor(stat.mtimeMs / 1000) <= Math.floor(Date.parse(ifModifiedSince) / 1000);
+    if (notModified) {
+        return new Response(null, { status: 304, headers });
+    }
+
+    let start = 0;
+    let end = stat.size - 1;
+    let status = 200;
+
+    // Single byte range, ignored if If-Range does not match the current file
+    const range = request.headers.get("range");
+    const ifRange = request.headers.get("if-range");
+    if (range !== null && (ifRange === null || ifRange === etag || ifRange === lastModified)) {
+        const match = /^bytes=(\d*)-(\d*)$/.exec(range.trim());
+        // Multiple ranges and invalid ones, such as "bytes=5-2", are ignored
+        const valid = match !== null && (match[1] !== "" || match[2] !== "")
+            && (match[1] === "" || match[2] === "" || Number(match[1]) <= Number(match[2]));
+        if (valid) {
+            if (match[1] === "") {
+                start = Math.max(0, stat.size - Number(match[2]));
+            }
+            else {
+                start = Number(match[1]);
+                end = match[2] !== "" ? Math.min(Number(match[2]), stat.size - 1) : stat.size - 1;
+            }
+
+            if (start > end || start >= stat.size) {
+                headers.set("Content-Range", `bytes */${stat.size}`);
+                return new Response(null, { status: 416, headers });
+            }
+            status = 206;
+            headers.set("Content-Range", `bytes ${start}-${end}/${stat.size}`);
+        }
+    }
+
+    headers.set("Content-Length", String(Math.max(0, end - start + 1)));
+    if (stat.size === 0) {
+        return new Response(null, { status, headers });
+    }
+
+    const stream = fs.createReadStream(filePath, { start, end });
+    return new Response(Readable.toWeb(stream) as ReadableStream, { status, headers });
+}
@@ -0,0 +1,185 @@
+import type { FlowsListFilters } from "$lib/schema";
+import { CTF_CONFIG } from "$lib/server/config";
+import { Prisma } from "../../generated/prisma/client";
+
+
+// Writers commit batches concurrently, so `seq` values may become visible out of order.
+// A "since" cursor holds the last visible `seq` and the transactions still running when it was read:
+// only their flows can become visible below it, they are looked up by the `xid` that wrote them.
+
+// Cursor of the flows written after a `flowsListSeqQuery` result.
+export type FlowsListSince = {
+    seq: bigint,
+    // Ids of the transactions running at that point
+    running: bigint[]
+};
+
+export type FlowsListCursor = {
+    before?: { ts_start: bigint, id: bigint },
+    since?: FlowsListSince,
+    late?: FlowsListSince
+};
+
+export type FlowsListRow = {
+    id: bigint,
+    ts_start: bigint,
+    ts_end: bigint,
+    dest_ip: string,
+    dest_port: number | null,
+    dest_ipport: string | null,
+    app_proto: string | null,
+    metadata: any,
+    alerts: { tag: string }[]
+};
+
+/**
+ * Build the SQL condition matching the flows list filters.
+ * Payload search is narrowed by the trigram index on `raw` first, then joined to `flow`.
+ * @param filters Parsed flows list filters.
+ * @returns Prisma.Sql
+ */
+export function flowsListWhere(filters: FlowsListFilters) {
+    const { ts_to, app_proto, search, tags_require, tags_deny } = filters;
+    let services = filters.services;
+
+    let conditions = [Prisma.sql`f.ts_start <= ${BigInt(ts_to)}`];
+
+    if (app_proto !== undefined) {
+        conditions.push(Prisma.sql`f.app_proto = ${app_proto}`);
+    }
+
+    if (services) {
+        if (services.length === 0) {
+            // Filter flows related to no services
+            services = [];
+            for (const s of Object.values(CTF_CONFIG.services)) {
+                for (const ipp of s.ipports) {
+                    services.push(`${ipp.ip}:${ipp.port}`);
+                }
+            }
+            if (services.length > 0) {
+                const ipports = Prisma.join(services);
+                conditions.push(Prisma.sql`NOT (f.src_ipport IN (${ipports}) OR f.dest_ipport IN (${ipports}))`);
+            }
+        }
+        else {
+            const ipports = Prisma.join(services);
+            conditions.push(Prisma.sql`(f.src_ipport IN (${ipports}) OR f.dest_ipport IN (${ipports}))`);
+        }
+    }
+
+    if (tags_deny.length > 0) {
+        conditions.push(Prisma.sql`NOT EXISTS (SELECT 1 FROM alert a WHERE a.flow_id = f.id AND a.tag IN (${Prisma.join(tags_deny)}))`);
+    }
+
+    if (tags_require.length > 0) {
+        conditions.push(Prisma.sql`EXISTS (SELECT 1 FROM alert a WHERE a.flow_id = f.id AND a.tag IN (${Prisma.join(tags_require)}))`);
+    }
+
+    if (search) {
+        conditions.push(Prisma.sql`f.id IN (SELECT flow_id FROM search_match)`);
+    }
+
+    return Prisma.join(conditions, " AND ");
+}
+
+/**
+ * Build the flows list query, newest flows first.
+ * `cursor.before` returns the page following a flow, `cursor.since` only the flows written after a `flowsListSeqQuery` result,
+ * `cursor.late` the flows of its running transactions, see `flowsListLateQuery`.
+ * @param filters Parsed flows list filters.
+ * @param cursor Optional keyset cursor.
+ * @param limit Maximum number of flows returned, `null` for all.
+ * @returns Prisma.Sql
+ */
+export function flowsListQuery(filters: FlowsListFilters, cursor: FlowsListCursor = {}, limit: number | null = 100) {
+    // MATERIALIZED keeps the planner from probing the regex flow by flow.
+    // The regex runs once per distinct chunk, then on payloads written before deduplication.
+    const searchMatch = filters.search
+        ? Prisma.sql`WITH search_match AS MATERIALIZED (
+            SELECT flow_id FROM raw WHERE blob_hash IN (
+                SELECT hash FROM raw_blob WHERE ENCODE("blob", 'escape') ~ ${filters.search}
+            )
+            UNION
+            SELECT flow_id FROM raw WHERE ENCODE("blob", 'escape') ~ ${filters.search}
+        )`
+        : Prisma.empty;
+
+    return Prisma.sql`${searchMatch}
+        SELECT f.id, f.ts_start, f.ts_end, f.dest_ip, f.dest_port, f.dest_ipport, f.app_proto, f.metadata,
+            COALESCE((SELECT json_agg(json_build_object('tag', a.tag)) FROM alert a WHERE a.flow_id = f.id), '[]') AS alerts
+        FROM flow f
+        WHERE ${flowsListWhere(filters)}${flowsListCursorWhere(cursor)}
+        ORDER BY f.ts_start DESC, f.id DESC
+        ${limit === null ? Prisma.empty : Prisma.sql`LIMIT ${limit}`}`;
+}
+
+/**
+ * Build the query of the flows committed after `since` was read, although their `seq` is below it.
+ * They are not counted in the page of new flows, there are at most a few batches of them.
+ * @param filters Parsed flows list filters.
+ * @param since Cursor of the previous request.
+ * @returns Prisma.Sql, or `undefined` if no flow was being written.
+ */
+export function flowsListLateQuery(filters: FlowsListFilters, since: FlowsListSince) {
+    return since.running.length > 0 ? flowsListQuery(filters, { late: since }, null) : undefined;
+}
+
+function flowsListCursorWhere({ before, since, late }: FlowsListCursor) {
+    let conditions = [];
+    if (before) {
+        // The plain bound lets PostgreSQL skip the partitions of newer hours
+        conditions.push(Prisma.sql` AND (f.ts_start, f.id) < (${before.ts_start}, ${before.id}) AND f.ts_start <= ${before.ts_start}`);
+    }
+    if (since !== undefined) {
+        conditions.push(Prisma.sql` AND f.seq > ${since.seq}`);
+    }
+    if (late !== undefined) {
+        conditions.push(Prisma.sql` AND f.xid IN (${Prisma.join(late.running)}) AND f.seq <= ${late.seq}`);
+    }
+    return conditions.length > 0 ? Prisma.join(conditions, "") : Prisma.empty;
+}
+
+/**
+ * Convert flows list rows to JSON values, 64-bit integers are sent as strings.
+ * @param flows Rows returned by `flowsListQuery`.
+ * @returns Flows list rows with string ids and timestamps.
+ */
+export function flowsListJson(flows: FlowsListRow[]) {
+    return flows.map((f) => ({
+        ...f,
+        id: f.id.toString(),
+        ts_start: f.ts_start?.toString(),
+        ts_end: f.ts_end?.toString()
+    }));
+}
+
+/**
+ * Build the query returning the next `since` cursor: the last visible flow sequence value,
+ * and the transactions running in the same snapshot.
+ * @returns Prisma.Sql, returning one `FlowsListSince` row.
+ */
+export function flowsListSeqQuery() {
+    return Prisma.sql`SELECT COALESCE(MAX(seq), 0) AS seq,
+        ARRAY(SELECT x::text::bigint FROM pg_snapshot_xip(pg_current_snapshot()) x) AS running
+        FROM flow`;
+}
+
+/**
+ * Format a cursor as sent to clients, `<seq>` or `<seq>:<xid>,<xid>...`.
+ * @param since Cursor.
+ * @returns string
+ */
+export function formatSince({ seq, running }: FlowsListSince) {
+    return running.length > 0 ? `${seq}:${running.join(",")}` : seq.toString();
+}
+
+/**
+ * Parse a cursor formatted by `formatSince`, validated by `flowsListCursor`.
+ * @param since Cursor as sent by clients.
+ * @returns FlowsListSince
+ */
+export function parseSince(since: string): FlowsListSince {
+    const [seq, running] = since.split(":");
+    return { seq: BigInt(seq), running: running ? running.split(",").map((x) => BigInt(x)) : [] };
+}
@@ -0,0 +1,131 @@
+import type { FlowsListFilters } from "$lib/schema";
+import { flowsListJson, flowsListLateQuery, flowsListQuery, flowsListSeqQuery, formatSince, type FlowsListRow, type FlowsListSince } from "$lib/server/flows";
+import prisma from "$lib/server/prisma";
+import { env } from "$env/dynamic/private";
+
+
+// Delay between two checks of `flow_seq_seq`, in milliseconds.
+const LIVE_CHECK_INTERVAL = Number(env.LIVE_CHECK_INTERVAL ?? 250);
+// Checks between two keep-alive comments, proxies close idle streams.
+const LIVE_KEEPALIVE_CHECKS = Math.ceil(15000 / LIVE_CHECK_INTERVAL);
+// New flows read per push, flows committed late below the cursor come on top, see `flowsListLateQuery`.
+const LIVE_QUERY_LIMIT = 1000;
+// Minimum delay between two pushes with a payload search, which scans every payload, in milliseconds.
+const LIVE_SEARCH_INTERVAL = Number(env.LIVE_SEARCH_INTERVAL ?? 5000);
+// Flow ids remembered per client to skip flows already pushed.
+const LIVE_SEEN_SIZE = 20000;
+
+export type LiveFlows = {
+    flows: ReturnType<typeof flowsListJson>,
+    late: ReturnType<typeof flowsListJson>,
+    since: string
+};
+
+type Subscriber = {
+    filters: FlowsListFilters,
+    // Filters as JSON, subscribers with the same filters and cursor share one query
+    key: string,
+    since: FlowsListSince | undefined,
+    seen: Set<bigint>,
+    // `flow_seq_seq` state of the last push
+    version: string | undefined,
+    pushedAt: number,
+    send: (update: LiveFlows | undefined) => void
+};
+
+const subscribers = new Set<Subscriber>();
+let timer: NodeJS.Timeout | undefined;
+let checks = 0;
+
+/**
+ * Push the flows matching `filters` to `send` as soon as they are written.
+ * One shared loop checks the `flow_seq_seq` sequence for every client, and the flows list
+ * query runs once per distinct filters and cursor when it moves. `send` is called without
+ * update every 15 seconds, to keep the stream open.
+ * @param filters Parsed flows list filters.
+ * @param since Cursor the client already has, the current one if undefined.
+ * @param send Callback receiving new flows and the next cursor.
+ * @returns Function cancelling the subscription.
+ */
+export function subscribeFlows(filters: FlowsListFilters, since: FlowsListSince | undefined, send: (update: LiveFlows | undefined) => void) {
+    const subscriber: Subscriber = { filters, key: JSON.stringify(filters), since, seen: new Set<bigint>(), version: undefined, pushedAt: 0, send };
+    subscribers.add(subscriber);
+    timer ??= setTimeout(checkFlows, 0);
+
+    return () => {
+        subscribers.delete(subscriber);
+    };
+}
+
+async function checkFlows() {
+    try {
+        // The sequence moves on every flow insert, reading it costs the same with thousands of flows
+        const [{ version }] = await prisma.$queryRaw<{ version: string }[]>`SELECT last_value::text || is_called::text AS version FROM flow_seq_seq`;
+        if ([...subscribers].some((s) => s.version !== version || s.since?.running.length)) {
+            await pushFlows(version);
+        }
+        if (++checks % LIVE_KEEPALIVE_CHECKS === 0) {
+            subscribers.forEach((s) => s.send(undefined));
+        }
+    }
+    catch (e) {
+        console.error("Failed to check new flows:", e);
+    }
+
+    timer = subscribers.size > 0 ? setTimeout(checkFlows, LIVE_CHECK_INTERVAL) : undefined;
+}
+
+async function pushFlows(version: string) {
+    const now = Date.now();
+    const groups = new Map<string, Subscriber[]>();
+    for (const s of subscribers) {
+        // Flows of transactions running at the last push may commit without moving the sequence
+        if (s.version === version && !s.since?.running.length || s.filters.search && s.since !== undefined && now - s.pushedAt < LIVE_SEARCH_INTERVAL) {
+            continue;
+        }
+        const key = `${s.since ? formatSince(s.since) : ""}|${s.key}`;
+        groups.set(key, [...(groups.get(key) ?? []), s]);
+    }
+    if (groups.size === 0) {
+        return;
+    }
+
+    // Read the next cursor first, flows written meanwhile are returned again by the next push
+    const [next] = await prisma.$queryRaw<FlowsListSince[]>(flowsListSeqQuery());
+    for (const group of groups.values()) {
+        const { filters, since } = group[0];
+        let flows: FlowsListRow[] = [];
+        let late: FlowsListRow[] = [];
+        if (since !== undefined) {
+            try {
+                flows = await prisma.$queryRaw<FlowsListRow[]>(flowsListQuery(filters, { since }, LIVE_QUERY_LIMIT));
+                const lateQuery = flowsListLateQuery(filters, since);
+                if (lateQuery) {
+                    late = await prisma.$queryRaw<FlowsListRow[]>(lateQuery);
+                }
+            }
+            catch (e) {
+                // e.g. an invalid search regular expression, retried on the next flows only
+                console.error("Failed to query new flows:", e);
+                group.forEach((s) => s.version = version);
+                continue;
+            }
+        }
+
+        for (const s of group) {
+            s.since = next;
+            s.version = version;
+            s.pushedAt = now;
+            // Flows committed between the cursor and the query are read again by the next push
+            const unseen = flows.filter((f) => !s.seen.has(f.id));
+            const unseenLate = late.filter((f) => !s.seen.has(f.id));
+            if (s.seen.size + unseen.length + unseenLate.length > LIVE_SEEN_SIZE) {
+                s.seen.clear();
+            }
+            unseen.concat(unseenLate).forEach((f) => s.seen.add(f.id));
+            if (unseen.length + unseenLate.length > 0) {
+                s.send({ flows: flowsListJson(unseen), late: flowsListJson(unseenLate), since: formatSince(next) });
+            }
+        }
+    }
+}
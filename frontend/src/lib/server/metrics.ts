@@ -0,0 +1,117 @@
+// Upper bounds of the latency histogram buckets, in seconds.
+const LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30];
+
+type Histogram = {
+    labels: { [name: string]: string },
+    // Observations per bucket, not cumulative
+    buckets: number[],
+    sum: number,
+    count: number
+};
+
+// Counters published by ingestion processes, see the `ingest_stats` table
+export type IngestStatsRow = {
+    source: string,
+    stats: { [name: string]: number },
+    age: number
+};
+
+const requestLatency = new Map<string, Histogram>();
+const queryLatency = new Map<string, Histogram>();
+
+function observe(histograms: Map<string, Histogram>, labels: { [name: string]: string }, seconds: number) {
+    const key = JSON.stringify(labels);
+    let histogram = histograms.get(key);
+    if (!histogram) {
+        histogram = { labels, buckets: LATENCY_BUCKETS.map(() => 0), sum: 0, count: 0 };
+        histograms.set(key, histogram);
+    }
+
+    const bucket = LATENCY_BUCKETS.findIndex((le) => seconds <= le);
+    if (bucket >= 0) {
+        histogram.buckets[bucket] += 1;
+    }
+    histogram.sum += seconds;
+    histogram.count += 1;
+}
+
+/**
+ * Record the latency of one request, up to its response headers for streamed responses.
+ * @param route Route id, e.g. `/api/flow/[flow=flowId]`, so that flows share one histogram.
+ * @param method HTTP method.
+ * @param status Response status code.
+ * @param seconds Latency in seconds.
+ */
+export function observeRequest(route: string, method: string, status: number, seconds: number) {
+    observe(requestLatency, { route, method, status: String(status) }, seconds);
+}
+
+/**
+ * Record the duration of one database query, including the wait for a pooled connection.
+ * @param model Prisma model, or `raw` for raw SQL queries.
+ * @param operation Prisma operation, e.g. `findMany` or `$queryRaw`.
+ * @param seconds Duration in seconds.
+ */
+export function observeQuery(model: string, operation: string, seconds: number) {
+    observe(queryLatency, { model, operation }, seconds);
+}
+
+function formatLabels(labels: { [name: string]: string }) {
+    const pairs = Object.entries(labels).map(([name, value]) => `${name}="${value.replace(/[\\"\n]/g, (c) => c === "\n" ? "\\n" : `\\${c}`)}"`);
+    return `{${pairs.join(",")}}`;
+}
+
+function renderHistogram(name: string, help: string, histograms: Iterable<Histogram>) {
+    let lines = [`# HELP ${name} ${help}`, `# TYPE ${name} histogram`];
+    for (const h of histograms) {
+        let cumulative = 0;
+        LATENCY_BUCKETS.forEach((le, i) => {
+            cumulative += h.buckets[i];
+            lines.push(`${name}_bucket${formatLabels({ ...h.labels, le: String(le) })} ${cumulative}`);
+        });
+        lines.push(`${name}_bucket${formatLabels({ ...h.labels, le: "+Inf" })} ${h.count}`);
+        lines.push(`${name}_sum${formatLabels(h.labels)} ${h.sum}`);
+        lines.push(`${name}_count${formatLabels(h.labels)} ${h.count}`);
+    }
+    return lines.join("\n");
+}
+
+function renderIngestStats(rows: IngestStatsRow[]) {
+    // Payload writers only, the EVE output serves its own metrics on `EVE_METRICS_ADDR`.
+    // Rows are published by the payload loaders, one per writer and shard whatever the packet threads.
+    const payloadMetrics: [string, string, string, string][] = [
+        ["chunks", "shovel_payload_chunks_total", "counter", "Payload chunks written."],
+        ["bytes", "shovel_payload_bytes_total", "counter", "Payload bytes written."],
+        ["batches", "shovel_payload_batches_total", "counter", "Payload batches written."],
+        ["errors", "shovel_payload_errors_total", "counter", "Payload batches that failed to be written."],
+        ["pending", "shovel_payload_pending_chunks", "gauge", "Payload chunks waiting in the spool."]
+    ];
+    const writers = rows.filter((row) => row.source.startsWith("payload-"));
+
+    let lines = [];
+    for (const [field, name, type, help] of payloadMetrics) {
+        lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`);
+        for (const row of writers) {
+            lines.push(`${name}${formatLabels({ writer: row.source })} ${row.stats[field] ?? 0}`);
+        }
+    }
+    lines.push("# HELP shovel_ingest_stats_age_seconds Time since an ingestion process last published its counters.");
+    lines.push("# TYPE shovel_ingest_stats_age_seconds gauge");
+    for (const row of rows) {
+        lines.push(`shovel_ingest_stats_age_seconds${formatLabels({ source: row.source })} ${row.age}`);
+    }
+    return lines.join("\n");
+}
+
+/**
+ * Render metrics in the Prometheus text exposition format.
+ * @param ingestStats Rows of the `ingest_stats` table.
+ * @returns Metrics text
+ */
+export function renderMetrics(ingestStats: IngestStatsRow[]) {
+    return [
+        renderHistogram("shovel_http_request_duration_seconds", "Latency of HTTP requests per route.", requestLatency.values()),
+        renderHistogram("shovel_db_query_duration_seconds", "Duration of database queries per Prisma model and operation.", queryLatency.values()),
+        renderIngestStats(ingestStats)
+    ].join("\n") + "\n";
+}
@@ -0,0 +1,270 @@
+import fs from "node:fs";
+import os from "node:os";
+import path from "node:path";
+import zlib from "node:zlib";
+import { afterAll, beforeAll, describe, expect, it, vi } from "vitest";
+import { extractFlowPcap, listPcapFiles } from "./pcap";
+
+vi.mock("$env/dynamic/private", () => ({ env: {} }));
+
+type TestPacket = { ts: number, data: Buffer };
+
+const A = { src: "10.0.0.1", dst: "10.0.0.2", sport: 40000, dport: 8080 };
+const B = { src: "10.0.0.3", dst: "10.0.0.2", sport: 40001, dport: 8080 };
+const T0 = 1700000000 * 1000000;
+
+let dir: string;
+
+beforeAll(async () => {
+    dir = await fs.promises.mkdtemp(path.join(os.tmpdir(), "pcap-spec-"));
+});
+
+afterAll(async () => {
+    await fs.promises.rm(dir, { recursive: true, force: true });
+});
+
+/**
+ * Ethernet, IPv4 and TCP headers followed by `payload`.
+ */
+function tcpPacket(src: string, dst: string, sport: number, dport: number, payload = "") {
+    const data = Buffer.alloc(14 + 20 + 20 + payload.length);
+    data.writeUInt16BE(0x0800, 12);
+    data[14] = 0x45;
+    data.writeUInt16BE(40 + payload.length, 16);
+    data[14 + 8] = 64;
+    data[14 + 9] = 6;
+    Buffer.from(src.split(".").map(Number)).copy(data, 14 + 12);
+    Buffer.from(dst.split(".").map(Number)).copy(data, 14 + 16);
+    data.writeUInt16BE(sport, 34);
+    data.writeUInt16BE(dport, 36);
+    data.write(payload, 54, "latin1");
+    return data;
+}
+
+function flowPackets(flow: typeof A, ts: number, count: number) {
+    const packets: TestPacket[] = [];
+    for (let i = 0; i < count; i++) {
+        packets.push(i % 2 === 0
+            ? { ts: ts + i * 1000, data: tcpPacket(flow.src, flow.dst, flow.sport, flow.dport, `c${i}`) }
+            : { ts: ts + i * 1000, data: tcpPacket(flow.dst, flow.src, flow.dport, flow.sport, `s${i}`) });
+    }
+    return packets;
+}
+
+function classicPcap(packets: TestPacket[], nanos = false) {
+    const header = Buffer.alloc(24);
+    header.writeUInt32LE(nanos ? 0xa1b23c4d : 0xa1b2c3d4, 0);
+    header.writeUInt16LE(2, 4);
+    header.writeUInt16LE(4, 6);
+    header.writeUInt32LE(65535, 16);
+    header.writeUInt32LE(1, 20);
+    const records = packets.map((p) => {
+        const record = Buffer.alloc(16);
+        record.writeUInt32LE(Math.floor(p.ts / 1000000), 0);
+        record.writeUInt32LE(nanos ? (p.ts % 1000000) * 1000 : p.ts % 1000000, 4);
+        record.writeUInt32LE(p.data.length, 8);
+        record.writeUInt32LE(p.data.length, 12);
+        return Buffer.concat([record, p.data]);
+    });
+    return Buffer.concat([header, ...records]);
+}
+
+/**
+ * pcapng file with one Ethernet interface, timestamps in nanoseconds.
+ */
+function pcapng(packets: TestPacket[]) {
+    const shb = Buffer.alloc(28);
+    shb.writeUInt32LE(0x0a0d0d0a, 0);
+    shb.writeUInt32LE(28, 4);
+    shb.writeUInt32LE(0x1a2b3c4d, 8);
+    shb.writeUInt16LE(1, 12);
+    shb.writeInt32LE(-1, 16);
+    shb.writeInt32LE(-1, 20);
+    shb.writeUInt32LE(28, 24);
+
+    // if_tsresol = 9, then opt_endofopt
+    const idb = Buffer.alloc(32);
+    idb.writeUInt32LE(1, 0);
+    idb.writeUInt32LE(32, 4);
+    idb.writeUInt16LE(1, 8);
+    idb.writeUInt32LE(65535, 12);
+    idb.writeUInt16LE(9, 16);
+    idb.writeUInt16LE(1, 18);
+    idb[20] = 9;
+    idb.writeUInt32LE(32, 28);
+
+    const epbs = packets.map((p) => {
+        const padded = Math.ceil(p.data.length / 4) * 4;
+        const epb = Buffer.alloc(32 + padded);
+        const ticks = BigInt(p.ts) * 1000n;
+        epb.writeUInt32LE(6, 0);
+        epb.writeUInt32LE(epb.length, 4);
+        epb.writeUInt32LE(0, 8);
+        epb.writeUInt32LE(Number(ticks >> 32n), 12);
+        epb.writeUInt32LE(Number(ticks & 0xffffffffn), 16);
+        epb.writeUInt32LE(p.data.length, 20);
+        epb.writeUInt32LE(p.data.length, 24);
+        p.data.copy(epb, 28);
+        epb.writeUInt32LE(epb.length, epb.length - 4);
+        return epb;
+    });
+    return Buffer.concat([shb, idb, ...epbs]);
+}
+
+/**
+ * Records of a classic pcap file written by `extractFlowPcap`.
+ */
+function readPcap(buf: Buffer) {
+    expect(buf.readUInt32LE(0)).toBe(0xa1b2c3d4);
+    const packets: TestPacket[] = [];
+    let o = 24;
+    while (o < buf.length) {
+        const capLen = buf.readUInt32LE(o + 8);
+        packets.push({
+            ts: buf.readUInt32LE(o) * 1000000 + buf.readUInt32LE(o + 4),
+            data: buf.subarray(o + 16, o + 16 + capLen)
+        });
+        o += 16 + capLen;
+    }
+    expect(o).toBe(buf.length);
+    return { linktype: buf.readUInt32LE(20), packets };
+}
+
+async function writeFile(name: string, content: Buffer) {
+    const file = path.join(dir, name);
+    await fs.promises.writeFile(file, content);
+    return file;
+}
+
+async function extract(files: string[], flow: typeof A, tsStart = T0, tsEnd = T0 + 1000000) {
+    const chunks: Buffer[] = [];
+    for await (const chunk of extractFlowPcap(files, {
+        proto: "TCP",
+        src_ip: flow.src,
+        src_port: flow.sport,
+        dest_ip: flow.dst,
+        dest_port: flow.dport,
+        ts_start: BigInt(tsStart),
+        ts_end: BigInt(tsEnd)
+    })) {
+        chunks.push(chunk);
+    }
+    return chunks.length > 0 ? readPcap(Buffer.concat(chunks)) : undefined;
+}
+
+function interleave(a: TestPacket[], b: TestPacket[]) {
+    return a.concat(b).sort((x, y) => x.ts - y.ts);
+}
+
+describe("extractFlowPcap", () => {
+    it("extracts both directions of a flow from a classic pcap", async () => {
+        const a = flowPackets(A, T0, 6);
+        const file = await writeFile("classic.pcap", classicPcap(interleave(a, flowPackets(B, T0 + 500, 6))));
+
+        const pcap = await extract([file], A);
+        expect(pcap?.linktype).toBe(1);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(a.map((p) => p.ts));
+        expect(pcap?.packets.map((p) => p.data)).toEqual(a.map((p) => p.data));
+    });
+
+    it("converts nanosecond timestamps", async () => {
+        const a = flowPackets(A, T0 + 123, 3);
+        const file = await writeFile("nanos.pcap", classicPcap(a, true));
+
+        const pcap = await extract([file], A);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(a.map((p) => p.ts));
+    });
+
+    it("reads pcapng enhanced packet blocks", async () => {
+        const b = flowPackets(B, T0 + 7, 5);
+        const file = await writeFile("capture.pcapng", pcapng(interleave(flowPackets(A, T0, 4), b)));
+
+        const pcap = await extract([file], B);
+        expect(pcap?.linktype).toBe(1);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(b.map((p) => p.ts));
+        expect(pcap?.packets.map((p) => p.data)).toEqual(b.map((p) => p.data));
+    });
+
+    it("skips a truncated trailing record, then reads it once complete", async () => {
+        const a = flowPackets(A, T0, 4);
+        const content = classicPcap(a);
+        const file = await writeFile("growing.pcap", content.subarray(0, content.length - 10));
+
+        const partial = await extract([file], A);
+        expect(partial?.packets.map((p) => p.ts)).toEqual(a.slice(0, 3).map((p) => p.ts));
+
+        await fs.promises.appendFile(file, content.subarray(content.length - 10));
+        const complete = await extract([file], A);
+        expect(complete?.packets.map((p) => p.ts)).toEqual(a.map((p) => p.ts));
+    });
+
+    it("concatenates the packets of several files in order", async () => {
+        const a = flowPackets(A, T0, 6);
+        const first = await writeFile("segment-1.pcap", classicPcap(a.slice(0, 3)));
+        const second = await writeFile("segment-2.pcapng", pcapng(a.slice(3)));
+
+        const pcap = await extract([first, second], A);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(a.map((p) => p.ts));
+    });
+
+    it("only keeps packets in the flow time range", async () => {
+        const before = flowPackets(A, T0 - 5000000, 2);
+        const during = flowPackets(A, T0, 2);
+        const file = await writeFile("reused-ports.pcap", classicPcap(before.concat(during)));
+
+        const pcap = await extract([file], A);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(during.map((p) => p.ts));
+    });
+
+    it.runIf("zstdCompressSync" in zlib)("reads zstd compressed segments", async () => {
+        const a = flowPackets(A, T0, 6);
+        const packets = interleave(a, flowPackets(B, T0 + 500, 6));
+        const plain = await writeFile("compressed.pcap", classicPcap(packets));
+        const compressed = await writeFile("compressed.pcapng.zst", zlib.zstdCompressSync(pcapng(packets)));
+
+        const pcap = await extract([plain, compressed], A);
+        expect(pcap?.packets.map((p) => p.ts)).toEqual(a.concat(a).map((p) => p.ts));
+    });
+
+    it("keeps the index of a segment renamed when closed", async () => {
+        const a = flowPackets(A, T0, 4);
+        const live = await writeFile("live.pcap", classicPcap(a));
+        expect((await extract([live], A))?.packets).toHaveLength(4);
+
+        const closed = path.join(dir, "closed.pcap");
+        await fs.promises.rename(live, closed);
+        expect((await extract([closed], A))?.packets).toHaveLength(4);
+    });
+
+    it("returns nothing when the flow is not captured", async () => {
+        const file = await writeFile("other.pcap", classicPcap(flowPackets(B, T0, 4)));
+        expect(await extract([file], A)).toBeUndefined();
+    });
+
+    it("ignores files that are not captures", async () => {
+        const file = await writeFile("garbage.pcap", Buffer.from("not a capture file at all"));
+        expect(await extract([file], A)).toBeUndefined();
+    });
+});
+
+describe("listPcapFiles", () => {
+    it("lists capture files by name", async () => {
+        const sub = await fs.promises.mkdtemp(path.join(dir, "list-"));
+        for (const name of ["b.pcapng", "a.pcap", "c.cap", "d.pcap.zst", "notes.txt", "notes.txt.zst"]) {
+            await fs.promises.writeFile(path.join(sub, name), "");
+        }
+        expect(await listPcapFiles(sub)).toEqual(["a.pcap", "b.pcapng", "c.cap", "d.pcap.zst"].map((name) => path.join(sub, name)));
+    });
+
+    it("lists a segment being compressed once", async () => {
+        const sub = await fs.promises.mkdtemp(path.join(dir, "list-"));
+        for (const name of ["a.pcap", "a.pcap.zst", "b.pcap.zst"]) {
+            await fs.promises.writeFile(path.join(sub, name), "");
+        }
+        expect(await listPcapFiles(sub)).toEqual(["a.pcap", "b.pcap.zst"].map((name) => path.join(sub, name)));
+    });
+
+    it("returns an empty list for a missing directory", async () => {
+        expect(await listPcapFiles(path.join(dir, "missing"))).toEqual([]);
+    });
+});
@@ -0,0 +1,698 @@
+import { env } from "$env/dynamic/private";
+import fs from "node:fs";
+import path from "node:path";
+import zlib from "node:zlib";
+
+
+// Packets per index block, each block keeps its time range and the flows it contains.
+const BLOCK_PACKETS = 2048;
+// Bytes read from disk at once.
+const READ_SIZE = 4 * 1024 * 1024;
+// Packets around the flow start and end timestamps, in microseconds.
+const TIME_SLACK = 1000000;
+// Largest pcap record or pcapng block accepted, anything bigger is considered corrupted.
+const MAX_RECORD_SIZE = 256 * 1024 * 1024;
+
+const PCAP_FILE_EXT = [".pcap", ".pcapng", ".cap"];
+// Closed segments compressed by the tshark container with `PCAP_COMPRESS=zstd`, see tshark/init.sh.
+const ZSTD_EXT = ".zst";
+
+// Captures written by the tshark container in mode C, see docker-compose-c.yml.
+export const PCAP_DUMPS_DIR = env.PCAP_DUMPS_DIR ?? "../tshark_dumps";
+// Interval between index updates of the captures in `PCAP_DUMPS_DIR`, in milliseconds.
+const PCAP_INDEX_INTERVAL = Number(env.PCAP_INDEX_INTERVAL ?? 5000);
+
+const IP_PROTOCOLS: { [proto: string]: number } = {
+    "TCP": 6,
+    "UDP": 17,
+    "ICMP": 1,
+    "IPv6-ICMP": 58,
+    "SCTP": 132
+};
+
+type Iface = {
+    linktype: number,
+    // Timestamp units per second
+    tsUnits: bigint
+};
+
+// Parser state at a given offset, pcapng sections and interfaces may change along the file.
+type ParseState = {
+    format: "pcap" | "pcapng",
+    le: boolean,
+    // Classic pcap only
+    linktype: number,
+    nanos: boolean,
+    // pcapng only
+    ifaces: Iface[]
+};
+
+type Block = {
+    offset: number,
+    end: number,
+    tsMin: number,
+    tsMax: number,
+    // Sorted hashes of the flows seen in this block
+    keys: Uint32Array,
+    state: ParseState
+};
+
+type FileIndex = {
+    // Last path of the file, segments are renamed when closed
+    path: string,
+    // File size when last indexed
+    size: number,
+    // Offset of the first record not indexed yet, in the decompressed stream for compressed files
+    scanned: number,
+    state: ParseState | undefined,
+    blocks: Block[],
+    // Last block is incomplete and is rebuilt on the next update
+    lastOpen: boolean
+};
+
+type Packet = {
+    ts: number,
+    linktype: number,
+    data: Buffer,
+    origLen: number
+};
+
+export type FlowTuple = {
+    proto: string,
+    src_ip: string,
+    src_port: number | null,
+    dest_ip: string,
+    dest_port: number | null,
+    ts_start: bigint,
+    ts_end: bigint
+};
+
+// Indexes are kept in memory only, about 8 bytes per flow and packet block. After a restart,
+// `watchPcapDir` rebuilds them in background by reading every capture once, sequentially,
+// the first extractions from a file not indexed yet wait for its scan.
+// Indexes are keyed by device and inode, so that closing a segment, which renames it, keeps its index.
+const indexes = new Map<string, FileIndex>();
+const updating = new Map<string, Promise<FileIndex>>();
+
+type Reader = {
+    get(offset: number, length: number): Promise<Buffer | undefined>,
+    close(): Promise<void>
+};
+
+class FileReader implements Reader {
+    private buf = Buffer.alloc(0);
+    private bufStart = 0;
+
+    constructor(private fh: fs.promises.FileHandle, readonly size: number) {}
+
+    /**
+     * Read `length` bytes at `offset`, or undefined past the end of file.
+     * Returned buffers stay valid after the next reads.
+     */
+    async get(offset: number, length: number) {
+        if (offset + length > this.size) {
+            return undefined;
+        }
+        if (offset >= this.bufStart && offset + length <= this.bufStart + this.buf.length) {
+            return this.buf.subarray(offset - this.bufStart, offset - this.bufStart + length);
+        }
+
+        const readLength = Math.min(Math.max(length, READ_SIZE), this.size - offset);
+        const buf = Buffer.allocUnsafe(readLength);
+        const { bytesRead } = await this.fh.read(buf, 0, readLength, offset);
+        this.buf = buf.subarray(0, bytesRead);
+        this.bufStart = offset;
+        if (bytesRead < length) {
+            return undefined;
+        }
+        return this.buf.subarray(0, length);
+    }
+
+    async close() {
+        await this.fh.close();
+    }
+}
+
+/**
+ * Reader of a zstd compressed capture, offsets are in the decompressed stream.
+ * Compressed files cannot be read at random: reads go forward only, and the bytes
+ * before the last read offset are dropped.
+ */
+class ZstdReader implements Reader {
+    private buf = Buffer.alloc(0);
+    private bufStart = 0;
+    private file: fs.ReadStream;
+    private chunks: AsyncIterator<Buffer>;
+
+    constructor(filePath: string) {
+        this.file = fs.createReadStream(filePath, { highWaterMark: READ_SIZE });
+        this.chunks = this.file.pipe(zlib.createZstdDecompress())[Symbol.asyncIterator]();
+    }
+
+    /**
+     * Read `length` bytes at `offset`, or undefined past the end of the stream.
+     * Returned buffers stay valid after the next reads.
+     */
+    async get(offset: number, length: number) {
+        if (offset < this.bufStart) {
+            throw new Error(`Backward read at ${offset} in a compressed capture`);
+        }
+        while (offset + length > this.bufStart + this.buf.length) {
+            let chunk: IteratorResult<Buffer>;
+            try {
+                chunk = await this.chunks.next();
+            }
+            catch {
+                // Truncated or corrupted frame, like a truncated record of an uncompressed file
+                return undefined;
+            }
+            if (chunk.done) {
+                return undefined;
+            }
+            const drop = Math.min(offset - this.bufStart, this.buf.length);
+            this.buf = Buffer.concat([this.buf.subarray(drop), chunk.value]);
+            this.bufStart += drop;
+        }
+        return this.buf.subarray(offset - this.bufStart, offset - this.bufStart + length);
+    }
+
+    async close() {
+        await this.chunks.return?.();
+        this.file.destroy();
+    }
+}
+
+function isCompressed(filePath: string) {
+    return filePath.endsWith(ZSTD_EXT);
+}
+
+async function openReader(filePath: string, size: number): Promise<Reader> {
+    if (isCompressed(filePath)) {
+        return new ZstdReader(filePath);
+    }
+    return new FileReader(await fs.promises.open(filePath, "r"), size);
+}
+
+function u16(buf: Buffer, offset: number, le: boolean) {
+    return le ? buf.readUInt16LE(offset) : buf.readUInt16BE(offset);
+}
+
+function u32(buf: Buffer, offset: number, le: boolean) {
+    return le ? buf.readUInt32LE(offset) : buf.readUInt32BE(offset);
+}
+
+function copyState(state: ParseState): ParseState {
+    return { ...state, ifaces: state.ifaces.slice() };
+}
+
+/**
+ * Parse the file header, classic pcap or pcapng section header block.
+ * @returns Initial parser state and offset of the first record, undefined if not a capture file.
+ */
+async function readFileHeader(reader: Reader): Promise<[ParseState, number] | undefined> {
+    const header = await reader.get(0, 24);
+    if (!header) {
+        return undefined;
+    }
+
+    const magic = header.readUInt32LE(0);
+    if (magic === 0x0a0d0d0a) {
+        return [{ format: "pcapng", le: true, linktype: 0, nanos: false, ifaces: [] }, 0];
+    }
+
+    for (const le of [true, false]) {
+        const m = u32(header, 0, le);
+        if (m === 0xa1b2c3d4 || m === 0xa1b23c4d) {
+            return [{ format: "pcap", le, linktype: u32(header, 20, le) & 0xffff, nanos: m === 0xa1b23c4d, ifaces: [] }, 24];
+        }
+    }
+    return undefined;
+}
+
+/**
+ * Read the record at `offset`, updating `state` on pcapng section and interface blocks.
+ * @returns Offset of the next record and the packet if the record holds one, undefined if incomplete.
+ */
+async function readRecord(reader: Reader, state: ParseState, offset: number): Promise<[number, Packet | undefined] | undefined> {
+    if (state.format === "pcap") {
+        const header = await reader.get(offset, 16);
+        if (!header) {
+            return undefined;
+        }
+        const capLen = u32(header, 8, state.le);
+        if (capLen > MAX_RECORD_SIZE) {
+            return undefined;
+        }
+        const data = await reader.get(offset + 16, capLen);
+        if (!data) {
+            return undefined;
+        }
+        const frac = u32(header, 4, state.le);
+        return [offset + 16 + capLen, {
+            ts: u32(header, 0, state.le) * 1000000 + (state.nanos ? Math.floor(frac / 1000) : frac),
+            linktype: state.linktype,
+            data,
+            origLen: u32(header, 12, state.le)
+        }];
+    }
+
+    const header = await reader.get(offset, 12);
+    if (!header) {
+        return undefined;
+    }
+    const type = u32(header, 0, state.le);
+    if (type === 0x0a0d0d0a) {
+        // Section header block, byte order may change
+        state.le = header.readUInt32LE(8) === 0x1a2b3c4d;
+        state.ifaces = [];
+    }
+    const length = u32(header, 4, state.le);
+    if (length < 12 || length > MAX_RECORD_SIZE || length % 4 !== 0) {
+        return undefined;
+    }
+    const block = await reader.get(offset, length);
+    if (!block) {
+        return undefined;
+    }
+    const next = offset + length;
+
+    if (type === 1) {
+        // Interface description block
+        let tsUnits = 1000000n;
+        let o = 16;
+        while (o + 4 <= length - 4) {
+            const code = u16(block, o, state.le);
+            const optLength = u16(block, o + 2, state.le);
+            if (code === 0) {
+                break;
+            }
+            if (code === 9 && optLength >= 1) {
+                // if_tsresol, negative power of 10 or of 2 if the MSB is set
+                const v = block[o + 4];
+                tsUnits = v & 0x80 ? 2n ** BigInt(v & 0x7f) : 10n ** BigInt(v);
+            }
+            o += 4 + Math.ceil(optLength / 4) * 4;
+        }
+        state.ifaces.push({ linktype: u16(block, 8, state.le), tsUnits });
+        return [next, undefined];
+    }
+
+    if (type === 6) {
+        // Enhanced packet block
+        const iface = state.ifaces[u32(block, 8, state.le)];
+        const capLen = u32(block, 20, state.le);
+        if (!iface || 28 + capLen > length) {
+            return [next, undefined];
+        }
+        const ticks = (BigInt(u32(block, 12, state.le)) << 32n) | BigInt(u32(block, 16, state.le));
+        return [next, {
+            ts: Number(ticks * 1000000n / iface.tsUnits),
+            linktype: iface.linktype,
+            data: block.subarray(28, 28 + capLen),
+            origLen: u32(block, 24, state.le)
+        }];
+    }
+
+    return [next, undefined];
+}
+
+/**
+ * Direction independent flow key of a packet, `proto|ip:port|ip:port` with hex IP addresses.
+ * @returns Key, undefined for non IP packets.
+ */
+function packetKey(linktype: number, data: Buffer) {
+    let o = 0;
+    let etherType: number;
+    switch (linktype) {
+        case 1:
+            // Ethernet, with optional VLAN tags
+            o = 14;
+            etherType = data.length >= 14 ? data.readUInt16BE(12) : 0;
+            while ((etherType === 0x8100 || etherType === 0x88a8) && data.length >= o + 4) {
+                etherType = data.readUInt16BE(o + 2);
+                o += 4;
+            }
+            break;
+        case 113:
+            // Linux cooked capture
+            o = 16;
+            etherType = data.length >= 16 ? data.readUInt16BE(14) : 0;
+            break;
+        case 276:
+            // Linux cooked capture v2
+            o = 20;
+            etherType = data.length >= 20 ? data.readUInt16BE(0) : 0;
+            break;
+        case 0:
+            // BSD loopback
+            o = 4;
+            etherType = data.length >= 1 && (data[0] === 2 || data[3] === 2) ? 0x0800 : 0x86dd;
+            break;
+        case 101:
+        case 12:
+            // Raw IP
+            etherType = data.length >= 1 && data[0] >> 4 === 6 ? 0x86dd : 0x0800;
+            break;
+        case 228:
+            etherType = 0x0800;
+            break;
+        case 229:
+            etherType = 0x86dd;
+            break;
+        default:
+            return undefined;
+    }
+
+    let proto: number;
+    let src: string;
+    let dst: string;
+    if (etherType === 0x0800 && data.length >= o + 20) {
+        const ihl = (data[o] & 0x0f) * 4;
+        proto = data[o + 9];
+        src = data.toString("hex", o + 12, o + 16);
+        dst = data.toString("hex", o + 16, o + 20);
+        // Fragments after the first one have no transport header
+        o = (data.readUInt16BE(o + 6) & 0x1fff) === 0 ? o + ihl : -1;
+    }
+    else if (etherType === 0x86dd && data.length >= o + 40) {
+        proto = data[o + 6];
+        src = data.toString("hex", o + 8, o + 24);
+        dst = data.toString("hex", o + 24, o + 40);
+        o += 40;
+        // Skip extension headers
+        while ([0, 43, 44, 60].includes(proto) && data.length >= o + 8) {
+            if (proto === 44 && (data.readUInt16BE(o + 2) & 0xfff8) !== 0) {
+                o = -1;
+                break;
+            }
+            const next = data[o];
+            o += proto === 44 ? 8 : (data[o + 1] + 1) * 8;
+            proto = next;
+        }
+    }
+    else {
+        return undefined;
+    }
+
+    let srcPort = 0;
+    let dstPort = 0;
+    if ([6, 17, 132].includes(proto) && o >= 0 && data.length >= o + 4) {
+        srcPort = data.readUInt16BE(o);
+        dstPort = data.readUInt16BE(o + 2);
+    }
+    return flowKey(proto, `${src}:${srcPort}`, `${dst}:${dstPort}`);
+}
+
+function flowKey(proto: number, a: string, b: string) {
+    return a < b ? `${proto}|${a}|${b}` : `${proto}|${b}|${a}`;
+}
+
+// 32-bit FNV-1a
+function hashKey(key: string) {
+    let h = 0x811c9dc5;
+    for (let i = 0; i < key.length; i++) {
+        h ^= key.charCodeAt(i);
+        h = Math.imul(h, 0x01000193);
+    }
+    return h >>> 0;
+}
+
+/**
+ * Convert an IPv4 or IPv6 address, as written by Suricata, to hexadecimal.
+ */
+function ipToHex(ip: string) {
+    if (!ip.includes(":")) {
+        return ip.split(".").map((b) => Number(b).toString(16).padStart(2, "0")).join("");
+    }
+
+    let [head, tail] = ip.split("::") as [string, string | undefined];
+    const groups = (s: string | undefined) => {
+        if (!s) {
+            return [];
+        }
+        return s.split(":").flatMap((g) => {
+            // Embedded IPv4 address
+            if (g.includes(".")) {
+                const hex = ipToHex(g);
+                return [hex.slice(0, 4), hex.slice(4)];
+            }
+            return [g.padStart(4, "0")];
+        });
+    };
+    const h = groups(head);
+    const t = groups(tail);
+    const fill = tail === undefined ? [] : new Array(8 - h.length - t.length).fill("0000");
+    return h.concat(fill, t).join("").toLowerCase();
+}
+
+/**
+ * Index new records of a capture file, starting over if it was truncated. Compressed
+ * files cannot be appended to, they are indexed again whenever their size changes.
+ */
+async function updateIndex(filePath: string) {
+    const stat = await fs.promises.stat(filePath);
+    const key = `${stat.dev}:${stat.ino}`;
+    const compressed = isCompressed(filePath);
+    let index = indexes.get(key);
+    if (index && compressed && index.size === stat.size) {
+        index.path = filePath;
+        return index;
+    }
+    if (!index || compressed || stat.size < index.scanned) {
+        index = { path: filePath, size: 0, scanned: 0, state: undefined, blocks: [], lastOpen: false };
+        indexes.set(key, index);
+    }
+    index.path = filePath;
+    index.size = stat.size;
+
+    const reader = await openReader(filePath, stat.size);
+    try {
+        if (!index.state) {
+            const header = await readFileHeader(reader);
+            if (!header) {
+                return index;
+            }
+            [index.state, index.scanned] = header;
+        }
+
+        // Rebuild the incomplete last block
+        if (index.lastOpen) {
+            const last = index.blocks.pop()!;
+            index.scanned = last.offset;
+            index.state = copyState(last.state);
+            index.lastOpen = false;
+        }
+
+        const state = index.state;
+        let offset = index.scanned;
+        let block: Block | undefined;
+        let keys = new Set<number>();
+        let packets = 0;
+        const closeBlock = (end: number) => {
+            if (block) {
+                block.end = end;
+                block.keys = Uint32Array.from(keys).sort();
+                index.blocks.push(block);
+            }
+            block = undefined;
+            keys = new Set();
+            packets = 0;
+        };
+
+        while (true) {
+            const record = await readRecord(reader, state, offset);
+            if (!record) {
+                break;
+            }
+            const [next, packet] = record;
+            if (packet) {
+                if (!block) {
+                    // Packet records do not change the parser state
+                    block = { offset, end: offset, tsMin: packet.ts, tsMax: packet.ts, keys: new Uint32Array(), state: copyState(state) };
+                }
+                block.tsMin = Math.min(block.tsMin, packet.ts);
+                block.tsMax = Math.max(block.tsMax, packet.ts);
+                const key = packetKey(packet.linktype, packet.data);
+                if (key) {
+                    keys.add(hashKey(key));
+                }
+                packets += 1;
+                if (packets === BLOCK_PACKETS) {
+                    closeBlock(next);
+                    index.scanned = next;
+                    index.state = copyState(state);
+                }
+            }
+            offset = next;
+        }
+
+        if (block) {
+            closeBlock(offset);
+            index.lastOpen = true;
+        }
+        else {
+            index.scanned = offset;
+            index.state = copyState(state);
+        }
+        return index;
+    }
+    finally {
+        await reader.close();
+    }
+}
+
+/**
+ * Get the up to date index of a capture file, concurrent callers share the same update.
+ */
+function getIndex(filePath: string) {
+    let pending = updating.get(filePath);
+    if (!pending) {
+        pending = updateIndex(filePath).finally(() => updating.delete(filePath));
+        updating.set(filePath, pending);
+    }
+    return pending;
+}
+
+function hasKey(keys: Uint32Array, hash: number) {
+    let lo = 0;
+    let hi = keys.length - 1;
+    while (lo <= hi) {
+        const mid = (lo + hi) >> 1;
+        if (keys[mid] === hash) {
+            return true;
+        }
+        if (keys[mid] < hash) {
+            lo = mid + 1;
+        }
+        else {
+            hi = mid - 1;
+        }
+    }
+    return false;
+}
+
+function pcapHeader(linktype: number) {
+    const header = Buffer.alloc(24);
+    header.writeUInt32LE(0xa1b2c3d4, 0);
+    header.writeUInt16LE(2, 4);
+    header.writeUInt16LE(4, 6);
+    header.writeUInt32LE(262144, 16);
+    header.writeUInt32LE(linktype, 20);
+    return header;
+}
+
+function pcapRecord(packet: Packet) {
+    const header = Buffer.alloc(16);
+    header.writeUInt32LE(Math.floor(packet.ts / 1000000), 0);
+    header.writeUInt32LE(packet.ts % 1000000, 4);
+    header.writeUInt32LE(packet.data.length, 8);
+    header.writeUInt32LE(packet.origLen, 12);
+    return Buffer.concat([header, packet.data]);
+}
+
+/**
+ * Extract the packets of a flow from capture files, as a classic pcap file.
+ * Only index blocks overlapping the flow time range and containing its 5-tuple are read.
+ * @param files Capture files that may contain the flow, in chronological order.
+ * @param flow Flow 5-tuple and time range.
+ * @returns Chunks of the pcap file, undefined if no packet was found.
+ */
+export async function* extractFlowPcap(files: string[], flow: FlowTuple): AsyncGenerator<Buffer> {
+    const proto = IP_PROTOCOLS[flow.proto] ?? Number(flow.proto);
+    const key = flowKey(proto, `${ipToHex(flow.src_ip)}:${flow.src_port ?? 0}`, `${ipToHex(flow.dest_ip)}:${flow.dest_port ?? 0}`);
+    const hash = hashKey(key);
+    const from = Number(flow.ts_start) - TIME_SLACK;
+    const to = Number(flow.ts_end) + TIME_SLACK;
+
+    let linktype: number | undefined;
+    for (const file of files) {
+        const index = await getIndex(file);
+        const blocks = index.blocks.filter((b) => b.tsMax >= from && b.tsMin <= to && hasKey(b.keys, hash));
+        if (blocks.length === 0) {
+            continue;
+        }
+
+        const stat = await fs.promises.stat(file);
+        const reader = await openReader(file, stat.size);
+        try {
+            // Blocks are in file order, as compressed files are read forward only
+            for (const block of blocks) {
+                const state = copyState(block.state);
+                let offset = block.offset;
+                let records: Buffer[] = [];
+                while (offset < block.end) {
+                    const record = await readRecord(reader, state, offset);
+                    if (!record) {
+                        break;
+                    }
+                    const [next, packet] = record;
+                    offset = next;
+                    if (!packet || packet.ts < from || packet.ts > to || packetKey(packet.linktype, packet.data) !== key) {
+                        continue;
+                    }
+                    if (linktype === undefined) {
+                        linktype = packet.linktype;
+                        yield pcapHeader(linktype);
+                    }
+                    // A flow uses a single link type, unless captured on several interfaces
+                    if (packet.linktype === linktype) {
+                        records.push(pcapRecord(packet));
+                    }
+                }
+                if (records.length > 0) {
+                    yield Buffer.concat(records);
+                }
+            }
+        }
+        finally {
+            await reader.close();
+        }
+    }
+}
+
+/**
+ * List capture files of a directory, sorted by name, including zstd compressed captures.
+ * A capture being compressed is listed once, uncompressed, until zstd removes it.
+ */
+export async function listPcapFiles(dir: string) {
+    try {
+        const entries = await fs.promises.readdir(dir, { withFileTypes: true });
+        const names = new Set(entries.filter((e) => e.isFile()).map((e) => e.name));
+        return [...names]
+            .filter((name) => {
+                const uncompressed = isCompressed(name) ? name.slice(0, -ZSTD_EXT.length) : undefined;
+                if (uncompressed !== undefined && names.has(uncompressed)) {
+                    return false;
+                }
+                return PCAP_FILE_EXT.includes(path.extname(uncompressed ?? name));
+            })
+            .map((name) => path.join(dir, name))
+            .sort();
+    }
+    catch {
+        return [];
+    }
+}
+
+/**
+ * Index capture files of a directory in background, so that the first extraction does not scan them.
+ * @param dir Directory of capture files.
+ * @param interval Delay between two updates, in milliseconds.
+ */
+export function watchPcapDir(dir = PCAP_DUMPS_DIR, interval = PCAP_INDEX_INTERVAL) {
+    const update = async () => {
+        const files = await listPcapFiles(dir);
+        const live = new Set<FileIndex>();
+        for (const file of files) {
+            await getIndex(file).then((index) => live.add(index), () => {});
+        }
+        // Segments deleted by retention, or replaced by their compressed copy
+        for (const [key, index] of indexes) {
+            if (path.resolve(path.dirname(index.path)) === path.resolve(dir) && !live.has(index)) {
+                indexes.delete(key);
+            }
+        }
+    };
+    update();
+    setInterval(update, interval).unref();
+}
@@ -1,9 +1,100 @@
-import { PrismaClient } from "../../generated/prisma/client";
+import { Prisma, PrismaClient } from "../../generated/prisma/client";
+import { observeQuery } from "$lib/server/metrics";
 import { env } from "$env/dynamic/private";
 
 
+// Connection pool, set explicitly rather than from the CPU count of the host.
+// `DATABASE_PGBOUNCER` disables prepared statements, required behind PgBouncer in transaction mode.
+const DATABASE_POOL_SIZE = env.DATABASE_POOL_SIZE ?? "10";
+const DATABASE_POOL_TIMEOUT = env.DATABASE_POOL_TIMEOUT ?? "10";
+const DATABASE_PGBOUNCER = env.DATABASE_PGBOUNCER === "true";
+
+/**
+ * Add the pool settings to the database URL, parameters already in `DATABASE_URL` take precedence.
+ * See https://www.prisma.io/docs/orm/overview/databases/postgresql#arguments
+ * @returns Database URL
+ */
+function datasourceUrl() {
+    const url = new URL(env.DATABASE_URL ?? "postgresql://postgres@postgres:5432/postgres");
+    const params: { [key: string]: string | undefined } = {
+        connection_limit: DATABASE_POOL_SIZE,
+        pool_timeout: DATABASE_POOL_TIMEOUT,
+        pgbouncer: DATABASE_PGBOUNCER ? "true" : undefined
+    };
+    for (const [key, value] of Object.entries(params)) {
+        if (value !== undefined && !url.searchParams.has(key)) {
+            url.searchParams.set(key, value);
+        }
+    }
+    return url.toString();
+}
+
 const prisma = new PrismaClient({
-    datasourceUrl: env.DATABASE_URL ?? "postgresql://postgres@postgres:5432/postgres"
+    datasourceUrl: datasourceUrl()
+}).$extends({
+    query: {
+        // Time every model and raw query for `/api/metrics`
+        async $allOperations({ model, operation, args, query }) {
+            const start = performance.now();
+            try {
+                return await query(args);
+            }
+            finally {
+                observeQuery(model ?? "raw", operation, (performance.now() - start) / 1000);
+            }
+        }
+    }
 });
 
-export default prisma;
\ No newline at end of file
+// Client of interactive transactions, extended like `prisma`.
+export type TransactionClient = Parameters<Parameters<typeof prisma.$transaction>[0]>[0];
+
+// Upper bound for user-driven queries such as payload regex search, in milliseconds.
+const QUERY_TIMEOUT = Number(env.QUERY_TIMEOUT ?? 30000);
+
+/**
+ * Run queries in a transaction that is cancelled server side when `signal` aborts,
+ * e.g. when the browser drops the request, or when it exceeds `QUERY_TIMEOUT`.
+ * @param signal Signal of the incoming request.
+ * @param fn Queries to run using the transaction client.
+ * @returns Result of `fn`.
+ */
+export async function cancellable<T>(signal: AbortSignal, fn: (tx: TransactionClient) => Promise<T>) {
+    return prisma.$transaction(async (tx) => {
+        const [{ pid, xact_start }] = await tx.$queryRaw<{ pid: number, xact_start: bigint }[]>`
+            SELECT pg_backend_pid() AS pid, (extract(epoch FROM now()) * 1000000)::bigint AS xact_start`;
+        await tx.$queryRaw`SELECT set_config('statement_timeout', ${String(QUERY_TIMEOUT)}, true)`;
+
+        // The connection returns to the pool once the transaction ends, only cancel
+        // the backend while it still runs this transaction, not another request's.
+        let done = false;
+        const cancel = () => {
+            if (done) {
+                return;
+            }
+            prisma.$queryRaw`
+                SELECT pg_cancel_backend(pid) FROM pg_stat_activity
+                WHERE pid = ${pid} AND (extract(epoch FROM xact_start) * 1000000)::bigint = ${xact_start}`.catch(() => {});
+        };
+        signal.addEventListener("abort", cancel, { once: true });
+
+        try {
+            return await fn(tx);
+        }
+        finally {
+            done = true;
+            signal.removeEventListener("abort", cancel);
+        }
+    }, { timeout: QUERY_TIMEOUT + 1000 });
+}
+
+/**
+ * Check if an error was raised by a cancelled statement (SQLSTATE 57014).
+ * @param e Error thrown by Prisma.
+ * @returns boolean
+ */
+export function isQueryCanceled(e: unknown) {
+    return e instanceof Prisma.PrismaClientKnownRequestError && e.meta?.code === "57014";
+}
+
+export default prisma;
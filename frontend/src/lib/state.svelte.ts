@@ -42,7 +42,14 @@ export const ctfConfig: {
 });
 
 export const flows: {
-    flows: Flows
+    flows: Flows,
+    since: string | undefined,
+    hasOlder: boolean,
+    // Pages shown, new flows push the oldest ones out of them
+    pages: number
 } = $state({
-    flows: []
+    flows: [],
+    since: undefined,
+    hasOlder: true,
+    pages: 1
 });
\ No newline at end of file
@@ -1,10 +1,12 @@
-import { flowsListFilters } from "$lib/schema";
-import { CTF_CONFIG } from "$lib/server/config";
-import prisma from "$lib/server/prisma";
+import { flowsListCursor, flowsListFilters } from "$lib/schema";
+import { flowsListJson, flowsListLateQuery, flowsListQuery, flowsListSeqQuery, formatSince, parseSince, type FlowsListCursor, type FlowsListRow, type FlowsListSince } from "$lib/server/flows";
+import { getFacets } from "$lib/server/facets";
+import { cancellable, isQueryCanceled } from "$lib/server/prisma";
 import { error, json, type RequestHandler } from "@sveltejs/kit";
+import { Prisma } from "../../../generated/prisma/client";
 
 
-export const GET: RequestHandler = async ({ url, locals }) => {
+export const GET: RequestHandler = async ({ url, request, locals }) => {
     const filters = url.searchParams.get("filters") ?? "{\"ts_to\":\"10000000000000000\",\"tags_require\":[],\"tags_deny\":[]}";
     const parsed = flowsListFilters.safeParse(JSON.parse(filters));
 
@@ -12,139 +14,53 @@ export const GET: RequestHandler = async ({ url, locals }) => {
         return error(400, JSON.stringify(parsed.error.issues));
     }
 
-    let { ts_to, services, app_proto, search, tags_require, tags_deny } = parsed.data;
-
-    let fsrvs = {};
-    if (services) {
-        if (services.length === 0) {
-            // Filter flows related to no services
-            for (const s of Object.values(CTF_CONFIG.services)) {
-                for (const ipp of s.ipports) {
-                    services.push(`${ipp.ip}:${ipp.port}`);
-                }
-            }
-            fsrvs = {
-                NOT: {
-                    OR: [
-                        {
-                            src_ipport: { in: services }
-                        },
-                        {
-                            dest_ipport: { in: services }
-                        }
-                    ]
-                }
-            };
-        }
-        else if (services.length > 0) {
-            fsrvs = {
-                OR: [
-                    {
-                        src_ipport: { in: services }
-                    },
-                    {
-                        dest_ipport: { in: services }
-                    }
-                ]
-            };
-        }
+    // `before=<ts_start>:<id>` requests the page after a flow, `since=<cursor>` only the new flows
+    const parsedCursor = flowsListCursor.safeParse({
+        before: url.searchParams.get("before") ?? undefined,
+        since: url.searchParams.get("since") ?? undefined
+    });
+    if (!parsedCursor.success) {
+        return error(400, JSON.stringify(parsedCursor.error.issues));
     }
-    
-    let ftags_deny = {};
-    if (tags_deny.length > 0) {
-        ftags_deny = {
-            NOT: {
-                alerts: {
-                    some: {
-                        tag: { in: tags_deny }
-                    }
-                }
-            }
-        };
+    let cursor: FlowsListCursor = {};
+    if (parsedCursor.data.since) {
+        cursor.since = parseSince(parsedCursor.data.since);
     }
-
-    let ftags_req = {};
-    if (tags_require.length > 0) {        
-        ftags_req = {
-            alerts: {
-                some: {
-                    tag: { in: tags_require }
-                }
-            }
-        };
+    if (parsedCursor.data.before) {
+        const [ts_start, id] = parsedCursor.data.before.split(":");
+        cursor.before = { ts_start: BigInt(ts_start), id: BigInt(id) };
     }
 
-    let search_fid = {};
-    if (search) {
-        const globs: { flow_id: bigint }[] = await prisma.$queryRaw`SELECT flow_id FROM raw WHERE REGEXP_LIKE(ENCODE("blob", 'escape'), ${search});`;
-        search_fid = {
-            id: { in: globs.map((v) => v.flow_id) }
-        };
+    let flows: FlowsListRow[];
+    let late: FlowsListRow[];
+    let since: FlowsListSince;
+    try {
+        [flows, late, since] = await cancellable(request.signal, async (tx): Promise<[FlowsListRow[], FlowsListRow[], FlowsListSince]> => {
+            // Read the next cursor first, flows written meanwhile are returned again by the next poll
+            const [next] = await tx.$queryRaw<FlowsListSince[]>(flowsListSeqQuery());
+            const flows = await tx.$queryRaw<FlowsListRow[]>(flowsListQuery(parsed.data, cursor));
+            const lateQuery = cursor.since && flowsListLateQuery(parsed.data, cursor.since);
+            return [flows, lateQuery ? await tx.$queryRaw<FlowsListRow[]>(lateQuery) : [], next];
+        });
     }
-
-    const flows = await prisma.flow.findMany({
-        select: {
-            id: true,
-            ts_start: true,
-            ts_end: true,
-            dest_ip: true,
-            dest_port: true,
-            dest_ipport: true,
-            app_proto: true,
-            metadata: true,
-            alerts: {
-                select: {
-                    tag: true
-                }
-            }
-        },
-        where: {
-            AND: [
-                {
-                    ts_start: { lte: Number(ts_to) }
-                },
-                {
-                    app_proto: { equals: app_proto }
-                },
-                fsrvs,
-                ftags_deny,
-                ftags_req,
-                search_fid
-            ]
-        },
-        orderBy: {
-            ts_start: "desc"
-        },
-        take: 100
-    });
-
-    const prs = await prisma.flow.groupBy({
-        by: "app_proto",
-        where: {
-            app_proto: {
-                not: "failed"
-            }
+    catch (e) {
+        if (isQueryCanceled(e)) {
+            return error(504, "Flows query was cancelled or took too long.");
         }
-    });
-
-    const tags = await prisma.alert.groupBy({
-        by: ["tag", "color"],
-        orderBy: {
-            color: "asc"
+        if (e instanceof Prisma.PrismaClientKnownRequestError && e.meta?.code === "2201B") {
+            return error(400, "Invalid search regular expression.");
         }
-    });
-
-    let seFlows: any = [];
-    for (let index = 0; index < flows.length; index += 1) {
-        seFlows.push(flows[index]);
-        seFlows[index].id = flows[index].id.toString();
-        seFlows[index].ts_start = flows[index].ts_start?.toString();
-        seFlows[index].ts_end = flows[index].ts_end?.toString();
+        throw e;
     }
 
+    const { appProto, tags } = await getFacets();
+
     return json({
-        flows: seFlows,
-        appProto: prs.map((v) => v.app_proto),
+        flows: flowsListJson(flows),
+        // Flows below the previous cursor, not counted in the page
+        late: flowsListJson(late),
+        since: formatSince(since),
+        appProto,
         tags
     });
 };
\ No newline at end of file
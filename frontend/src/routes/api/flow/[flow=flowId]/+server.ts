@@ -1,35 +1,62 @@
 import prisma from "$lib/server/prisma";
 import { error, json, type RequestHandler } from "@sveltejs/kit";
+import { Prisma } from "../../../../generated/prisma/client";
 
 
+// Application protocols logging extracted files
+// See https://docs.suricata.io/en/suricata-7.0.10/file-extraction/file-extraction.html
+const FILEINFO_APP_PROTOS = ["http", "http2", "smtp", "ftp", "nfs", "smb"];
+
+type FlowDetailRow = {
+    id: bigint,
+    ts_start: bigint,
+    ts_end: bigint,
+    src_ipport: string | null,
+    dest_ipport: string | null,
+    dest_port: number | null,
+    pcap_filename: string | null,
+    proto: string,
+    app_proto: string | null,
+    metadata: any,
+    extra_data: any,
+    fileinfo: { extra_data: any }[] | null,
+    app_events: { app_proto: string, extra_data: any }[] | null,
+    alert: { extra_data: any, color: string | null }[] | null,
+    anomaly: { extra_data: any }[]
+};
+
 export const GET: RequestHandler = async ({ params, locals }) => {
     if (!params.flow) {
         return json({ error: "Flow ID is required" }, { status: 400 });
     }
 
-    // Query flow from database
-    const flow = await prisma.flow.findUnique({
-        select: {
-            id: true,
-            ts_start: true,
-            ts_end: true,
-            src_ipport: true,
-            dest_ipport: true,
-            dest_port: true,
-            pcap_filename: true,
-            proto: true,
-            app_proto: true,
-            metadata: true,
-            extra_data: true
-        },
-        where: {
-            id: BigInt(params.flow)
-        }
-    });
+    // Query flow and its events in one round trip.
+    // Events are never older than their flow, which skips the partitions of older hours.
+    const rows = await prisma.$queryRaw<FlowDetailRow[]>`
+        SELECT f.id, f.ts_start, f.ts_end, f.src_ipport, f.dest_ipport, f.dest_port, f.pcap_filename, f.proto, f.app_proto, f.metadata, f.extra_data,
+            CASE WHEN f.app_proto IN (${Prisma.join(FILEINFO_APP_PROTOS)}) THEN (
+                SELECT COALESCE(json_agg(json_build_object('extra_data', e.extra_data) ORDER BY e.id), '[]')
+                FROM fileinfo e WHERE e.flow_id = f.id AND e.timestamp >= f.ts_start
+            ) END AS fileinfo,
+            CASE WHEN f.app_proto <> 'failed' THEN (
+                SELECT json_agg(json_build_object('app_proto', e.app_proto, 'extra_data', e.extra_data) ORDER BY e.id)
+                FROM app_event e WHERE e.flow_id = f.id AND e.timestamp >= f.ts_start
+            ) END AS app_events,
+            CASE WHEN f.extra_data->>'alerted' = 'true' THEN (
+                SELECT COALESCE(json_agg(json_build_object('extra_data', e.extra_data, 'color', e.color) ORDER BY e.id), '[]')
+                FROM alert e WHERE e.flow_id = f.id
+            ) END AS alert,
+            (
+                SELECT COALESCE(json_agg(json_build_object('extra_data', e.extra_data) ORDER BY e.id), '[]')
+                FROM anomaly e WHERE e.flow_id = f.id AND e.timestamp >= f.ts_start
+            ) AS anomaly
+        FROM flow f
+        WHERE f.id = ${BigInt(params.flow)}`;
 
-    if (flow === null) {
+    if (rows.length === 0) {
         return error(404);
     }
+    const { fileinfo, app_events, alert, anomaly, ...flow } = rows[0];
 
     let result: any = {
         flow: {
@@ -41,78 +68,27 @@ export const GET: RequestHandler = async ({ params, locals }) => {
     };
 
     // Get associated fileinfos
-    // See https://docs.suricata.io/en/suricata-7.0.10/file-extraction/file-extraction.html
-    if (flow.app_proto) {
-        if (["http", "http2", "smtp", "ftp", "nfs", "smb"].includes(flow.app_proto)) {
-            const fileinfo = await prisma.fileinfo.findMany({
-                select: {
-                    extra_data: true
-                },
-                where: {
-                    flow_id: BigInt(params.flow)
-                },
-                orderBy: {
-                    id: "asc"
-                }
-            });
-
-            result.fileinfo = fileinfo;
-        }
+    if (fileinfo !== null) {
+        result.fileinfo = fileinfo;
     }
 
     // Get associated application layer(s) metadata
-    if (result.flow.app_proto !== null && result.flow.app_proto !== "failed") {
-        const appEvents = await prisma.app_event.findMany({
-            select: {
-                app_proto: true,
-                extra_data: true
-            },
-            where: {
-                flow_id: BigInt(params.flow)
-            },
-            orderBy: {
-                id: "asc"
-            }
-        });
-
-        for (const row of appEvents) {
-            if (result[row.app_proto]) {
-                result[row.app_proto].push(row.extra_data);
-            }
-            else {
-                result[row.app_proto] = [row.extra_data];
-            }
+    for (const row of app_events ?? []) {
+        if (result[row.app_proto]) {
+            result[row.app_proto].push(row.extra_data);
+        }
+        else {
+            result[row.app_proto] = [row.extra_data];
         }
     }
 
     // Get associated alert
-    if (result.flow.extra_data.alerted) {
-        result.alert = await prisma.alert.findMany({
-            select: {
-                extra_data: true,
-                color: true
-            },
-            where: {
-                flow_id: BigInt(params.flow)
-            },
-            orderBy: {
-                id: "asc"
-            }
-        });
+    if (alert !== null) {
+        result.alert = alert;
     }
 
     // Get associated anomalies
-    result.anomaly = await prisma.anomaly.findMany({
-        select: {
-            extra_data: true
-        },
-        where: {
-            flow_id: BigInt(params.flow)
-        },
-        orderBy: {
-            id: "asc"
-        }
-    });
+    result.anomaly = anomaly;
 
     return json(result);
-};
\ No newline at end of file
+};
@@ -0,0 +1,81 @@
+import { extractFlowPcap, listPcapFiles, PCAP_DUMPS_DIR } from "$lib/server/pcap";
+import prisma from "$lib/server/prisma";
+import { error, json, type RequestHandler } from "@sveltejs/kit";
+import fs from "node:fs";
+import path from "node:path";
+
+
+/**
+ * Cut the packets of a flow out of the captures it was seen in, as a classic pcap.
+ * Suricata reports the pcap in `pcap_filename` when reading files, otherwise every capture in
+ * `PCAP_DUMPS_DIR` is searched through its index.
+ */
+export const GET: RequestHandler = async ({ params }) => {
+    if (!params.flow) {
+        return json({ error: "Flow ID is required" }, { status: 400 });
+    }
+
+    const flow = await prisma.flow.findUnique({
+        select: {
+            ts_start: true,
+            ts_end: true,
+            src_ip: true,
+            src_port: true,
+            dest_ip: true,
+            dest_port: true,
+            proto: true,
+            pcap_filename: true
+        },
+        where: {
+            id: BigInt(params.flow)
+        }
+    });
+
+    if (flow === null) {
+        return error(404);
+    }
+
+    // `pcap_filename` is stored JSON encoded, e.g. "\"/input_pcaps/file.pcap\""
+    let files: string[] = [];
+    if (flow.pcap_filename) {
+        const file = path.join("..", flow.pcap_filename.slice(1, -1));
+        if (fs.existsSync(file)) {
+            files = [file];
+        }
+    }
+    if (files.length === 0) {
+        files = await listPcapFiles(PCAP_DUMPS_DIR);
+    }
+
+    const packets = extractFlowPcap(files, flow);
+    const first = await packets.next();
+    if (first.done) {
+        return error(404, "No packets found for this flow");
+    }
+
+    const stream = new ReadableStream<Uint8Array>({
+        start(controller) {
+            controller.enqueue(first.value);
+        },
+        async pull(controller) {
+            const { done, value } = await packets.next();
+            if (done) {
+                controller.close();
+            }
+            else {
+                controller.enqueue(value);
+            }
+        },
+        async cancel() {
+            await packets.return(undefined);
+        }
+    });
+
+    return new Response(stream, {
+        headers: {
+            "Content-Type": "application/vnd.tcpdump.pcap",
+            "Content-Disposition": `attachment; filename="flow-${params.flow}.pcap"`,
+            "Cache-Control": "no-cache"
+        }
+    });
+};
@@ -1,34 +1,65 @@
+import { encodeRawFrame } from "$lib/raw";
 import prisma from "$lib/server/prisma";
+import { Prisma } from "../../../../../generated/prisma/client";
 import { json, type RequestHandler } from "@sveltejs/kit";
 
 
-export const GET: RequestHandler = async ({ params, locals }) => {
+// Chunks read from the database per query while streaming.
+const RAW_PAGE_SIZE = 64;
+
+/**
+ * Stream raw payload chunks of a flow as binary frames, see `$lib/raw`, chunks are sent as stored.
+ * `after=<count>` starts after a chunk and `limit=<n>` bounds the number of chunks, so clients can page.
+ */
+export const GET: RequestHandler = async ({ params, url, locals }) => {
     if (!params.flow) {
         return json({ error: "Flow ID is required" }, { status: 400 });
     }
 
-    const raws = await prisma.raw.findMany({
-        select: {
-            server_to_client: true,
-            blob: true
-        },
-        where: {
-            flow_id: BigInt(params.flow)
-        },
-        orderBy: {
-            count: "asc"
+    const flowId = BigInt(params.flow);
+    const after = Number(url.searchParams.get("after") ?? -1);
+    const limit = Number(url.searchParams.get("limit") ?? Infinity);
+    if (!Number.isInteger(after) || !(limit > 0)) {
+        return json({ error: "Invalid after or limit parameter" }, { status: 400 });
+    }
+
+    // Payloads are partitioned on the start of their flow, filtering on it only reads one partition.
+    // Flows are written when they end, payloads of an active flow are read from every partition.
+    // Payloads of flows still active when partitioning was migrated kept a start of 0, in the legacy partition.
+    const flow = await prisma.flow.findUnique({ select: { ts_start: true }, where: { id: flowId } });
+
+    let cursor = after;
+    let remaining = limit;
+
+    const stream = new ReadableStream<Uint8Array>({
+        async pull(controller) {
+            // Chunks are stored once in `raw_blob`, payloads written before deduplication keep their blob
+            const raws = await prisma.$queryRaw<{ count: number | null, server_to_client: number | null, blob: Uint8Array | null }[]>`
+                SELECT r.count, r.server_to_client, COALESCE(b.blob, r.blob) AS blob
+                FROM raw r LEFT JOIN raw_blob b ON b.hash = r.blob_hash
+                WHERE r.flow_id = ${flowId}${flow ? Prisma.sql` AND r.ts_start IN (${flow.ts_start}, 0)` : Prisma.empty} AND r.count > ${cursor}
+                ORDER BY r.count
+                LIMIT ${Math.min(RAW_PAGE_SIZE, remaining)}`;
+
+            for (const r of raws) {
+                // `server_to_client` is 0 for client to server chunks
+                if (r.count !== null && r.server_to_client !== null && r.blob) {
+                    controller.enqueue(encodeRawFrame({ count: r.count, server_to_client: r.server_to_client, data: r.blob }));
+                }
+            }
+
+            cursor = raws.at(-1)?.count ?? cursor;
+            remaining -= raws.length;
+            if (raws.length < RAW_PAGE_SIZE || remaining <= 0) {
+                controller.close();
+            }
         }
     });
 
-    let result: { server_to_client: string, data: string }[] = [];
-    for (const r of raws) {
-        if (r.server_to_client && r.blob) {
-            result.push({
-                server_to_client: r.server_to_client?.toString(),
-                data: Buffer.from(r.blob).toString("base64")
-            });
+    return new Response(stream, {
+        headers: {
+            "Content-Type": "application/octet-stream",
+            "Cache-Control": "no-cache"
         }
-    }
-    
-    return json(result);
-};
\ No newline at end of file
+    });
+};
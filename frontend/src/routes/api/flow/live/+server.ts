@@ -0,0 +1,60 @@
+import { flowsListCursor, flowsListFilters } from "$lib/schema";
+import { parseSince } from "$lib/server/flows";
+import { subscribeFlows, type LiveFlows } from "$lib/server/live";
+import { error, type RequestHandler } from "@sveltejs/kit";
+
+
+/**
+ * Stream the flows matching `filters` as Server-Sent Events, as soon as they are written.
+ * Each `flows` event carries the same `{flows, late, since}` object as an incremental `/api/flow` request.
+ * `since=<cursor>` resumes from a previous response, EventSource reconnections resume from the last event id.
+ */
+export const GET: RequestHandler = async ({ url, request }) => {
+    const filters = url.searchParams.get("filters") ?? "{\"ts_to\":\"10000000000000000\",\"tags_require\":[],\"tags_deny\":[]}";
+    const parsed = flowsListFilters.safeParse(JSON.parse(filters));
+    if (!parsed.success) {
+        return error(400, JSON.stringify(parsed.error.issues));
+    }
+
+    const parsedCursor = flowsListCursor.safeParse({
+        since: request.headers.get("last-event-id") ?? url.searchParams.get("since") ?? undefined
+    });
+    if (!parsedCursor.success) {
+        return error(400, JSON.stringify(parsedCursor.error.issues));
+    }
+
+    const encoder = new TextEncoder();
+    let unsubscribe: (() => void) | undefined;
+
+    const stream = new ReadableStream<Uint8Array>({
+        start(controller) {
+            const send = (update: LiveFlows | undefined) => {
+                const message = update
+                    ? `id: ${update.since}\nevent: flows\ndata: ${JSON.stringify(update)}\n\n`
+                    : ": keep-alive\n\n";
+                try {
+                    controller.enqueue(encoder.encode(message));
+                }
+                catch (e) {
+                    // Stream already closed
+                    unsubscribe?.();
+                }
+            };
+            const since = parsedCursor.data.since;
+            unsubscribe = subscribeFlows(parsed.data, since ? parseSince(since) : undefined, send);
+            request.signal.addEventListener("abort", () => unsubscribe?.(), { once: true });
+        },
+        cancel() {
+            unsubscribe?.();
+        }
+    });
+
+    return new Response(stream, {
+        headers: {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            // Disable response buffering of reverse proxies such as nginx
+            "X-Accel-Buffering": "no"
+        }
+    });
+};
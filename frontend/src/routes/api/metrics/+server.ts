@@ -0,0 +1,26 @@
+import { renderMetrics, type IngestStatsRow } from "$lib/server/metrics";
+import prisma from "$lib/server/prisma";
+import type { RequestHandler } from "@sveltejs/kit";
+
+
+/**
+ * Expose web server and payload writers metrics in the Prometheus text format.
+ */
+export const GET: RequestHandler = async () => {
+    let ingestStats: IngestStatsRow[] = [];
+    try {
+        ingestStats = await prisma.$queryRaw<IngestStatsRow[]>`
+            SELECT source, stats, extract(epoch FROM now() - updated_at)::float8 AS age FROM ingest_stats ORDER BY source`;
+    }
+    catch (e) {
+        // Web server metrics are still useful while the database is down
+        console.error("Failed to read ingest stats:", e);
+    }
+
+    return new Response(renderMetrics(ingestStats), {
+        headers: {
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+            "Cache-Control": "no-cache"
+        }
+    });
+};
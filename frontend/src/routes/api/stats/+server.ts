@@ -1,30 +1,54 @@
+import { CTF_CONFIG } from "$lib/server/config";
 import prisma from "$lib/server/prisma";
 import { json, type RequestHandler } from "@sveltejs/kit";
 
+/**
+ * Flags out per tick, overall and per service, from the per-second rollup tables.
+ * Ticks are counted from the CTF start date to the current tick, or the last one once the CTF is over.
+ * Overall flags are counted on the alert timestamp, flags per service on the start of their flow.
+ */
 export const GET: RequestHandler = async ({}) => {
-    const flagsOut = await prisma.alert.findMany({
-        select: {
-            flow_id: true,
-            timestamp: true
-        },
-        where: {
-            tag: "FLAG OUT"
+    const start = Math.floor(Date.parse(CTF_CONFIG.start_date + "Z") / 1000);
+    const end = Math.min(Date.now(), Date.parse(CTF_CONFIG.end_date + "Z")) / 1000;
+    const tickLength = CTF_CONFIG.tick_length;
+    const ticksNum = Math.max(0, Math.floor((end - start) / tickLength) + 1);
+
+    const [{ flows }] = await prisma.$queryRaw<{ flows: bigint | null }[]>`SELECT SUM(flows) AS flows FROM flow_rollup`;
+    const totals = await prisma.$queryRaw<{ tick: number, flags: bigint }[]>`
+        SELECT ((bucket - ${start}::bigint) / ${tickLength}::bigint)::int AS tick, SUM(flags) AS flags
+        FROM flag_out_alert_rollup
+        WHERE bucket >= ${start}::bigint AND bucket < ${start + ticksNum * tickLength}::bigint
+        GROUP BY 1`;
+    const rows = await prisma.$queryRaw<{ tick: number, dest_ipport: string, flags: bigint }[]>`
+        SELECT ((bucket - ${start}::bigint) / ${tickLength}::bigint)::int AS tick, dest_ipport, SUM(flags) AS flags
+        FROM flag_out_rollup
+        WHERE bucket >= ${start}::bigint AND bucket < ${start + ticksNum * tickLength}::bigint
+        GROUP BY 1, 2`;
+
+    const serviceByIpport: { [ipport: string]: string } = {};
+    const services: { [name: string]: number[] } = {};
+    for (const [name, s] of Object.entries(CTF_CONFIG.services)) {
+        services[name] = new Array(ticksNum).fill(0);
+        for (const ipp of s.ipports) {
+            serviceByIpport[`${ipp.ip}:${ipp.port}`] = name;
         }
-    });
-    const flowsNum = await prisma.flow.count();
-    const flagsOutFlows = await prisma.flow.findMany({
-        select: {
-            ts_start: true,
-            dest_ipport: true
-        },
-        where: {
-            id: { in: flagsOut.map((v) => v.flow_id) }
+    }
+
+    const flagsOut: number[] = new Array(ticksNum).fill(0);
+    for (const r of totals) {
+        flagsOut[r.tick] += Number(r.flags);
+    }
+    for (const r of rows) {
+        const name = serviceByIpport[r.dest_ipport];
+        if (name) {
+            services[name][r.tick] += Number(r.flags);
         }
-    });
+    }
 
     return json({
-        flagsOut: flagsOut.map((v) => v.timestamp.toString()),
-        flowsNum,
-        flagsOutFlows: flagsOutFlows.map((v) => { return {ts_start: v.ts_start.toString(), dest_ipport: v.dest_ipport} })
+        flowsNum: Number(flows ?? 0),
+        flagsOutNum: flagsOut.reduce((a, b) => a + b, 0),
+        flagsOut,
+        services
     });
-};
\ No newline at end of file
+};
@@ -1,17 +1,7 @@
-import path from "node:path";
-import fs from "node:fs";
+import { serveFile } from "$lib/server/files";
 import type { RequestHandler } from "@sveltejs/kit";
-import { error } from "node:console";
 
 
-export const GET: RequestHandler = ({ url }) => {
-    const pathName = path.join("../suricata/output", url.pathname);
-
-    try {
-        const file = fs.readFileSync(pathName);
-        return new Response(file);
-    }
-    catch {
-        error(404);
-    }
-};
\ No newline at end of file
+export const GET: RequestHandler = ({ params, request }) => {
+    return serveFile("../suricata/output/filestore", params.path ?? "", request);
+};
@@ -1,16 +1,7 @@
-import path from "node:path";
-import fs from "node:fs";
-import { error, type RequestHandler } from "@sveltejs/kit";
+import { serveFile } from "$lib/server/files";
+import type { RequestHandler } from "@sveltejs/kit";
 
 
-export const GET: RequestHandler = ({ url }) => {
-    const pathName = path.join("../", url.pathname);
-
-    try {
-        const file = fs.readFileSync(pathName);
-        return new Response(file);
-    }
-    catch {
-        error(404);
-    }
-};
\ No newline at end of file
+export const GET: RequestHandler = ({ params, request }) => {
+    return serveFile("../input_pcaps", params.path ?? "", request);
+};
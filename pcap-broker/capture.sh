@@ -0,0 +1,45 @@
+#!/bin/sh
+# Copyright (C) 2024  ANSSI
+# SPDX-License-Identifier: CC0-1.0
+
+# PCAP_COMMAND of pcap-broker in mode C: streams the vulnbox capture as one pcap.
+# The SSH capture is restarted in place when it ends, reading the target from
+# /config/capture.env each time, so that pcap-broker keeps its clients (Suricata,
+# tshark) connected across target changes and network failures.
+# Only the first capture forwards its pcap header, later ones are appended without
+# theirs, so the game interface must keep the same link type.
+# A connection lost in the middle of a packet leaves a partial record at the end
+# of the capture, which would shift every later record: the capture is rewritten
+# by a local tcpdump, which only writes whole records and drops the partial one.
+#
+# `sh /capture.sh switch` ends the current capture cleanly, remote tcpdump flushes
+# its last packets and exits, see `./start.py config set target_ip=...`.
+
+CAPTURE_ENV=/config/capture.env
+TCPDUMP="tcpdump -U --immediate-mode -ni game -s 65535 -w - not tcp port 22"
+SSH_OPTS="-oStrictHostKeyChecking=no -oServerAliveInterval=5 -oServerAliveCountMax=3"
+
+if [ "$1" = "switch" ]; then
+    ssh $SSH_OPTS "root@$(cat /tmp/target)" "pkill -INT -f '$TCPDUMP'"
+    exit
+fi
+
+# Forward the pcap header of the first capture only
+forward() {
+    if [ -e /tmp/header_sent ]; then
+        tail -c +25
+    else
+        # One byte reads, a pipe never returns less
+        dd bs=1 count=24 of=/tmp/header 2>/dev/null
+        [ "$(wc -c < /tmp/header)" -eq 24 ] || return
+        cat /tmp/header && touch /tmp/header_sent && cat
+    fi
+}
+
+while true; do
+    [ -f "$CAPTURE_ENV" ] && . "$CAPTURE_ENV"
+    echo "$TARGET_IP" > /tmp/target
+    echo "Capturing on root@$TARGET_IP" >&2
+    ssh $SSH_OPTS "root@$TARGET_IP" "$TCPDUMP" | tcpdump -U -r - -w - | forward
+    sleep 1
+done
@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
 import argparse
+import fnmatch
+import hashlib
+import http.client
+import ipaddress
+import json
 import os
+import random
 import re
 import shutil
+import socket
+import struct
 import subprocess
 import sys
-from datetime import datetime
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
 
 ENV_FILE = ".env"
 COMPOSE_FILES = {
@@ -14,6 +26,177 @@ COMPOSE_FILES = {
     "C": "docker-compose-c.yml",
 }
 OFFSET_PRINT = 77
+MIGRATIONS_DIR = "./suricata/migrations"
+# Advisory lock serializing migrations with Suricata, MIGRATIONS_LOCK_ID in suricata/src/database.rs
+MIGRATIONS_LOCK_ID = 0x64696767
+PCAP_DIR = "./tshark/dumps"
+INPUT_PCAPS_DIR = "./input_pcaps"
+
+# Configuration pushed to running containers by `./start.py config set`: the web
+# interface reloads ctf_config.json, pcap-broker and tshark read capture.env.
+CONFIG_DIR = "./config"
+CTF_CONFIG_FILE = os.path.join(CONFIG_DIR, "ctf_config.json")
+CAPTURE_ENV_FILE = os.path.join(CONFIG_DIR, "capture.env")
+# Keys of `./start.py config set`, with their .env variable
+CONFIG_KEYS = {
+    "target_ip": "TARGET_IP",
+    "start_date": "CTF_START_DATE",
+    "end_date": None,
+    "tick_length": "CTF_TICK_LENGTH",
+    "refresh_rate": "REFRESH_RATE",
+}
+
+# Images built by `./start.py start`, rebuilt only when the hash of their sources changes.
+# Build contexts, with the paths left out of the hash on top of their .dockerignore:
+# runtime data written by the containers.
+BUILD_CONTEXTS = {
+    "suricata": ("./suricata", ["output"]),
+    "frontend": ("./frontend", []),
+    "tshark": ("./tshark", ["dumps"]),
+}
+# Services built from a `dockerfile_inline` of their compose file
+BUILD_INLINE_SERVICES = ["pcap-broker"]
+BUILD_CACHE_FILE = ".build-cache.json"
+BUILD_LOG_FILE = "build.log"
+COMPOSE_PROJECT = "digger"
+
+# Parallel replay in mode A: one spool directory of hardlinks per Suricata worker,
+# and a generated compose file declaring the workers.
+SHARDS_DIR = os.path.join(INPUT_PCAPS_DIR, ".shards")
+PARALLEL_COMPOSE_FILE = "docker-compose-a.parallel.yml"
+
+# Local Prometheus scraping the EVE output, the web server and the payload writers,
+# declared by a generated compose file.
+METRICS_COMPOSE_FILE = "docker-compose.metrics.yml"
+PROMETHEUS_CONFIG_FILE = "./prometheus.yml"
+EVE_METRICS_PORT = 9101
+PROMETHEUS_RETENTION = "30d"
+
+# End-to-end benchmark: a synthetic corpus replayed in mode A by a separate compose
+# project, so that the database of the game is left untouched.
+BENCH_DIR = "./bench"
+BENCH_CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+BENCH_MANIFEST_FILE = os.path.join(BENCH_DIR, "corpus.json")
+BENCH_OUTPUT_DIR = os.path.join(BENCH_DIR, "output")
+BENCH_RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BENCH_COMPOSE_FILE = "docker-compose-a.bench.yml"
+BENCH_PROJECT = "digger-bench"
+BENCH_API_URL = "http://127.0.0.1:3000"
+# Corpus packets start at a fixed date, so that runs write the same partitions
+BENCH_EPOCH = 1_700_000_000
+BENCH_FLOWS_PER_FILE = 5000
+
+# Resumable replay in mode A: new and grown input pcaps are staged in the spool
+# replayed by Suricata, the ledger records what has been fully ingested.
+INGEST_DIR = os.path.join(INPUT_PCAPS_DIR, ".ingest")
+INGEST_SPOOL_DIR = os.path.join(INGEST_DIR, "spool")
+INGEST_LEDGER_FILE = os.path.join(INGEST_DIR, "ledger.json")
+# Bytes hashed at the start of input pcaps, tells a grown file from a replaced one.
+INGEST_HASH_SIZE = 1024 * 1024
+# Files modified more recently are still being written, in seconds.
+INGEST_SETTLE_TIME = 10
+
+# Sources of `./start.py top`: Suricata counters dumped by the stats output, see suricata/entrypoint.sh,
+# and the Docker Engine API for container usage.
+SURICATA_STATS_LOG = "./suricata/output/stats.log"
+DOCKER_SOCKET = "/var/run/docker.sock"
+# Suricata counters shown by `./start.py top`, when present in the capture mode.
+TOP_SURICATA_COUNTERS = [
+    "capture.kernel_packets",
+    "capture.kernel_drops",
+    "decoder.pkts",
+    "decoder.bytes",
+    "tcp.reassembly_gap",
+    "flow.spare_sync_empty",
+    "detect.alert",
+]
+
+# Units of `./start.py prune --older-than`, in seconds. Ticks ("t") are read from .env.
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Capture segments closed by `tshark/init.sh`, named after the tick they start in.
+PCAP_SEGMENT_PATTERN = re.compile(r"-tick(\d+)-\d{8}T\d{6}\.pcap(\.zst)?$")
+
+# Migrations with online steps for `./start.py migrate`, other pending migrations are applied as is.
+# `prepare` runs once outside of any transaction (e.g. concurrent index builds),
+# `backfill` walks the table by id: each batch takes the rows after `{last_id}` and
+# returns the number of updated rows and the last id it scanned, none once the table
+# is exhausted. The migration itself is then applied: it is idempotent and finds
+# nothing left to rewrite.
+ONLINE_MIGRATIONS = {
+    "00000000000002_flow_ipport_trigger": {
+        "backfill": """
+            WITH batch AS (
+                SELECT id, src_ipport, dest_ipport FROM flow WHERE id > {last_id} ORDER BY id LIMIT {batch_size}
+            ), updated AS (
+                UPDATE flow SET
+                    src_ipport = flow.src_ip || (CASE WHEN flow.src_port IS NULL THEN '' ELSE ':' || flow.src_port END),
+                    dest_ipport = flow.dest_ip || (CASE WHEN flow.dest_port IS NULL THEN '' ELSE ':' || flow.dest_port END)
+                FROM batch WHERE flow.id = batch.id AND (batch.src_ipport IS NULL OR batch.dest_ipport IS NULL)
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM updated), (SELECT max(id) FROM batch);
+        """,
+    },
+    "00000000000003_raw_payload_trgm": {
+        "prepare": """
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS "raw_blob_trgm_idx" ON "raw" USING GIN ((ENCODE("blob", 'escape')) gin_trgm_ops);
+        """,
+    },
+    "00000000000004_flow_keyset": {
+        "prepare": """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS "flow_ts_start_id_idx" ON "flow" ("ts_start" DESC, "id" DESC);
+            ALTER TABLE "flow" ADD COLUMN IF NOT EXISTS "seq" BIGINT;
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS "flow_seq_idx" ON "flow" ("seq");
+            ALTER TABLE "flow" ADD COLUMN IF NOT EXISTS "xid" BIGINT;
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS "flow_xid_idx" ON "flow" USING BRIN ("xid");
+        """,
+    },
+    "00000000000007_time_partitions": {
+        "prepare": """
+            ALTER TABLE "raw" ADD COLUMN IF NOT EXISTS "ts_start" BIGINT NOT NULL DEFAULT 0;
+        """,
+        # Payloads of flows not written yet keep 0, the id keyset moves past them
+        "backfill": """
+            WITH batch AS (
+                SELECT id, flow_id FROM raw WHERE id > {last_id} AND ts_start = 0 ORDER BY id LIMIT {batch_size}
+            ), updated AS (
+                UPDATE raw SET ts_start = flow.ts_start
+                FROM batch JOIN flow ON flow.id = batch.flow_id
+                WHERE raw.id = batch.id AND raw.ts_start = 0
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM updated), (SELECT max(id) FROM batch);
+        """,
+    },
+    "00000000000008_raw_blob_dedup": {
+        "prepare": """
+            CREATE TABLE IF NOT EXISTS "raw_blob" ("hash" BYTEA NOT NULL, "blob" BYTEA NOT NULL, CONSTRAINT "raw_blob_pkey" PRIMARY KEY ("hash"));
+            ALTER TABLE "raw_blob" ALTER COLUMN "blob" SET COMPRESSION lz4;
+            ALTER TABLE "raw_blob" SET (toast_tuple_target = 128);
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS "raw_blob_blob_trgm_idx" ON "raw_blob" USING GIN ((ENCODE("blob", 'escape')) gin_trgm_ops);
+            ALTER TABLE "raw" ADD COLUMN IF NOT EXISTS "blob_hash" BYTEA;
+        """,
+        # Legacy payloads are moved to deduplicated chunks
+        "backfill": """
+            WITH batch AS (
+                SELECT id, ts_start, blob FROM raw WHERE id > {last_id} ORDER BY id LIMIT {batch_size}
+            ), legacy AS (
+                SELECT * FROM batch WHERE blob IS NOT NULL
+            ), blobs AS (
+                INSERT INTO raw_blob (hash, blob)
+                SELECT DISTINCT ON (sha256(blob)) sha256(blob), blob FROM legacy
+                ON CONFLICT DO NOTHING
+            ), updated AS (
+                UPDATE raw SET blob_hash = sha256(legacy.blob), blob = NULL
+                FROM legacy WHERE raw.id = legacy.id AND raw.ts_start = legacy.ts_start
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM updated), (SELECT max(id) FROM batch);
+        """,
+    },
+}
 
 
 # Terminal colors and formatting
@@ -297,7 +480,22 @@ def prompt_for_missing_params(args):
             print_error(f"Unsupported algorithm. Choose from: {', '.join(supported_algorithms)}")
 
 
-def write_env(start_date, target_ip, tick_length, refresh_rate):
+def read_env(path=ENV_FILE):
+    """Read variables from the env file, if any"""
+    env = {}
+    if not os.path.exists(path):
+        return env
+
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                env[key.strip()] = value.strip()
+    return env
+
+
+def write_env(start_date, target_ip, tick_length, refresh_rate, pcap=None):
     if not os.path.exists(ENV_FILE):
         print_warning(f"{ENV_FILE} file not found. Creating new file.")
         with open(ENV_FILE, "w") as f:
@@ -314,6 +512,11 @@ def write_env(start_date, target_ip, tick_length, refresh_rate):
         content += f"TARGET_IP={target_ip}\n"
         content += f"REFRESH_RATE={refresh_rate}\n"
 
+        # Capture rotation and retention, only written when set
+        for key, value in (pcap or {}).items():
+            if value:
+                content += f"{key}={value}\n"
+
         f.write(content)
 
     print_success(f"Environment variables written to {ENV_FILE}")
@@ -321,11 +524,14 @@ def write_env(start_date, target_ip, tick_length, refresh_rate):
     print(f"  {Colors.CYAN}TARGET_IP{Colors.END} = {target_ip}")
     print(f"  {Colors.CYAN}CTF_TICK_LENGTH{Colors.END} = {tick_length}")
     print(f"  {Colors.CYAN}REFRESH_RATE{Colors.END} = {refresh_rate}")
+    for key, value in (pcap or {}).items():
+        if value:
+            print(f"  {Colors.CYAN}{key}{Colors.END} = {value}")
     print()
 
 
-def update_compose(target_ip, key):
-    """Update target IP and SSH key in docker-compose-c.yml"""
+def update_compose(key):
+    """Update SSH key in docker-compose-c.yml, the target IP is read from config/capture.env"""
     compose_file = "docker-compose-c.yml"
 
     supported_algorithms = ["rsa", "ed25519", "ecdsa", "dsa"]
@@ -341,30 +547,178 @@ def update_compose(target_ip, key):
     with open(compose_file, "r") as f:
         content = f.read()
 
-    # Replace the Target IP
-    ip_pattern = r"ssh root@[\d\.:]+ -oStrictHostKeyChecking=no"
-    ip_replacement = f"ssh root@{target_ip} -oStrictHostKeyChecking=no"
-
-    if re.search(ip_pattern, content):
-        modified_content = re.sub(ip_pattern, ip_replacement, content)
-        print_success(f"Updated SSH target IP to {target_ip} in {compose_file}")
-    else:
-        print_error(f"Could not find SSH command pattern in {compose_file}")
-        sys.exit(1)
-
     # Replace the SSH key path
     key_pattern = r"~/.ssh/id_[a-zA-Z0-9_]+:/root/.ssh/id_[a-zA-Z0-9_]+:ro"
     key_replacement = f"~/.ssh/id_{key}:/root/.ssh/id_{key}:ro"
 
-    if re.search(key_pattern, modified_content):
-        modified_content = re.sub(key_pattern, key_replacement, modified_content)
+    if re.search(key_pattern, content):
+        modified_content = re.sub(key_pattern, key_replacement, content)
         print_success(f"Updated SSH key path to use algorithm: {key}")
     else:
         print_error(f"Could not find SSH key pattern in {compose_file}")
         sys.exit(1)
 
-    with open(compose_file, "w") as f:
+    # Replace atomically, images may be building from this file meanwhile
+    with open(compose_file + ".tmp", "w") as f:
         f.write(modified_content)
+    os.replace(compose_file + ".tmp", compose_file)
+
+
+def source_hash(context, excludes=()):
+    """Hash the files of a build context, skipping .dockerignore entries and `excludes`"""
+    patterns = list(excludes)
+    try:
+        with open(os.path.join(context, ".dockerignore")) as f:
+            patterns += [line.strip().rstrip("/") for line in f if line.strip() and not line.startswith("#")]
+    except OSError:
+        pass
+
+    def ignored(path):
+        # Docker always sends the Dockerfile, even when ignored
+        return path != "Dockerfile" and any(
+            fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path.split(os.sep)[0], pattern) for pattern in patterns
+        )
+
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(context):
+        relroot = os.path.relpath(root, context)
+        dirs[:] = sorted(d for d in dirs if not ignored(os.path.normpath(os.path.join(relroot, d))))
+        for name in sorted(files):
+            path = os.path.normpath(os.path.join(relroot, name))
+            if ignored(path):
+                continue
+            digest.update(path.encode() + b"\0")
+            try:
+                with open(os.path.join(root, name), "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+            except OSError:
+                pass
+    return digest.hexdigest()
+
+
+def inline_dockerfile_hash(compose_file, service):
+    """Hash the `dockerfile_inline` of a service, the rest of the compose file does not change its image"""
+    with open(compose_file) as f:
+        content = f.read()
+    match = re.search(rf"^  {re.escape(service)}:\n(?:    .*\n|\n)*?\s+dockerfile_inline: \|\n((?:\s{{8,}}.*\n)+)", content, re.M)
+    return hashlib.sha256(match.group(1).encode() if match else b"").hexdigest()
+
+
+def start_image_build(compose_file, rebuild=False):
+    """Start building in the background, in parallel, the images whose sources changed.
+    Return the build process and the hashes to record once it succeeds, or None."""
+    result = subprocess.run(["docker", "compose", "-f", compose_file, "config", "--services"], capture_output=True, text=True)
+    services = [s for s in result.stdout.split() if s in BUILD_CONTEXTS or s in BUILD_INLINE_SERVICES]
+
+    try:
+        with open(BUILD_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    hashes = {}
+    stale = []
+    for service in services:
+        if service in BUILD_CONTEXTS:
+            hashes[service] = source_hash(*BUILD_CONTEXTS[service])
+        else:
+            hashes[service] = inline_dockerfile_hash(compose_file, service)
+        # Images may also have been removed since the last build
+        image = f"{COMPOSE_PROJECT}-{service}"
+        missing = subprocess.run(["docker", "image", "inspect", image], capture_output=True).returncode != 0
+        if rebuild or missing or cache.get(service) != hashes[service]:
+            stale.append(service)
+
+    if not stale:
+        print_info("Images are up to date, skipping build.")
+        return None
+
+    print_progress(f"Building {', '.join(stale)} in the background, see {BUILD_LOG_FILE}...")
+    log = open(BUILD_LOG_FILE, "w")
+    process = subprocess.Popen(
+        ["docker", "compose", "-f", compose_file, "build", *stale],
+        stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+    )
+    log.close()
+    return process, {service: hashes[service] for service in stale}
+
+
+def wait_image_build(build):
+    """Wait for the background build, then record the hashes of the built images"""
+    if build is None:
+        return
+    process, hashes = build
+
+    print_progress("Waiting for images to be built...")
+    if process.wait() != 0:
+        print_error(f"Failed to build images, last lines of {BUILD_LOG_FILE}:")
+        with open(BUILD_LOG_FILE) as f:
+            print("".join(f.readlines()[-20:]))
+        sys.exit(1)
+
+    try:
+        with open(BUILD_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache.update(hashes)
+    with open(BUILD_CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2)
+    print_success(f"Images built: {', '.join(hashes)}")
+    print()
+
+
+def write_atomic(path, content):
+    """Replace a file atomically, running containers never read a partial file"""
+    with open(path + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def utc_date(date_str):
+    """Convert a YYYY-MM-DDThh:mm+ZZ:zz date to the UTC YYYY-MM-DDThh:mm format of ctf_config.json"""
+    date = datetime.fromisoformat(date_str)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M")
+
+
+def update_runtime_config(values):
+    """Write `./start.py config set` keys to .env, config/capture.env and config/ctf_config.json"""
+    values = {key: value for key, value in values.items() if value is not None}
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+
+    env = read_env()
+    env.update({CONFIG_KEYS[key]: str(value) for key, value in values.items() if CONFIG_KEYS[key]})
+    write_atomic(ENV_FILE, "".join(f"{key}={value}\n" for key, value in env.items()))
+
+    capture = read_env(CAPTURE_ENV_FILE)
+    for key in ("target_ip", "start_date", "tick_length"):
+        if key in values:
+            capture[CONFIG_KEYS[key]] = str(values[key])
+    write_atomic(CAPTURE_ENV_FILE, "".join(f"{key}={value}\n" for key, value in capture.items()))
+
+    # Same defaults as the web interface without config file
+    try:
+        with open(CTF_CONFIG_FILE) as f:
+            ctf_config = json.load(f)
+    except (OSError, ValueError):
+        start = datetime.fromisoformat(values["start_date"]) if "start_date" in values else datetime.now(timezone.utc)
+        ctf_config = {
+            "start_date": utc_date(start.isoformat()),
+            "end_date": utc_date((start + timedelta(hours=8)).isoformat()),
+            "tick_length": 120,
+            "refresh_rate": 120,
+            "services": {},
+        }
+    for key in ("start_date", "end_date"):
+        if key in values:
+            ctf_config[key] = utc_date(values[key])
+    for key in ("tick_length", "refresh_rate"):
+        if key in values:
+            ctf_config[key] = int(values[key])
+    write_atomic(CTF_CONFIG_FILE, json.dumps(ctf_config, indent=2) + "\n")
 
 
 def compose_down(compose_file):
@@ -398,7 +752,7 @@ def compose_down(compose_file):
         return False
 
 
-def compose_up(compose_file, build=True):
+def compose_up(compose_file, build=True, overrides=()):
     """Start containers defined in the specified docker-compose file"""
     
     # Check if compose file exists
@@ -406,7 +760,10 @@ def compose_up(compose_file, build=True):
         print_error(f"Docker compose file not found: {compose_file}")
         sys.exit(1)
 
-    cmd = ["docker", "compose", "-f", compose_file, "up", "-d"]
+    cmd = ["docker", "compose", "-f", compose_file]
+    for override in overrides:
+        cmd += ["-f", override]
+    cmd += ["up", "-d"]
     if build:
         cmd.append("--build")
 
@@ -422,6 +779,16 @@ def compose_up(compose_file, build=True):
         sys.exit(1)
 
 
+def run_psql(sql, compose_file=COMPOSE_FILES["C"], project=None, single_transaction=False):
+    """Run SQL statements inside the Postgres container and return psql output"""
+    cmd = ["docker", "compose"] + (["-p", project] if project else []) + [
+        "-f", compose_file, "exec", "-T", "postgres",
+        "psql", "-U", "postgres", "-v", "ON_ERROR_STOP=1", "-qAt",
+    ] + (["--single-transaction"] if single_transaction else [])
+    result = subprocess.run(cmd, input=sql, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
 def clear_suricata():
     """Clean the Suricata output directory"""
     if not os.path.exists("./suricata/output"):
@@ -449,7 +816,7 @@ def clear_suricata():
 def clear_config():
     """Clear configuration files"""
     
-    files_to_clear = [ENV_FILE, "services_config.json"]
+    files_to_clear = [ENV_FILE, CTF_CONFIG_FILE, CAPTURE_ENV_FILE]
     cleared_files = []
 
     for file_path in files_to_clear:
@@ -467,7 +834,7 @@ def clear_config():
 
 def clear_pcap():
     """Clear PCAP files"""
-    pcap_dir = "./tshark/dumps/"
+    pcap_dir = PCAP_DIR
     if not os.path.exists(pcap_dir):
         print_warning("PCAP directory not found. Skipping clear operation.")
         os.makedirs(pcap_dir, exist_ok=True)
@@ -489,6 +856,404 @@ def clear_pcap():
         print()
 
 
+def select_pcap_segments(keep_ticks=None, max_size=None):
+    """Select closed capture segments to delete, oldest first.
+    Keep the segments of the last `keep_ticks` ticks and at most `max_size` megabytes,
+    select every closed segment when no policy is given."""
+    segments = []
+    for name in os.listdir(PCAP_DIR):
+        m = PCAP_SEGMENT_PATTERN.search(name)
+        if m:
+            path = os.path.join(PCAP_DIR, name)
+            segments.append((int(m.group(1)), name, os.path.getsize(path)))
+    segments.sort()
+
+    if keep_ticks is None and max_size is None:
+        return [name for _, name, _ in segments]
+
+    selected = []
+    if keep_ticks is not None and segments:
+        last_tick = segments[-1][0]
+        selected = [s for s in segments if s[0] <= last_tick - keep_ticks]
+
+    if max_size is not None:
+        kept = segments[len(selected):]
+        total = sum(size for _, _, size in kept)
+        for s in kept:
+            if total <= max_size * 1000 * 1000:
+                break
+            selected.append(s)
+            total -= s[2]
+
+    return [name for _, name, _ in selected]
+
+
+def prune_pcap(keep_ticks=None, max_size=None):
+    """Delete closed capture segments according to the retention policy, without stopping capture"""
+    if not os.path.exists(PCAP_DIR):
+        print_warning("PCAP directory not found. Skipping clear operation.")
+        os.makedirs(PCAP_DIR, exist_ok=True)
+        return
+
+    names = select_pcap_segments(keep_ticks, max_size)
+    if not names:
+        print_info("No closed PCAP segment to delete. Skipping clear operation.")
+        return
+
+    print_progress(f"Deleting {len(names)} closed PCAP segments...")
+
+    # Segments are created by the tshark container as root
+    denied = []
+    for name in names:
+        try:
+            os.remove(os.path.join(PCAP_DIR, name))
+        except PermissionError:
+            denied.append(os.path.join(PCAP_DIR, name))
+        except FileNotFoundError:
+            pass
+
+    try:
+        if denied:
+            subprocess.run(["sudo", "rm", "-f", "--", *denied], check=True)
+        print_success(f"Deleted PCAP segments from {names[0]} to {names[-1]}")
+        print()
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to delete PCAP segments: {e}")
+        print()
+
+
+def shard_input_pcaps(workers):
+    """Stage new and grown input pcaps in one spool directory per worker, balancing their total size.
+    Like the ingest service, files are recorded in the ingest ledger once their worker deleted them.
+    Return the number of files and bytes to replay."""
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    ledger = load_ingest_ledger()
+    files = ledger["files"]
+    settle_ingest_ledger(ledger)
+
+    # Links left by an interrupted replay are spread over the new spools,
+    # unless the ledger was removed and their input pcap is staged again
+    leftover_dir = SHARDS_DIR + ".old"
+    shutil.rmtree(leftover_dir, ignore_errors=True)
+    if os.path.exists(SHARDS_DIR):
+        os.rename(SHARDS_DIR, leftover_dir)
+    spools = [os.path.join(SHARDS_DIR, str(i)) for i in range(workers)]
+    for spool in spools:
+        os.makedirs(spool)
+
+    leftovers = []
+    for root, _, names in os.walk(leftover_dir):
+        for name in names:
+            if "pending" in files.get(name, {}):
+                path = os.path.join(root, name)
+                leftovers.append((os.path.getsize(path), name, path))
+    loads = [0] * workers
+    for size, name, path in sorted(leftovers, reverse=True):
+        i = loads.index(min(loads))
+        os.rename(path, os.path.join(spools[i], name))
+        files[name]["spool"] = spools[i]
+        loads[i] += size
+    shutil.rmtree(leftover_dir, ignore_errors=True)
+
+    stage_input_pcaps(ledger, spools)
+    save_ingest_ledger(ledger)
+
+    total_files = 0
+    total_bytes = 0
+    for spool in spools:
+        for name in os.listdir(spool):
+            total_files += 1
+            total_bytes += os.path.getsize(os.path.join(spool, name))
+    return total_files, total_bytes
+
+
+def write_parallel_compose(workers):
+    """Write the compose file replacing mode A Suricata by `workers` instances.
+    Each instance replays its own spool, and offsets flow ids by its shard number."""
+    services = {"suricata": {"profiles": ["serial"]}, "ingest": {"profiles": ["serial"]}}
+    for i in range(workers):
+        services[f"suricata-{i}"] = {
+            "extends": {"file": COMPOSE_FILES["A"], "service": "suricata"},
+            "volumes": [f"{SHARDS_DIR}/{i}:/input_pcaps:rw"],
+            "command": "-r /input_pcaps --pcap-file-delete",
+            # Share the image of the serial service, built once
+            "image": f"{COMPOSE_PROJECT}-suricata",
+            "depends_on": {"postgres": {"condition": "service_healthy"}},
+            "environment": {
+                "EVE_FLOW_ID_SHARD": str(i),
+                "SURICATA_RUNMODE": "single",
+            },
+        }
+
+    # JSON is valid YAML
+    with open(PARALLEL_COMPOSE_FILE, "w") as f:
+        json.dump({"x-generated-by": f"./start.py start --mode-a --parallel {workers}", "services": services}, f, indent=2)
+        f.write("\n")
+
+
+def write_metrics_compose(mode, workers=1):
+    """Write the compose file enabling EVE metrics and adding a Prometheus server,
+    and its scrape configuration"""
+    eve_services = [f"suricata-{i}" for i in range(workers)] if workers > 1 else ["suricata"]
+    environment = {"EVE_METRICS_ADDR": f"0.0.0.0:{EVE_METRICS_PORT}"}
+    services = {name: {"environment": environment} for name in eve_services}
+
+    prometheus = {
+        "image": "prom/prometheus",
+        "restart": "always",
+        "command": [
+            "--config.file=/etc/prometheus/prometheus.yml",
+            "--storage.tsdb.path=/prometheus",
+            f"--storage.tsdb.retention.time={PROMETHEUS_RETENTION}",
+        ],
+        "volumes": [
+            f"{PROMETHEUS_CONFIG_FILE}:/etc/prometheus/prometheus.yml:ro",
+            "prometheus:/prometheus",
+        ],
+    }
+    if mode == "B":
+        # Suricata shares the host network in mode B
+        prometheus["network_mode"] = "host"
+        prometheus["command"].append("--web.listen-address=127.0.0.1:9090")
+        eve_targets = [f"127.0.0.1:{EVE_METRICS_PORT}"]
+        frontend_target = "127.0.0.1:3000"
+    else:
+        prometheus["ports"] = ["127.0.0.1:9090:9090"]
+        eve_targets = [f"{name}:{EVE_METRICS_PORT}" for name in eve_services]
+        frontend_target = "frontend:3000"
+    services["prometheus"] = prometheus
+
+    config = {
+        "global": {"scrape_interval": "5s"},
+        "scrape_configs": [
+            {"job_name": "eve", "static_configs": [{"targets": eve_targets}]},
+            {"job_name": "frontend", "metrics_path": "/api/metrics", "static_configs": [{"targets": [frontend_target]}]},
+        ],
+    }
+
+    # JSON is valid YAML
+    with open(PROMETHEUS_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    with open(METRICS_COMPOSE_FILE, "w") as f:
+        json.dump({"x-generated-by": "./start.py start --metrics", "services": services, "volumes": {"prometheus": {}}}, f, indent=2)
+        f.write("\n")
+
+
+def running_services(compose_files):
+    """Return the names of running services"""
+    cmd = ["docker", "compose"]
+    for compose_file in compose_files:
+        cmd += ["-f", compose_file]
+    cmd += ["ps", "--services", "--status", "running"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return set(result.stdout.split())
+
+
+def format_duration(seconds):
+    """Format a duration in seconds as h:mm:ss"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def format_count(value):
+    """Format a count with a k/M/G suffix"""
+    for suffix, scale in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if abs(value) >= scale:
+            return f"{value / scale:.1f}{suffix}"
+    return f"{value:.0f}"
+
+
+def monitor_parallel_replay(workers, total_files, total_bytes, interval=5):
+    """Report parallel replay progress until every spool is empty,
+    and record the processed files in the ingest ledger"""
+    compose_files = [COMPOSE_FILES["A"], PARALLEL_COMPOSE_FILE]
+    worker_names = {f"suricata-{i}" for i in range(workers)}
+    started = time.monotonic()
+
+    print_progress(f"Replaying {total_files} files ({total_bytes / 1e9:.2f} GB) with {workers} workers, Ctrl-C to detach...")
+    try:
+        while True:
+            remaining_files = 0
+            remaining_bytes = 0
+            for i in range(workers):
+                spool = os.path.join(SHARDS_DIR, str(i))
+                for name in os.listdir(spool):
+                    remaining_files += 1
+                    remaining_bytes += os.path.getsize(os.path.join(spool, name))
+
+            ledger = load_ingest_ledger()
+            settle_ingest_ledger(ledger)
+            save_ingest_ledger(ledger)
+
+            elapsed = time.monotonic() - started
+            rate = (total_bytes - remaining_bytes) / elapsed if elapsed > 0 else 0
+            eta = format_duration(remaining_bytes / rate) if rate > 0 else "-"
+            print(
+                f"\r  {Colors.CYAN}{total_files - remaining_files}/{total_files}{Colors.END} files"
+                f"  {rate / 1e6:.1f} MB/s  ETA {eta}  ",
+                end="",
+                flush=True,
+            )
+
+            if remaining_files == 0:
+                print()
+                print_success(f"Replay completed in {format_duration(elapsed)}")
+                shutil.rmtree(SHARDS_DIR, ignore_errors=True)
+                break
+            if not worker_names & running_services(compose_files):
+                print()
+                print_warning(f"All workers stopped with {remaining_files} files left, see './start.py logs'")
+                break
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+        print_info("Detached, replay continues in background.")
+    print()
+
+
+def load_ingest_ledger():
+    """Load the ingest ledger, `files` maps input pcap names to their ingested state"""
+    try:
+        with open(INGEST_LEDGER_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}, "last_mtime": 0}
+
+
+def save_ingest_ledger(ledger):
+    """Atomically write the ingest ledger"""
+    tmp_file = INGEST_LEDGER_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(ledger, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, INGEST_LEDGER_FILE)
+
+
+def settle_ingest_ledger(ledger):
+    """Record staged files as ingested once Suricata deleted them from their spool"""
+    for name, entry in ledger["files"].items():
+        if "pending" in entry and not os.path.exists(os.path.join(entry.get("spool", INGEST_SPOOL_DIR), name)):
+            entry["size"] = entry.pop("pending")
+            entry.pop("spool", None)
+
+
+def pcap_head_digest(path, size):
+    """Hash the first bytes of a file, at most `INGEST_HASH_SIZE` and `size`"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(min(size, INGEST_HASH_SIZE))).hexdigest()
+
+
+def pcap_preamble(path):
+    """Return the bytes preceding the first packet of a capture file:
+    the classic pcap header, or the pcapng section header and interface blocks"""
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"\x0a\x0d\x0d\x0a":
+            return header + f.read(12)
+
+        endian = "<" if header[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+        offset = 0
+        while True:
+            f.seek(offset)
+            block = f.read(8)
+            if len(block) < 8:
+                break
+            block_type, length = struct.unpack(endian + "II", block)
+            # Packet, simple packet and enhanced packet blocks
+            if block_type in (2, 3, 6) or length < 12:
+                break
+            offset += length
+
+        f.seek(0)
+        return f.read(offset)
+
+
+def stage_input_pcaps(ledger, spools=None):
+    """Stage new and grown input pcaps in the ingest spool, return the number of staged files.
+    New files are hardlinked, only the packets appended to grown files are copied.
+    Suricata deletes staged files once processed, which marks them as ingested.
+    With several `spools`, each file goes to the spool holding the fewest bytes."""
+    spools = spools or [INGEST_SPOOL_DIR]
+    for spool in spools:
+        os.makedirs(spool, exist_ok=True)
+    files = ledger["files"]
+    settle_ingest_ledger(ledger)
+
+    candidates = []
+    now = time.time()
+    for name in os.listdir(INPUT_PCAPS_DIR):
+        path = os.path.join(INPUT_PCAPS_DIR, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = files.get(name)
+        if entry is not None and "pending" in entry:
+            continue
+        if entry is not None and entry["size"] == stat.st_size:
+            # Unchanged, or rewritten with the same size
+            if entry["mtime"] == int(stat.st_mtime):
+                continue
+            if pcap_head_digest(path, stat.st_size) == entry["sha256"]:
+                entry["mtime"] = int(stat.st_mtime)
+                continue
+            entry["size"] = 0
+        if now - stat.st_mtime < INGEST_SETTLE_TIME:
+            continue
+        candidates.append((stat.st_mtime, name, stat.st_size))
+
+    loads = [0] * len(spools)
+    if len(spools) > 1:
+        for i, spool in enumerate(spools):
+            loads[i] = sum(os.path.getsize(os.path.join(spool, name)) for name in os.listdir(spool))
+        # Largest files first balances the spools, their order only matters to a continuous replay
+        candidates.sort(key=lambda c: c[2], reverse=True)
+    else:
+        candidates.sort()
+
+    # Suricata only replays files more recent than the last one it processed
+    mtime = max(int(now) - len(candidates), ledger["last_mtime"] + 1)
+    for _, name, size in candidates:
+        path = os.path.join(INPUT_PCAPS_DIR, name)
+        spool = spools[loads.index(min(loads))]
+        spool_path = os.path.join(spool, name)
+        entry = files.get(name)
+
+        if entry is not None and 0 < entry["size"] < size and pcap_head_digest(path, entry["size"]) == entry["sha256"]:
+            tmp_path = os.path.join(INGEST_DIR, name + ".tmp")
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                dst.write(pcap_preamble(path))
+                src.seek(entry["size"])
+                remaining = size - entry["size"]
+                while remaining > 0:
+                    chunk = src.read(min(remaining, 4 * 1024 * 1024))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+            os.utime(tmp_path, (mtime, mtime))
+            os.replace(tmp_path, spool_path)
+        else:
+            # New, replaced or truncated file; the mtime of the hardlinked input pcap changes too
+            entry = {"size": 0}
+            os.link(path, spool_path)
+            os.utime(spool_path, (mtime, mtime))
+
+        files[name] = {
+            "size": entry["size"],
+            "pending": size,
+            "spool": spool,
+            "mtime": int(os.stat(path).st_mtime),
+            "sha256": pcap_head_digest(path, size),
+        }
+        loads[spools.index(spool)] += os.path.getsize(spool_path)
+        ledger["last_mtime"] = mtime
+        mtime += 1
+
+    return len(candidates)
+
+
 def get_compose_file_for_mode(mode):
     """Get the appropriate compose file for the given mode"""
     return COMPOSE_FILES.get(mode.upper(), COMPOSE_FILES["C"])
@@ -510,6 +1275,9 @@ def handle_start_command(args):
 
     compose_file = get_compose_file_for_mode(mode)
 
+    # Build changed images while containers stop and parameters are prompted
+    build = None if args.no_build else start_image_build(compose_file, args.rebuild)
+
     # Stop existing containers
     compose_down(compose_file)
 
@@ -586,12 +1354,34 @@ def handle_start_command(args):
                 print_error("Invalid input. Please enter 'y' or 'n'.")
 
     # Mode-specific initialization
+    overrides = []
+    replay = None
     if mode == "A":
         print_progress("Initializing mode A (pcap replay)...")
         if not os.path.exists(compose_file):
             print_error(f"Docker compose file not found: {compose_file}")
             sys.exit(1)
 
+        if not 1 <= args.parallel <= 4096:
+            print_error("Number of parallel workers must be between 1 and 4096")
+            sys.exit(1)
+        if args.reingest and os.path.exists(INGEST_LEDGER_FILE):
+            try:
+                os.remove(INGEST_LEDGER_FILE)
+            except PermissionError:
+                subprocess.run(["sudo", "rm", "-f", "--", INGEST_LEDGER_FILE], check=True)
+            print_warning("Ingest ledger removed, every input pcap will be replayed.")
+
+        if args.parallel > 1:
+            try:
+                replay = shard_input_pcaps(args.parallel)
+            except OSError as e:
+                print_error(f"Failed to shard input pcaps: {e}")
+                sys.exit(1)
+            write_parallel_compose(args.parallel)
+            overrides.append(PARALLEL_COMPOSE_FILE)
+            print_success(f"Sharded {replay[0]} input pcaps over {args.parallel} workers")
+
     elif mode == "B":
         print_progress("Initializing mode B (capture interface)...")
         if not os.path.exists(compose_file):
@@ -618,29 +1408,51 @@ def handle_start_command(args):
             target_ip=args.target_ip,
             tick_length=args.tick_length,
             refresh_rate=args.refresh_rate,
+            pcap={
+                "PCAP_ROTATE_SIZE": args.pcap_rotate_size,
+                "PCAP_COMPRESS": "zstd" if args.pcap_compress else None,
+                "PCAP_KEEP_TICKS": args.pcap_keep_ticks,
+                "PCAP_MAX_SIZE": args.pcap_max_size,
+            },
         )
-        update_compose(target_ip=args.target_ip, key=args.key)
+        update_compose(key=args.key)
 
-        # Create a new file 'services_config.json' empty
-        json_config = "services_config.json"
-        if not os.path.exists(json_config):
-            print_info(f"Creating empty {json_config} file.")
-            with open(json_config, "w") as f:
-                f.write("{}")
+        # Target, start date and ticks shared with running containers
+        update_runtime_config({
+            "target_ip": args.target_ip,
+            "start_date": args.start_date,
+            "tick_length": args.tick_length,
+            "refresh_rate": args.refresh_rate,
+        })
+        print_success(f"Runtime configuration written to {CONFIG_DIR}")
+
+    if args.metrics:
+        write_metrics_compose(mode, args.parallel if mode == "A" else 1)
+        overrides.append(METRICS_COMPOSE_FILE)
 
     print_separator(char="═")
     print_success("Configuration completed successfully!")
     print_separator(char="═")
     print()
 
+    # Mounted by the web interface in every mode, created here so that Docker does not create it as root
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+
     # Start the containers using the selected docker-compose file
-    compose_up(compose_file, not args.no_build)
+    wait_image_build(build)
+    compose_up(compose_file, False, overrides)
 
     print_separator(char="═")
     print_success(f"Digger successfully started in mode {mode}!")
     print(f"  {Colors.BOLD}Web interface:{Colors.END} {Colors.CYAN}http://127.0.0.1:8000{Colors.END}")
+    if args.metrics:
+        print(f"  {Colors.BOLD}Prometheus:{Colors.END} {Colors.CYAN}http://127.0.0.1:9090{Colors.END}")
     print_separator(char="═")
 
+    if replay is not None:
+        print()
+        monitor_parallel_replay(args.parallel, *replay)
+
 
 def handle_stop_command():
     """Handle the stop command"""
@@ -776,8 +1588,14 @@ def handle_clear_command(args):
         cleared_items.append("Suricata output")
 
     if args.pcap:
-        # Clear PCAP files - check if directory exists
-        clear_pcap()
+        # Delete closed segments only, the configured retention policy applies by default
+        env = read_env()
+        keep_ticks = args.keep_ticks if args.keep_ticks is not None else env.get("PCAP_KEEP_TICKS")
+        max_size = args.max_size if args.max_size is not None else env.get("PCAP_MAX_SIZE")
+        prune_pcap(
+            keep_ticks=int(keep_ticks) if keep_ticks is not None else None,
+            max_size=int(max_size) if max_size is not None else None,
+        )
         cleared_items.append("PCAP files")
 
     if cleared_items:
@@ -848,6 +1666,798 @@ def handle_logs_command(args):
         sys.exit(1)
 
 
+def handle_migrate_command(args):
+    """Handle the migrate command - apply schema migrations on a running database"""
+    print_progress("Migrating database...")
+
+    if not os.path.exists(MIGRATIONS_DIR):
+        print_error(f"Migrations directory not found: {MIGRATIONS_DIR}")
+        sys.exit(1)
+
+    try:
+        run_psql("SELECT 1;")
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to reach Postgres: {e.stderr.strip() if e.stderr else e}")
+        print_info("Make sure the postgres container is running.")
+        sys.exit(1)
+
+    # Same bookkeeping as diesel, so that Suricata does not apply these migrations again when it starts
+    applied = set(run_psql(
+        "CREATE TABLE IF NOT EXISTS __diesel_schema_migrations ("
+        "version VARCHAR(50) PRIMARY KEY NOT NULL, run_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);"
+        "SELECT version FROM __diesel_schema_migrations;"
+    ).split())
+
+    migrations = sorted(os.listdir(MIGRATIONS_DIR))
+    for i, name in enumerate(migrations):
+        version = name.split("_", 1)[0]
+        if version in applied:
+            continue
+
+        # Migrations build on the schema of their predecessors, e.g. triggers of earlier migrations
+        missing = [m for m in migrations[:i] if m.split("_", 1)[0] not in applied]
+        if missing:
+            print_error(f"Refusing to apply {name}, previous migrations are not applied: {', '.join(missing)}")
+            sys.exit(1)
+
+        up_file = os.path.join(MIGRATIONS_DIR, name, "up.sql")
+        if not os.path.exists(up_file):
+            print_error(f"Migration not found: {up_file}")
+            sys.exit(1)
+
+        steps = ONLINE_MIGRATIONS.get(name, {})
+        total = 0
+        try:
+            if "prepare" in steps:
+                print_progress(f"Preparing {name}...")
+                run_psql(steps["prepare"])
+
+            if "backfill" in steps:
+                print_progress(f"Backfilling {name} ({args.batch_size} rows per batch)...")
+                # Below any id, flow ids are signed 64-bit hashes. Written as a bigint
+                # expression: the literal -9223372036854775808 is numeric and defeats the index.
+                last_id = "(-9223372036854775807 - 1)"
+                while True:
+                    updated, _, last = run_psql(
+                        steps["backfill"].format(batch_size=args.batch_size, last_id=last_id)
+                    ).partition("|")
+                    total += int(updated or 0)
+                    if not last:
+                        break
+                    last_id = int(last)
+                    print(f"  {Colors.CYAN}{total}{Colors.END} rows updated", end="\r", flush=True)
+
+            # The migration and its version are committed together, or not at all.
+            # A Suricata instance starting meanwhile holds the same lock while it migrates,
+            # the version is checked again once the lock is granted.
+            with open(up_file, "r") as f:
+                output = run_psql(
+                    f"SELECT pg_advisory_xact_lock({MIGRATIONS_LOCK_ID});\n"
+                    f"SELECT EXISTS (SELECT 1 FROM __diesel_schema_migrations WHERE version = '{version}') AS done \\gset\n"
+                    "\\if :done\nSELECT 'skipped';\n\\else\n"
+                    + f.read()
+                    + f"\nINSERT INTO __diesel_schema_migrations (version) VALUES ('{version}');\n\\endif\n",
+                    single_transaction=True,
+                )
+        except subprocess.CalledProcessError as e:
+            print_error(f"Failed to apply {name}: {e.stderr.strip() if e.stderr else e}")
+            sys.exit(1)
+
+        applied.add(version)
+        if output.endswith("skipped"):
+            print_info(f"{name} was applied by Suricata meanwhile")
+        else:
+            print_success(f"Applied {name} ({total} rows backfilled)")
+
+    print()
+
+
+def handle_ingest_command(args):
+    """Handle the ingest command - stage new and grown input pcaps for Suricata in mode A"""
+    if not os.path.exists(INPUT_PCAPS_DIR):
+        print_error(f"Input pcaps directory not found: {INPUT_PCAPS_DIR}")
+        sys.exit(1)
+
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    ledger = load_ingest_ledger()
+    print_info(f"Ingest ledger: {len(ledger['files'])} known input pcaps")
+
+    while True:
+        staged = stage_input_pcaps(ledger)
+        save_ingest_ledger(ledger)
+        if staged:
+            print_success(f"Staged {staged} new or grown input pcaps")
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+
+def parse_duration(value):
+    """Convert a duration such as 90m, 12h, 2d or 30t (ticks) to seconds"""
+    match = re.fullmatch(r"(\d+)([smhdt])", value.strip().lower())
+    if not match:
+        return None
+
+    count, unit = int(match.group(1)), match.group(2)
+    if unit == "t":
+        tick_length = read_env().get("CTF_TICK_LENGTH")
+        if not tick_length:
+            print_error(f"CTF_TICK_LENGTH not found in {ENV_FILE}, durations in ticks are unavailable.")
+            sys.exit(1)
+        return count * int(tick_length)
+    return count * DURATION_UNITS[unit]
+
+
+def handle_prune_command(args):
+    """Handle the prune command - drop the hourly partitions of flows older than a duration"""
+    seconds = parse_duration(args.older_than)
+    if seconds is None:
+        print_error(f"Invalid duration: {args.older_than} (expected e.g. 90m, 12h, 2d or 30t)")
+        sys.exit(1)
+
+    # Age is measured from the newest flow, replayed captures may be older than the wall clock
+    try:
+        newest = run_psql("SELECT max(ts_start) FROM flow;")
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to reach Postgres: {e.stderr.strip() if e.stderr else e}")
+        print_info("Make sure the postgres container is running.")
+        sys.exit(1)
+    if not newest:
+        print_info("No flow in database. Nothing to prune.")
+        return
+
+    cutoff = int(newest) - seconds * 1000000
+    cutoff_date = datetime.fromtimestamp(cutoff / 1000000, timezone.utc).strftime("%Y-%m-%d %H:00 UTC")
+    print_progress(f"Pruning flows before {cutoff_date}...")
+    try:
+        # Hours spanned by a flow still running at the cutoff are kept
+        cutoff = run_psql(f"SELECT time_partitions_cutoff({cutoff});")
+        partitions = run_psql(f"SELECT * FROM time_partitions_before({cutoff or 'NULL'});").splitlines()
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to prune: {e.stderr.strip() if e.stderr else e}")
+        sys.exit(1)
+
+    if args.dry_run:
+        for line in partitions:
+            print(f"  {Colors.CYAN}{line.split('|')[1]}{Colors.END}")
+        print_info(f"{len(partitions)} partitions would be dropped")
+        print()
+        return
+
+    # One short transaction per partition: detaching concurrently does not block writers,
+    # and a partition is dropped as soon as no query reads it.
+    dropped = 0
+    try:
+        for line in partitions:
+            parent, name, detach_pending = line.split("|")
+            if parent:
+                mode = "FINALIZE" if detach_pending == "t" else "CONCURRENTLY"
+                run_psql(f'ALTER TABLE "{parent}" DETACH PARTITION "{name}" {mode};')
+            run_psql(f"SELECT drop_time_partition('{name}');")
+            print(f"  {Colors.CYAN}{name}{Colors.END}")
+            dropped += 1
+        if cutoff:
+            run_psql(f"SELECT delete_time_rows({cutoff});")
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to prune: {e.stderr.strip() if e.stderr else e}")
+        sys.exit(1)
+    print_success(f"Dropped {dropped} partitions")
+
+    # Chunks of dropped payloads, batches do not block writers referencing other chunks
+    collected = 0
+    try:
+        while True:
+            checked = int(run_psql(f"SELECT collect_raw_blobs({args.batch_size});"))
+            if checked == 0:
+                break
+            collected += checked
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to delete unreferenced payload chunks: {e.stderr.strip() if e.stderr else e}")
+        sys.exit(1)
+    if collected:
+        print_success(f"Deleted the unreferenced chunks among {collected} chunks of dropped payloads")
+    print()
+
+
+TOP_SQL = """
+SELECT json_build_object(
+    'tables', (
+        SELECT json_object_agg(name, inserted) FROM (
+            SELECT COALESCE(p.relname, c.relname) AS name, sum(s.n_tup_ins) AS inserted
+            FROM pg_stat_user_tables s
+            JOIN pg_class c ON c.oid = s.relid
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            LEFT JOIN pg_class p ON p.oid = i.inhparent
+            GROUP BY 1
+        ) t
+    ),
+    'newest_flow', (SELECT max(ts_start) FROM flow),
+    'ingest', (
+        SELECT json_object_agg(source, stats || jsonb_build_object('age', extract(epoch FROM now() - updated_at)))
+        FROM ingest_stats
+    )
+);
+"""
+
+
+def read_suricata_stats(path=SURICATA_STATS_LOG):
+    """Return the date and counters of the last block of Suricata stats.log"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - 256 * 1024))
+            text = f.read().decode(errors="replace")
+    except OSError:
+        return None, {}
+
+    # Blocks start with a "Date: ..." line, the last one may still be written
+    blocks = text.split("\nDate: ")
+    for block in reversed(blocks[1:-1] if len(blocks) > 2 else blocks[1:]):
+        counters = {}
+        for line in block.splitlines()[1:]:
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2].isdigit():
+                counters[fields[0]] = int(fields[2])
+        if counters:
+            return block.split(" (uptime")[0].strip(), counters
+    return None, {}
+
+
+def docker_api(path):
+    """Send a GET request to the Docker Engine API and return the decoded JSON response"""
+    conn = http.client.HTTPConnection("localhost", timeout=5)
+    conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.sock.settimeout(5)
+    conn.sock.connect(DOCKER_SOCKET)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def sample_containers():
+    """Return CPU time, system time and memory usage of the running Digger containers"""
+    filters = json.dumps({"label": [f"com.docker.compose.project.working_dir={os.getcwd()}"]})
+    samples = {}
+    for container in docker_api(f"/containers/json?filters={filters}"):
+        stats = docker_api(f"/containers/{container['Id']}/stats?stream=false&one-shot=true")
+        memory = stats.get("memory_stats", {})
+        # Page cache is reclaimable, `docker stats` does not count it either
+        cache = memory.get("stats", {}).get("inactive_file", memory.get("stats", {}).get("cache", 0))
+        cpu = stats.get("cpu_stats", {})
+        samples[container["Labels"].get("com.docker.compose.service", container["Names"][0])] = {
+            "cpu": cpu.get("cpu_usage", {}).get("total_usage", 0),
+            "system": cpu.get("system_cpu_usage", 0),
+            "cpus": cpu.get("online_cpus", 1),
+            "memory": memory.get("usage", 0) - cache,
+        }
+    return samples
+
+
+def sample_top():
+    """Collect one sample of database, ingest, Suricata and container statistics"""
+    sample = {"time": time.time(), "errors": []}
+    try:
+        sample["db"] = json.loads(run_psql(TOP_SQL))
+    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        sample["db"] = {}
+        sample["errors"].append(f"Postgres: {e.stderr.strip() if getattr(e, 'stderr', None) else e}")
+    sample["suricata_date"], sample["suricata"] = read_suricata_stats()
+    try:
+        sample["containers"] = sample_containers()
+    except (OSError, ValueError) as e:
+        sample["containers"] = {}
+        sample["errors"].append(f"Docker API ({DOCKER_SOCKET}): {e}")
+    return sample
+
+
+def render_top(prev, cur, suricata_prev):
+    """Print the dashboard of `./start.py top` from two consecutive samples"""
+    elapsed = max(cur["time"] - prev["time"], 1e-3)
+
+    def rate(new, old):
+        return (new - old) / elapsed
+
+    lines = [
+        f"{Colors.BOLD}Digger top{Colors.END} - {datetime.now().strftime('%H:%M:%S')} (Ctrl-C to quit)",
+        "",
+        f"{Colors.BOLD}Ingest{Colors.END}",
+    ]
+    newest = cur["db"].get("newest_flow")
+    if newest:
+        lag = cur["time"] - newest / 1e6
+        color = Colors.GREEN if lag < 60 else Colors.YELLOW if lag < 300 else Colors.RED
+        lines.append(f"  {'lag':<24}{color}{format_duration(max(lag, 0))}{Colors.END} since the newest flow start")
+    else:
+        lines.append(f"  {'lag':<24}no flow yet")
+
+    ingest, ingest_prev = cur["db"].get("ingest") or {}, prev["db"].get("ingest") or {}
+    for source, stats in sorted(ingest.items()):
+        old = ingest_prev.get(source, stats)
+        if source.startswith("eve-"):
+            fields = [
+                f"received {format_count(rate(stats['received'], old['received']))}/s",
+                f"inserted {format_count(rate(stats['inserted'], old['inserted']))}/s",
+                f"queued {stats['queued']}",
+                f"failed {format_count(stats['failed'])}",
+            ]
+        else:
+            fields = [
+                f"chunks {format_count(rate(stats['chunks'], old['chunks']))}/s",
+                f"{format_count(rate(stats['bytes'], old['bytes']))}B/s",
+                f"pending {stats['pending']}",
+                f"errors {format_count(stats['errors'])}",
+            ]
+        stale = f" {Colors.YELLOW}(updated {stats['age']:.0f}s ago){Colors.END}" if stats["age"] > 10 else ""
+        lines.append(f"  {source:<24}{'  '.join(fields)}{stale}")
+
+    lines += ["", f"{Colors.BOLD}Rows inserted{Colors.END}"]
+    tables, tables_prev = cur["db"].get("tables") or {}, prev["db"].get("tables") or {}
+    for name in ["flow", "raw", "raw_blob", "alert", "app_event", "fileinfo", "anomaly"]:
+        if name in tables:
+            lines.append(f"  {name:<24}{format_count(rate(tables[name], tables_prev.get(name, tables[name])))}/s"
+                         f"  total {format_count(tables[name])}")
+
+    lines += ["", f"{Colors.BOLD}Suricata{Colors.END} (stats.log {cur['suricata_date'] or 'not found'})"]
+    counters = cur["suricata"]
+    old_counters, old_date = suricata_prev
+    for name in TOP_SURICATA_COUNTERS:
+        if name in counters:
+            delta = counters[name] - old_counters.get(name, counters[name])
+            lines.append(f"  {name:<24}{format_count(counters[name]):<10}+{format_count(delta)} since {old_date or 'start'}")
+    packets, drops = counters.get("capture.kernel_packets"), counters.get("capture.kernel_drops")
+    if packets:
+        ratio = 100 * (drops or 0) / packets
+        color = Colors.GREEN if ratio < 0.1 else Colors.YELLOW if ratio < 1 else Colors.RED
+        lines.append(f"  {'drop ratio':<24}{color}{ratio:.2f}%{Colors.END}")
+
+    lines += ["", f"{Colors.BOLD}Containers{Colors.END}"]
+    for name, usage in sorted(cur["containers"].items()):
+        old = prev["containers"].get(name)
+        cpu = 0
+        if old and usage["system"] > old["system"]:
+            cpu = 100 * usage["cpus"] * (usage["cpu"] - old["cpu"]) / (usage["system"] - old["system"])
+        lines.append(f"  {name:<24}cpu {cpu:5.1f}%  mem {format_count(usage['memory'])}B")
+
+    for error in cur["errors"]:
+        lines.append(f"{Colors.RED}[✗]{Colors.END} {error}")
+
+    # Redraw from the top left corner
+    print("\033[H\033[2J" + "\n".join(lines), flush=True)
+
+
+def handle_top_command(args):
+    """Handle the top command - live dashboard of ingest throughput and health"""
+    prev = sample_top()
+    # Suricata dumps counters every few seconds, deltas are shown against the previous dump
+    suricata_prev, suricata_last = ({}, None), (prev["suricata"], prev["suricata_date"])
+    try:
+        while True:
+            time.sleep(args.interval)
+            cur = sample_top()
+            if cur["suricata_date"] != suricata_last[1]:
+                suricata_prev, suricata_last = suricata_last, (cur["suricata"], cur["suricata_date"])
+            render_top(prev, cur, (suricata_prev[0], suricata_prev[1]))
+            prev = cur
+    except KeyboardInterrupt:
+        print()
+
+
+def inet_checksum(data):
+    """Compute the Internet checksum of IPv4 and TCP headers"""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def bench_packet(src, dst, sport, dport, seq, ack, flags, payload=b""):
+    """Build an Ethernet frame of one IPv4 TCP segment"""
+    tcp = struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, flags, 65535, 0, 0) + payload
+    pseudo = struct.pack("!4s4sBBH", src, dst, 0, 6, len(tcp))
+    tcp = tcp[:16] + struct.pack("!H", inet_checksum(pseudo + tcp)) + tcp[18:]
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp), 0, 0x4000, 64, 6, 0, src, dst)
+    ip = ip[:10] + struct.pack("!H", inet_checksum(ip)) + ip[12:]
+    return b"\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01\x08\x00" + ip + tcp
+
+
+def bench_flag(rng):
+    """Return a random flag matching the CINI flag rules of suricata/rules/suricata.rules"""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    return (
+        rng.choice("0123456789") + rng.choice(alphabet) + rng.choice("012")
+        + "".join(rng.choices(alphabet, k=28)) + "="
+    )
+
+
+def bench_conversation(rng, http, role):
+    """Return the client and server messages of one flow, and the flags it carries"""
+    flag = bench_flag(rng) if role != "benign" else None
+    note = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz ", k=rng.randint(16, 512)))
+    if http:
+        body = f"note={flag if role == 'checker' else note}".encode()
+        request = (
+            f"POST /api/notes/{rng.randint(1, 99999)} HTTP/1.1\r\nHost: service\r\n"
+            f"User-Agent: python-requests/2.32.3\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode() + body
+        content = f"{{\"note\": \"{flag if role == 'attacker' else note}\"}}".encode()
+        response = (
+            f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(content)}\r\n\r\n"
+        ).encode() + content
+        messages = [(False, request), (True, response)]
+    else:
+        messages = [(True, b"Welcome! Choose an option:\n1. Store\n2. Retrieve\n> ")]
+        for _ in range(rng.randint(1, 4)):
+            messages.append((False, rng.choice([b"1\n", b"2\n"])))
+            messages.append((True, f"Content: {note[:rng.randint(8, 64)]}\n> ".encode()))
+        if role == "checker":
+            messages += [(False, f"1\n{flag}\n".encode()), (True, b"Stored!\n> ")]
+        elif role == "attacker":
+            messages += [(False, b"2\n../../../data/*\n"), (True, f"{flag}\n> ".encode())]
+    return messages, flag
+
+
+def write_bench_corpus(seed, flows, services, teams):
+    """Write a synthetic attack-defense pcap corpus to BENCH_CORPUS_DIR and return its manifest.
+    The same parameters always produce the same files."""
+    rng = random.Random(seed)
+    shutil.rmtree(BENCH_CORPUS_DIR, ignore_errors=True)
+    os.makedirs(BENCH_CORPUS_DIR)
+
+    vulnbox = socket.inet_aton("10.60.1.1")
+    checker = socket.inet_aton("10.10.0.1")
+    # Odd ports are HTTP services, even ones line based services
+    ports = [8000 + i for i in range(services)]
+    manifest = {
+        "seed": seed, "flows": flows, "services": services, "teams": teams,
+        "files": 0, "packets": 0, "bytes": 0, "flags_in": 0, "flags_out": 0, "search": None,
+    }
+
+    ts = BENCH_EPOCH * 1_000_000
+    f = None
+    for i in range(flows):
+        if i % BENCH_FLOWS_PER_FILE == 0:
+            if f:
+                f.close()
+            f = open(os.path.join(BENCH_CORPUS_DIR, f"bench-{manifest['files']:04d}.pcap"), "wb")
+            f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+            manifest["files"] += 1
+
+        port = rng.choice(ports)
+        role = rng.choices(["benign", "checker", "attacker"], weights=[5, 2, 3])[0]
+        client = checker if role == "checker" else socket.inet_aton(f"10.60.{rng.randint(2, teams + 1)}.1")
+        messages, flag = bench_conversation(rng, port % 2 == 1, role)
+        if role == "checker":
+            manifest["flags_in"] += 1
+        elif role == "attacker":
+            manifest["flags_out"] += 1
+            manifest["search"] = manifest["search"] or flag
+
+        sport = rng.randint(32768, 60999)
+        seqs = {False: rng.getrandbits(32), True: rng.getrandbits(32)}
+        packets = []
+
+        def segment(from_server, flags, payload=b""):
+            src, dst, a, b = (vulnbox, client, port, sport) if from_server else (client, vulnbox, sport, port)
+            ack = seqs[not from_server] if flags & 0x10 else 0
+            packets.append(bench_packet(src, dst, a, b, seqs[from_server], ack, flags, payload))
+            seqs[from_server] = (seqs[from_server] + len(payload) + (1 if flags & 0x03 else 0)) % 2**32
+
+        segment(False, 0x02)
+        segment(True, 0x12)
+        segment(False, 0x10)
+        for from_server, data in messages:
+            for offset in range(0, len(data), 1400):
+                segment(from_server, 0x18, data[offset:offset + 1400])
+            segment(not from_server, 0x10)
+        segment(False, 0x11)
+        segment(True, 0x11)
+        segment(False, 0x10)
+
+        for packet in packets:
+            ts += rng.randint(50, 2000)
+            f.write(struct.pack("<IIII", ts // 1_000_000, ts % 1_000_000, len(packet), len(packet)))
+            f.write(packet)
+            manifest["packets"] += 1
+            manifest["bytes"] += len(packet)
+        # Flows of a service start every few milliseconds
+        ts += rng.randint(1000, 20000)
+    if f:
+        f.close()
+
+    with open(BENCH_MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def write_bench_compose():
+    """Write the compose file replaying the benchmark corpus once in mode A"""
+    services = {
+        "ingest": {"profiles": ["disabled"]},
+        "suricata": {
+            "volumes": [
+                f"{BENCH_CORPUS_DIR}:/input_pcaps:ro",
+                f"{BENCH_OUTPUT_DIR}:/suricata/output:rw",
+            ],
+            "command": "-r /input_pcaps",
+            "restart": "no",
+        },
+        "frontend": {"volumes": [f"{BENCH_OUTPUT_DIR}:/suricata/output:ro"]},
+    }
+
+    # JSON is valid YAML
+    with open(BENCH_COMPOSE_FILE, "w") as f:
+        json.dump({"x-generated-by": "./start.py bench", "services": services}, f, indent=2)
+        f.write("\n")
+
+
+def bench_compose(*args):
+    """Run a docker compose command in the benchmark project"""
+    cmd = ["docker", "compose", "-p", BENCH_PROJECT, "-f", COMPOSE_FILES["A"], "-f", BENCH_COMPOSE_FILE, *args]
+    return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+
+
+def bench_psql(sql):
+    """Run SQL statements in the benchmark database"""
+    return run_psql(sql, COMPOSE_FILES["A"], project=BENCH_PROJECT)
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values, by nearest rank"""
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))]
+
+
+def bench_api(requests, rng, search):
+    """Time the main API endpoints, return latency percentiles in milliseconds per endpoint"""
+    def filters(**extra):
+        return urllib.parse.quote(json.dumps({"tags_require": [], "tags_deny": [], **extra}))
+
+    with urllib.request.urlopen(f"{BENCH_API_URL}/api/flow?filters={filters()}", timeout=60) as response:
+        flow_ids = [flow["id"] for flow in json.load(response)["flows"]]
+    endpoints = {
+        "flows": lambda: f"/api/flow?filters={filters()}",
+        "flows_tag": lambda: f"/api/flow?filters={filters(tags_require=['FLAG OUT'])}",
+        "flows_search": lambda: f"/api/flow?filters={filters(search=search)}",
+        "flow": lambda: f"/api/flow/{rng.choice(flow_ids)}",
+        "flow_raw": lambda: f"/api/flow/{rng.choice(flow_ids)}/raw",
+        "stats": lambda: "/api/stats",
+    }
+
+    results = {}
+    for name, path in endpoints.items():
+        latencies = []
+        errors = 0
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(BENCH_API_URL + path(), timeout=60) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            "requests": requests,
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        }
+    return results
+
+
+def git_revision():
+    """Return the current commit hash, with a -dirty suffix for uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+BENCH_SIZE_SQL = """
+SELECT json_build_object(
+    'database_bytes', pg_database_size(current_database()),
+    'tables', (
+        SELECT json_object_agg(name, bytes) FROM (
+            SELECT COALESCE(p.relname, c.relname) AS name, sum(pg_total_relation_size(c.oid)) AS bytes
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = 'public'
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            LEFT JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relkind = 'r'
+            GROUP BY 1
+        ) t
+    ),
+    'rows', json_build_object(
+        'flow', (SELECT count(*) FROM flow),
+        'alert', (SELECT count(*) FROM alert),
+        'app_event', (SELECT count(*) FROM app_event),
+        'fileinfo', (SELECT count(*) FROM fileinfo),
+        'anomaly', (SELECT count(*) FROM anomaly),
+        'raw', (SELECT count(*) FROM raw)
+    )
+);
+"""
+
+
+def handle_bench_command(args):
+    """Handle the bench command - replay a synthetic corpus end to end and report throughput as JSON"""
+    result = subprocess.run(
+        ["docker", "ps", "-q", "--filter", "label=com.docker.compose.project=digger"],
+        capture_output=True, text=True,
+    )
+    if result.stdout.strip():
+        print_error("Digger is running, stop it first: the benchmark uses the same ports.")
+        sys.exit(1)
+
+    # The corpus is only generated again when its parameters change
+    params = {"seed": args.seed, "flows": args.flows, "services": args.services, "teams": args.teams}
+    manifest = None
+    try:
+        with open(BENCH_MANIFEST_FILE) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if manifest is None or any(manifest.get(k) != v for k, v in params.items()):
+        print_progress(f"Generating corpus of {args.flows} flows over {args.services} services...")
+        manifest = write_bench_corpus(**params)
+    print_info(f"Corpus: {manifest['files']} files, {manifest['packets']} packets, {manifest['bytes'] / 1e6:.1f} MB")
+
+    write_bench_compose()
+    shutil.rmtree(BENCH_OUTPUT_DIR, ignore_errors=True)
+    os.makedirs(BENCH_OUTPUT_DIR)
+
+    results = {
+        "revision": git_revision(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "corpus": manifest,
+    }
+    try:
+        bench_compose("down", "-v", "--remove-orphans")
+        if not args.no_build:
+            print_progress("Building images...")
+            bench_compose("build", "suricata", "frontend")
+        bench_compose("up", "-d", "--no-build", "--wait", "postgres")
+
+        # Suricata start time includes rules loading and migrations, as when Digger starts
+        print_progress("Replaying corpus...")
+        started = time.monotonic()
+        bench_compose("up", "-d", "--no-build", "suricata")
+        counts = []
+        while True:
+            time.sleep(0.5)
+            running = "suricata" in bench_compose("ps", "--services", "--status", "running").split()
+            try:
+                counts.append((time.monotonic() - started, int(bench_psql("SELECT count(*) FROM flow;") or 0)))
+            except subprocess.CalledProcessError:
+                # Tables do not exist before migrations
+                pass
+            if not running:
+                break
+        ingest_seconds = time.monotonic() - started
+
+        # Older Compose versions print a JSON array, newer ones one object per line
+        state = json.loads(bench_compose("ps", "-a", "--format", "json", "suricata").splitlines()[0])
+        if isinstance(state, list):
+            state = state[0]
+        if state.get("ExitCode"):
+            print_error(f"Suricata exited with code {state['ExitCode']}, see {BENCH_OUTPUT_DIR}/suricata.log")
+            sys.exit(1)
+
+        db = json.loads(bench_psql(BENCH_SIZE_SQL))
+        rows = sum(db["rows"].values())
+        flows = db["rows"]["flow"]
+        results["ingest"] = {
+            "seconds": round(ingest_seconds, 3),
+            "packets_per_second": round(manifest["packets"] / ingest_seconds, 1),
+            "events_per_second": round((rows - db["rows"]["raw"]) / ingest_seconds, 1),
+            "rows_per_second": round(rows / ingest_seconds, 1),
+            # Time from Suricata start until the first and all flows are visible
+            "lag_first_flow_seconds": next((round(t, 3) for t, n in counts if n > 0), None),
+            "lag_all_flows_seconds": next((round(t, 3) for t, n in counts if n >= flows), round(ingest_seconds, 3)),
+            "suricata_stats": read_suricata_stats(os.path.join(BENCH_OUTPUT_DIR, "stats.log"))[1],
+        }
+        results["db"] = db
+
+        print_progress("Timing API endpoints...")
+        bench_compose("up", "-d", "--no-build", "frontend")
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                urllib.request.urlopen(f"{BENCH_API_URL}/api/metrics", timeout=5).read()
+                break
+            except (urllib.error.URLError, OSError):
+                if time.monotonic() > deadline:
+                    print_error("Web server did not answer in time.")
+                    sys.exit(1)
+                time.sleep(1)
+        results["api"] = bench_api(args.requests, random.Random(args.seed), manifest["search"])
+    except subprocess.CalledProcessError as e:
+        print_error(f"Benchmark failed: {' '.join(e.cmd)}\n{e.stderr}")
+        sys.exit(1)
+    finally:
+        if not args.keep:
+            subprocess.run(
+                ["docker", "compose", "-p", BENCH_PROJECT, "-f", COMPOSE_FILES["A"], "-f", BENCH_COMPOSE_FILE,
+                 "down", "-v", "--remove-orphans"],
+                capture_output=True,
+            )
+
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(BENCH_RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{results['revision'][:12]}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(json.dumps(results, indent=2))
+    print_success(f"Results written to {path}")
+
+
+def parse_config_value(key, value):
+    """Validate a `./start.py config set` value, exit on invalid values"""
+    if key == "target_ip":
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            print_error(f"Invalid IP address: {value}")
+            sys.exit(1)
+    if key in ("start_date", "end_date"):
+        if not validate_date_format(value) or validate_timezone(value) is False:
+            print_error(f"Invalid date: {value}, expected YYYY-MM-DDThh:mm+ZZ:zz")
+            sys.exit(1)
+        return value
+    if not value.isdigit() or int(value) == 0:
+        print_error(f"Invalid {key}: {value}, expected a positive number of seconds")
+        sys.exit(1)
+    return int(value)
+
+
+def handle_config_command(args):
+    """Handle the config command - show or change the configuration of a running Digger"""
+    if args.config_command != "set":
+        for path in (CAPTURE_ENV_FILE, CTF_CONFIG_FILE):
+            print_info(f"{path}:")
+            if os.path.exists(path):
+                with open(path) as f:
+                    print(f.read().rstrip())
+            else:
+                print_warning("Not written yet, see `./start.py start` or `./start.py config set`")
+            print()
+        return
+
+    values = {}
+    for assignment in args.values:
+        key, sep, value = assignment.partition("=")
+        if not sep or key not in CONFIG_KEYS:
+            print_error(f"Invalid setting: {assignment}, expected key=value with key in {', '.join(CONFIG_KEYS)}")
+            sys.exit(1)
+        values[key] = parse_config_value(key, value.strip())
+    if not values:
+        print_error("Nothing to set")
+        sys.exit(1)
+
+    previous = read_env(CAPTURE_ENV_FILE)
+    update_runtime_config(values)
+    for key, value in values.items():
+        print_success(f"Set {key} to {value}")
+
+    # The web interface reloads config/ctf_config.json by itself, captures are switched here
+    running = running_services([COMPOSE_FILES["C"]])
+    compose = ["docker", "compose", "-f", COMPOSE_FILES["C"]]
+    if "target_ip" in values and previous.get("TARGET_IP") != values["target_ip"] and "pcap-broker" in running:
+        print_progress(f"Switching capture to {values['target_ip']}...")
+        # Ends the current capture, pcap-broker reconnects to the new target without dropping its clients
+        subprocess.run(compose + ["exec", "-T", "pcap-broker", "sh", "/capture.sh", "switch"])
+    if "tick_length" in values and previous.get("CTF_TICK_LENGTH") != str(values["tick_length"]) and "tshark" in running:
+        print_progress("Restarting tshark for the new rotation interval...")
+        subprocess.run(compose + ["up", "-d", "--no-deps", "tshark"], check=True)
+    print_success("Configuration applied")
+
+
 def handle_help_command():
     """Handle the help command - show help information"""
     parser = create_parser()
@@ -864,16 +2474,26 @@ def create_parser():
 {Colors.BOLD}Examples:{Colors.END}
   {Colors.CYAN}./start.py start --mode-a{Colors.END}                         # Start Digger in mode A
   {Colors.CYAN}./start.py start --mode-c --target-ip 10.60.2.1 {Colors.END}  # Start mode C with target IP
+  {Colors.CYAN}./start.py start --mode-a --parallel 4{Colors.END}            # Replay input pcaps with 4 workers
+  {Colors.CYAN}./start.py start --mode-c --metrics{Colors.END}               # Also start a local Prometheus
   {Colors.CYAN}./start.py stop{Colors.END}                                   # Stop running containers
   {Colors.CYAN}./start.py clear{Colors.END}                                  # Clear output and stop containers
   {Colors.CYAN}./start.py clear --all{Colors.END}                            # Clear everything
   {Colors.CYAN}./start.py clear --config{Colors.END}                         # Clear only config files
   {Colors.CYAN}./start.py clear --suricata{Colors.END}                       # Clear only Suricata output
-  {Colors.CYAN}./start.py clear --pcap{Colors.END}                           # Clear only PCAP files
+  {Colors.CYAN}./start.py clear --pcap{Colors.END}                           # Delete closed PCAP segments
+  {Colors.CYAN}./start.py clear --pcap --keep-ticks 30{Colors.END}           # Keep the last 30 ticks of PCAP
   {Colors.CYAN}./start.py status{Colors.END}                                 # Show container status
   {Colors.CYAN}./start.py logs{Colors.END}                                   # Follow all container logs
   {Colors.CYAN}./start.py logs --tail 100{Colors.END}                        # Last 100 logs of all containers
   {Colors.CYAN}./start.py logs webapp --tail 50{Colors.END}                  # Last 50 logs of specific service
+  {Colors.CYAN}./start.py migrate{Colors.END}                                # Migrate a running database
+  {Colors.CYAN}./start.py ingest{Colors.END}                                 # Stage new input pcaps (mode A)
+  {Colors.CYAN}./start.py prune --older-than 12h{Colors.END}                 # Drop flows 12 hours older than the newest
+  {Colors.CYAN}./start.py top{Colors.END}                                    # Live ingest throughput and health
+  {Colors.CYAN}./start.py bench{Colors.END}                                  # Benchmark ingest and API, results as JSON
+  {Colors.CYAN}./start.py config set target_ip=10.60.3.1{Colors.END}         # Switch capture target without restart
+  {Colors.CYAN}./start.py config show{Colors.END}                            # Show the configuration of running containers
   {Colors.CYAN}./start.py help{Colors.END}                                   # Show this help message
         """,
     )
@@ -899,9 +2519,29 @@ def create_parser():
     parser_start.add_argument(
         "--no-build", action="store_true", help="Skip building images"
     )
+    parser_start.add_argument(
+        "--rebuild", action="store_true", help="Rebuild every image, even if its sources did not change"
+    )
+    parser_start.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Replay input pcaps with N Suricata workers, sharded by file (for mode A)",
+    )
+    parser_start.add_argument(
+        "--reingest",
+        action="store_true",
+        help="Forget the ingest ledger and replay every input pcap (for mode A)",
+    )
     parser_start.add_argument(
         "--no-clean", action="store_true", help="Skip cleaning environment"
     )
+    parser_start.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Export ingest and web server metrics to a local Prometheus on port 9090",
+    )
     parser_start.add_argument(
         "--date",
         dest="start_date",
@@ -931,6 +2571,26 @@ def create_parser():
         dest="key",
         help="Specify algorithm for SSH key exchange (default: ed25519)",
     )
+    parser_start.add_argument(
+        "--pcap-rotate-size",
+        type=int,
+        help="Also switch capture segments when they reach this size, in MB (for mode C)",
+    )
+    parser_start.add_argument(
+        "--pcap-compress",
+        action="store_true",
+        help="Compress closed capture segments with zstd (for mode C)",
+    )
+    parser_start.add_argument(
+        "--pcap-keep-ticks",
+        type=int,
+        help="Retention policy of 'clear --pcap': number of ticks of captures to keep",
+    )
+    parser_start.add_argument(
+        "--pcap-max-size",
+        type=int,
+        help="Retention policy of 'clear --pcap': maximum size of captures to keep, in MB",
+    )
 
     # Stop command
     subparsers.add_parser("stop", help="Stop Digger containers")
@@ -949,7 +2609,7 @@ def create_parser():
         "--config",
         "-c",
         action="store_true",
-        help="Clear config files (.env and services_config.json)",
+        help="Clear config files (.env and config/)",
     )
     parser_clear.add_argument(
         "--suricata",
@@ -961,7 +2621,17 @@ def create_parser():
         "--pcap",
         "-p",
         action="store_true",
-        help="Clear PCAP files captured with Tshark",
+        help="Delete closed PCAP segments captured with Tshark, capture keeps running",
+    )
+    parser_clear.add_argument(
+        "--keep-ticks",
+        type=int,
+        help="With --pcap, keep the segments of the last KEEP_TICKS ticks",
+    )
+    parser_clear.add_argument(
+        "--max-size",
+        type=int,
+        help="With --pcap, keep at most MAX_SIZE MB of segments",
     )
 
     # Status command - simple container status
@@ -970,6 +2640,104 @@ def create_parser():
     # Logs command - NO ARGUMENTS, uses sys.argv directly
     subparsers.add_parser("logs", help="Follow container logs")
 
+    # Migrate command
+    parser_migrate = subparsers.add_parser(
+        "migrate", help="Apply schema migrations on a running database"
+    )
+    parser_migrate.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Number of rows backfilled per transaction (default: 10000)",
+    )
+
+    # Ingest command, run by the `ingest` service of mode A
+    parser_ingest = subparsers.add_parser(
+        "ingest", help="Stage new and grown input pcaps for Suricata (mode A)"
+    )
+    parser_ingest.add_argument(
+        "--watch", action="store_true", help="Keep staging input pcaps as they appear"
+    )
+    parser_ingest.add_argument(
+        "--interval",
+        type=int,
+        default=5,
+        help="Seconds between two scans of input pcaps with --watch (default: 5)",
+    )
+
+    # Prune command
+    parser_prune = subparsers.add_parser(
+        "prune", help="Drop flows, payloads and events older than a duration"
+    )
+    parser_prune.add_argument(
+        "--older-than",
+        required=True,
+        metavar="DURATION",
+        help="Age measured from the newest flow, e.g. 90m, 12h, 2d or 30t (ticks)",
+    )
+    parser_prune.add_argument(
+        "--dry-run", action="store_true", help="Only list the partitions to drop"
+    )
+    parser_prune.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Number of payload chunks checked per transaction (default: 1000)",
+    )
+
+    # Top command
+    parser_top = subparsers.add_parser(
+        "top", help="Live dashboard of ingest throughput, lag, drops and containers"
+    )
+    parser_top.add_argument(
+        "--interval",
+        type=float,
+        default=1,
+        help="Seconds between two samples (default: 1)",
+    )
+
+    # Bench command
+    parser_bench = subparsers.add_parser(
+        "bench", help="Replay a synthetic corpus end to end and report throughput as JSON"
+    )
+    parser_bench.add_argument(
+        "--flows", type=int, default=20000, help="Flows in the corpus (default: 20000)"
+    )
+    parser_bench.add_argument(
+        "--services", type=int, default=8, help="Services of the vulnbox (default: 8)"
+    )
+    parser_bench.add_argument(
+        "--teams", type=int, default=20, help="Teams connecting to services (default: 20)"
+    )
+    parser_bench.add_argument(
+        "--seed", type=int, default=1, help="Seed of the corpus generator (default: 1)"
+    )
+    parser_bench.add_argument(
+        "--requests", type=int, default=100, help="Requests per API endpoint (default: 100)"
+    )
+    parser_bench.add_argument(
+        "--no-build", action="store_true", help="Skip building images"
+    )
+    parser_bench.add_argument(
+        "--keep", action="store_true", help="Keep the benchmark containers and database"
+    )
+
+    # Config command
+    parser_config = subparsers.add_parser(
+        "config", help="Show or change services and ticks of running containers"
+    )
+    config_subparsers = parser_config.add_subparsers(dest="config_command")
+    config_subparsers.add_parser("show", help="Show the current configuration")
+    parser_config_set = config_subparsers.add_parser(
+        "set", help="Change settings without restarting containers"
+    )
+    parser_config_set.add_argument(
+        "values",
+        nargs="+",
+        metavar="key=value",
+        help=f"Keys: {', '.join(CONFIG_KEYS)}",
+    )
+
     return parser
 
 
@@ -981,6 +2749,8 @@ def show_action_selection():
     print(f"  {Colors.BOLD}clear{Colors.END} - Clear Suricata's output, and stop containers")
     print(f"  {Colors.BOLD}status{Colors.END} - Show container status")
     print(f"  {Colors.BOLD}logs{Colors.END} - Follow container logs")
+    print(f"  {Colors.BOLD}migrate{Colors.END} - Migrate a running database")
+    print(f"  {Colors.BOLD}top{Colors.END} - Live ingest throughput and health")
     print(f"  {Colors.BOLD}help{Colors.END} - Show help information")
     print()
 
@@ -996,23 +2766,24 @@ def prompt_for_action():
     while True:
         action = (
             prompt_styled(
-                "Enter action (start/stop/clear/status/logs/help)", default="start"
+                "Enter action (start/stop/clear/status/logs/migrate/top/help)", default="start"
             )
             .strip()
             .lower()
         )
-        if action in ["start", "stop", "clear", "status", "logs", "help"]:
+        if action in ["start", "stop", "clear", "status", "logs", "migrate", "top", "help"]:
             print_separator(char="═")
             print()
             return action
         print_error(
-            "Invalid action. Please choose from: start, stop, clear, status, logs, help"
+            "Invalid action. Please choose from: start, stop, clear, status, logs, migrate, top, help"
         )
 
 
 def main():
     # Clear screen and show banner
-    os.system("clear" if os.name == "posix" else "cls")
+    if sys.stdout.isatty():
+        os.system("clear" if os.name == "posix" else "cls")
     print_banner()
 
     # Handle logs command BEFORE argparse to avoid --tail conflicts
@@ -1045,6 +2816,18 @@ def main():
         handle_clear_command(args)
     elif args.command == "status":
         handle_status_command()
+    elif args.command == "migrate":
+        handle_migrate_command(args)
+    elif args.command == "ingest":
+        handle_ingest_command(args)
+    elif args.command == "prune":
+        handle_prune_command(args)
+    elif args.command == "top":
+        handle_top_command(args)
+    elif args.command == "bench":
+        handle_bench_command(args)
+    elif args.command == "config":
+        handle_config_command(args)
     else:
         parser.print_help()
 
@@ -0,0 +1,21 @@
+-- Copyright (C) 2024  ANSSI
+-- SPDX-License-Identifier: CC0-1.0
+
+-- pgbench script inserting one random flow per transaction, like the EVE plugin does.
+-- Per-row cost must stay constant while the flow table grows, run it on a
+-- throwaway database and watch the reported latency with `-P`:
+--
+--   docker compose -f docker-compose-c.yml exec -T postgres \
+--       pgbench -U postgres -n -P 10 -t 1000000 -f /dev/stdin < suricata/bench/flow_ingest.sql
+
+\set id random(1, 9223372036854775807)
+\set ts 1700000000000000 + random(0, 36000000000)
+\set src_port random(1024, 65535)
+\set dest_port random(1, 1024)
+\set host random(1, 254)
+
+-- Flows are partitioned by hour, the plugin creates missing partitions before each batch
+SELECT create_time_partitions(:ts);
+INSERT INTO flow (id, ts_start, ts_end, src_ip, src_port, dest_ip, dest_port, proto, app_proto)
+VALUES (:id, :ts, :ts + 1000, '10.60.' || :host || '.1', :src_port, '10.60.1.1', :dest_port, 'TCP', 'http')
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,66 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Compare generic `serde_json::Value` parsing with the typed Eve parser.
+//!
+//! ```bash
+//! EVE_BENCH_FILE=output/eve.json cargo bench --bench eve_parse
+//! ```
+//!
+//! Without a recorded `eve.json`, a few sample events are used.
+
+use criterion::{black_box, criterion_group, criterion_main, Criterion, Throughput};
+use eve_postgres_output::eve::{parse_timestamp, Event, FlowTimes};
+
+const SAMPLE: &str = r#"{"timestamp":"2024-05-04T10:00:01.123456+0000","flow_id":1234567890,"pcap_filename":"/suricata/input_pcaps/dump.pcap","event_type":"http","src_ip":"10.60.1.1","src_port":41234,"dest_ip":"10.60.2.1","dest_port":8080,"proto":"TCP","pkt_src":"wire/pcap","tx_id":0,"http":{"hostname":"10.60.2.1","url":"/api/login","http_user_agent":"python-requests/2.31.0","http_content_type":"application/json","http_method":"POST","protocol":"HTTP/1.1","status":200,"length":42}}
+{"timestamp":"2024-05-04T10:00:01.223456+0000","flow_id":1234567890,"pcap_filename":"/suricata/input_pcaps/dump.pcap","event_type":"alert","src_ip":"10.60.2.1","src_port":8080,"dest_ip":"10.60.1.1","dest_port":41234,"proto":"TCP","alert":{"action":"allowed","gid":1,"signature_id":1000001,"rev":1,"signature":"FLAG OUT","category":"","severity":3,"metadata":{"tag":["FLAG OUT"],"color":["red"]}}}
+{"timestamp":"2024-05-04T10:01:01.000000+0000","flow_id":1234567890,"event_type":"flow","src_ip":"10.60.1.1","src_port":41234,"dest_ip":"10.60.2.1","dest_port":8080,"proto":"TCP","app_proto":"http","flow":{"pkts_toserver":6,"pkts_toclient":5,"bytes_toserver":612,"bytes_toclient":980,"start":"2024-05-04T10:00:01.023456+0000","end":"2024-05-04T10:00:01.323456+0000","age":0,"state":"closed","reason":"timeout","alerted":true},"metadata":{"flowints":{"tcp.retransmission.count":0}},"tcp":{"tcp_flags":"1b","syn":true,"fin":true,"psh":true,"ack":true,"state":"closed"}}"#;
+
+/// Previous approach: parse to `Value`, then extract and clone the stored fields.
+fn parse_value(buf: &str) -> Option<(i64, Option<serde_json::Value>)> {
+    let v: serde_json::Value = serde_json::from_str(buf).ok()?;
+    let event_type = v.get("event_type")?.as_str()?;
+    let ts = chrono::DateTime::parse_from_str(v.get("timestamp")?.as_str()?, "%Y-%m-%dT%H:%M:%S%.6f%z")
+        .ok()?
+        .timestamp_micros();
+    if event_type == "flow" {
+        let flow = v.get("flow")?;
+        for key in ["start", "end"] {
+            chrono::DateTime::parse_from_str(flow.get(key)?.as_str()?, "%Y-%m-%dT%H:%M:%S%.6f%z").ok()?;
+        }
+    }
+    Some((ts, v.get(event_type).cloned()))
+}
+
+/// Typed approach used by the plugin.
+fn parse_typed(buf: &str) -> Option<(i64, Option<&str>)> {
+    let event = Event::parse(buf).ok()?;
+    let ts = parse_timestamp(&event.timestamp?)?;
+    if event.event_type? == "flow" {
+        let times = FlowTimes::parse(event.flow?).ok()?;
+        parse_timestamp(&times.start)?;
+        parse_timestamp(&times.end)?;
+    }
+    Some((ts, event.data.map(|d| d.get())))
+}
+
+fn eve_parse(c: &mut Criterion) {
+    let content = std::env::var("EVE_BENCH_FILE")
+        .ok()
+        .and_then(|path| std::fs::read_to_string(path).ok())
+        .unwrap_or(SAMPLE.into());
+    let events: Vec<&str> = content.lines().collect();
+
+    let mut group = c.benchmark_group("eve_parse");
+    group.throughput(Throughput::Elements(events.len() as u64));
+    group.bench_function("value", |b| {
+        b.iter(|| events.iter().filter_map(|e| parse_value(black_box(e))).count())
+    });
+    group.bench_function("typed", |b| {
+        b.iter(|| events.iter().filter_map(|e| parse_typed(black_box(e))).count())
+    });
+    group.finish();
+}
+
+criterion_group!(benches, eve_parse);
+criterion_main!(benches);
@@ -0,0 +1,56 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Replay a recorded `eve.json` into PostgreSQL to measure ingest throughput.
+//!
+//! Record events with Suricata regular EVE output (`outputs.1.eve-log.filetype=regular`),
+//! then run against a throwaway database:
+//!
+//! ```bash
+//! EVE_BENCH_FILE=output/eve.json DATABASE_URL=postgresql://postgres@localhost:5432/postgres cargo bench
+//! ```
+//!
+//! Every iteration is rolled back, so the database is left unchanged.
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use diesel::result::Error;
+use diesel::{Connection, PgConnection};
+use diesel_migrations::{embed_migrations, EmbeddedMigrations, MigrationHarness};
+use eve_postgres_output::database::write_batch;
+use eve_postgres_output::pcap_cache::FlowPcapCache;
+
+const MIGRATIONS: EmbeddedMigrations = embed_migrations!();
+
+fn eve_replay(c: &mut Criterion) {
+    let path = std::env::var("EVE_BENCH_FILE").unwrap_or("output/eve.json".into());
+    let Ok(content) = std::fs::read_to_string(&path) else {
+        eprintln!("Cannot read {path}, set EVE_BENCH_FILE to a recorded eve.json");
+        return;
+    };
+    let events: Vec<String> = content.lines().map(String::from).collect();
+
+    let url = std::env::var("DATABASE_URL").unwrap_or("postgresql://postgres@localhost:5432/postgres".into());
+    let mut conn = PgConnection::establish(&url).expect("Failed to connect to PostgreSQL");
+    conn.run_pending_migrations(MIGRATIONS).unwrap();
+
+    let mut group = c.benchmark_group("eve_replay");
+    group.throughput(Throughput::Elements(events.len() as u64));
+    group.sample_size(10);
+    for batch_size in [1, 100, 1000] {
+        group.bench_with_input(BenchmarkId::from_parameter(batch_size), &batch_size, |b, &batch_size| {
+            b.iter(|| {
+                let mut pcap_cache = FlowPcapCache::new(100_000, std::time::Duration::from_secs(300));
+                let _ = conn.transaction::<(), Error, _>(|conn| {
+                    for batch in events.chunks(batch_size) {
+                        write_batch(conn, &mut pcap_cache, 0, batch)?;
+                    }
+                    Err(Error::RollbackTransaction)
+                });
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, eve_replay);
+criterion_main!(benches);
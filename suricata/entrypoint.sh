@@ -11,15 +11,23 @@ if [ -n "${PCAP_OVER_IP+x}" ]; then
     SURICATA_CMD="nc -d $PCAP_OVER_IP | $SURICATA_CMD"
 fi
 
+# Runmode can be `autofp`, `workers` or `single`, EVE records are written
+# by each packet thread (threaded EVE) then inserted by a pool of
+# EVE_WRITERS database writers. Payload batches of the Lua outputs are spooled
+# to suricata/output/payloads, then inserted by PAYLOAD_LOADERS threads of the
+# same plugin.
+# Capture and decoder counters are dumped to stats.log every SURICATA_STATS_INTERVAL
+# seconds for `./start.py top`.
 # Arguments override default Suricata configuration,
 # see https://github.com/OISF/suricata/blob/suricata-7.0.5/suricata.yaml.in
 eval "$SURICATA_CMD" \
-    --runmode=single --no-random -k none \
+    --runmode="${SURICATA_RUNMODE:=autofp}" --no-random -k none \
     -l suricata/output \
     --set default-rule-path=suricata/rules \
     --set plugins.0=suricata/libeve_postgres_output.so \
     --set outputs.0.fast.enabled=no \
     --set outputs.1.eve-log.filetype=sqlite \
+    --set outputs.1.eve-log.threaded=yes \
     --set outputs.1.eve-log.pcap-file="${PCAP_FILE:=true}" \
     --set outputs.1.eve-log.types.3.http.dump-all-headers=both \
     --set outputs.1.eve-log.types.6.files.force-hash.0=sha256 \
@@ -27,7 +35,8 @@ eval "$SURICATA_CMD" \
     --set outputs.1.eve-log.types.23.mqtt.passwords=yes \
     --set outputs.1.eve-log.types.25.pgsql.enabled=yes \
     --set outputs.1.eve-log.types.25.pgsql.passwords=yes \
-    --set outputs.7.stats.enabled=no \
+    --set stats.interval="${SURICATA_STATS_INTERVAL:=10}" \
+    --set outputs.7.stats.enabled=yes \
     --set outputs.9.file-store.enabled=yes \
     --set outputs.9.file-store.force-filestore=yes \
     --set outputs.9.file-store.stream-depth=0 \
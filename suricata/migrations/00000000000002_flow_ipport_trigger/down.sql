@@ -0,0 +1,13 @@
+DROP TRIGGER IF EXISTS set_ipport ON flow;
+DROP FUNCTION IF EXISTS set_ipport_fn();
+
+CREATE FUNCTION set_ts_fn() RETURNS trigger AS $$
+BEGIN
+    UPDATE flow SET src_ipport = src_ip || (CASE WHEN src_port IS NULL THEN '' ELSE ':' || src_port END);
+	UPDATE flow SET dest_ipport = dest_ip || (CASE WHEN dest_port IS NULL THEN '' ELSE ':' || dest_port END);
+
+	RETURN new;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER set_ts AFTER INSERT ON flow FOR each ROW EXECUTE PROCEDURE set_ts_fn();
@@ -0,0 +1,22 @@
+-- `set_ts_fn` was an AFTER INSERT trigger rewriting `src_ipport`/`dest_ipport`
+-- of the whole flow table for every inserted row, making ingest O(n²).
+-- Compute both columns on the inserted row only, before it is written.
+CREATE OR REPLACE FUNCTION set_ipport_fn() RETURNS trigger AS $$
+BEGIN
+    NEW.src_ipport := NEW.src_ip || (CASE WHEN NEW.src_port IS NULL THEN '' ELSE ':' || NEW.src_port END);
+    NEW.dest_ipport := NEW.dest_ip || (CASE WHEN NEW.dest_port IS NULL THEN '' ELSE ':' || NEW.dest_port END);
+
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+-- `./start.py migrate` may already have swapped the triggers on a running database.
+DROP TRIGGER IF EXISTS set_ts ON flow;
+DROP FUNCTION IF EXISTS set_ts_fn();
+
+DROP TRIGGER IF EXISTS set_ipport ON flow;
+CREATE TRIGGER set_ipport BEFORE INSERT OR UPDATE OF src_ip, src_port, dest_ip, dest_port ON flow FOR EACH ROW EXECUTE PROCEDURE set_ipport_fn();
+
+-- Backfill rows missed by the previous trigger, usually none.
+-- Large databases should run `./start.py migrate` beforehand to do it in small batches.
+UPDATE flow SET src_ip = src_ip WHERE src_ipport IS NULL OR dest_ipport IS NULL;
@@ -0,0 +1 @@
+DROP INDEX IF EXISTS "raw_blob_trgm_idx";
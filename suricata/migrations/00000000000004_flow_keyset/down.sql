@@ -0,0 +1,7 @@
+DROP INDEX IF EXISTS "flow_xid_idx";
+ALTER TABLE "flow" DROP COLUMN IF EXISTS "xid";
+DROP INDEX IF EXISTS "flow_seq_idx";
+ALTER TABLE "flow" DROP COLUMN IF EXISTS "seq";
+DROP SEQUENCE IF EXISTS "flow_seq_seq";
+CREATE INDEX IF NOT EXISTS "flow_ts_start_idx" ON "flow" ("ts_start");
+DROP INDEX IF EXISTS "flow_ts_start_id_idx";
@@ -0,0 +1,6 @@
+DROP TRIGGER IF EXISTS alert_facet ON alert;
+DROP TRIGGER IF EXISTS flow_facet ON flow;
+DROP FUNCTION IF EXISTS alert_facet_fn();
+DROP FUNCTION IF EXISTS flow_facet_fn();
+DROP SEQUENCE IF EXISTS "facet_version";
+DROP TABLE IF EXISTS "facet";
@@ -0,0 +1,9 @@
+DROP TRIGGER IF EXISTS alert_rollup ON alert;
+DROP TRIGGER IF EXISTS flow_rollup ON flow;
+DROP FUNCTION IF EXISTS flag_out_reconcile();
+DROP FUNCTION IF EXISTS alert_rollup_fn();
+DROP FUNCTION IF EXISTS flow_rollup_fn();
+DROP TABLE IF EXISTS "flag_out_pending";
+DROP TABLE IF EXISTS "flag_out_alert_rollup";
+DROP TABLE IF EXISTS "flag_out_rollup";
+DROP TABLE IF EXISTS "flow_rollup";
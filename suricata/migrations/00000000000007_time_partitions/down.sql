@@ -0,0 +1,6 @@
+-- Partitioned tables are kept, only the maintenance functions are removed.
+-- Converting them back would copy every row.
+DROP FUNCTION IF EXISTS delete_time_rows(BIGINT);
+DROP FUNCTION IF EXISTS time_partitions_before(BIGINT);
+DROP FUNCTION IF EXISTS time_partitions_cutoff(BIGINT);
+DROP FUNCTION IF EXISTS create_time_partitions(BIGINT);
@@ -0,0 +1,9 @@
+DROP FUNCTION IF EXISTS collect_raw_blobs(INT);
+DROP FUNCTION IF EXISTS drop_time_partition(TEXT);
+DROP TABLE IF EXISTS "raw_blob_gc";
+
+-- Moves deduplicated chunks back to payload rows
+UPDATE "raw" SET "blob" = b."blob", "blob_hash" = NULL FROM "raw_blob" b WHERE "raw"."blob_hash" = b."hash";
+DROP INDEX IF EXISTS "raw_blob_hash_idx";
+ALTER TABLE "raw" DROP COLUMN IF EXISTS "blob_hash";
+DROP TABLE IF EXISTS "raw_blob";
@@ -0,0 +1,200 @@
+-- Copyright (C) 2024  ANSSI
+-- SPDX-License-Identifier: GPL-2.0-or-later
+
+-- Batched PostgreSQL writer shared by TCP and UDP payload outputs.
+-- Payload chunks are buffered in memory and written with one multi-row INSERT
+-- when the batch is full, too large, or older than the flush interval.
+-- Packet threads never wait for the database: each batch is written as an SQL
+-- file to the spool directory, then run by the payload loaders of the EVE output
+-- plugin, which share its connection pool (see suricata/src/payloads.rs).
+-- The hourly partitions of the batch are created by the first statement.
+-- Chunks are deduplicated by PostgreSQL: each distinct chunk is stored once in
+-- raw_blob, keyed by its SHA-256, and payload rows reference it. Existing chunks
+-- are locked until the batch commits, so that pruning does not delete them.
+-- Configuration is read from the environment:
+--   PAYLOAD_BATCH_SIZE        rows per INSERT (default: 500)
+--   PAYLOAD_BATCH_BYTES       payload bytes buffered before flushing (default: 8 MiB)
+--   PAYLOAD_FLUSH_INTERVAL    seconds before a partial batch is flushed (default: 1)
+--   PAYLOAD_STATS_INTERVAL    seconds between throughput logs, 0 to disable (default: 60)
+--   PAYLOAD_SPOOL_DIR         spool directory, one subdirectory per shard (default: suricata/output/payloads)
+--   EVE_FLOW_ID_SHARD         shard of parallel ingestion, offsets flow ids like the EVE output (default: 0)
+
+local writer = {}
+writer.__index = writer
+
+-- Spooled batches are named "<writer>-<id>.sql", written as ".tmp" first so that
+-- loaders only see complete files. Statements are one per line: chunks are sent
+-- escaped, without raw newlines. The first line gives the chunks and bytes of the batch.
+local SPOOL_DIR = os.getenv("PAYLOAD_SPOOL_DIR") or "suricata/output/payloads"
+
+-- Chunks are sent as bytea escape literals, printable bytes are kept as is.
+-- A single gsub pass over a lookup table is much faster than a call per byte.
+local ESCAPE = {}
+for i = 0, 255 do
+    local c = string.char(i)
+    if c == "'" then
+        ESCAPE[c] = "''"
+    elseif c == "\\" then
+        ESCAPE[c] = "\\\\"
+    elseif i < 32 or i > 126 then
+        ESCAPE[c] = string.format("\\%03o", i)
+    end
+end
+local ESCAPE_PATTERN = "[%z\1-\31'\\\127-\255]"
+
+-- Mostly binary chunks are shorter in hex
+local HEX = {}
+for i = 0, 255 do
+    HEX[string.char(i)] = string.format("%02x", i)
+end
+
+local function bytea_literal (data)
+    local escaped = data:gsub(ESCAPE_PATTERN, ESCAPE)
+    if #escaped > 2 * #data then
+        return "'\\x" .. (data:gsub(".", HEX)) .. "'::bytea"
+    end
+    return "'" .. escaped .. "'::bytea"
+end
+
+-- Payloads are partitioned by flow start hour, in microseconds
+local PARTITION_LENGTH = 3600000000
+
+local function getenv_number (name, default)
+    return tonumber(os.getenv(name) or "") or default
+end
+
+function writer.new (name)
+    -- Shard offset is added by PostgreSQL, flow ids above 2^53 are not exact as Lua numbers
+    local shard = getenv_number("EVE_FLOW_ID_SHARD", 0)
+    local flow_id_offset = ""
+    if shard > 0 then
+        flow_id_offset = string.format(" + %.0f", shard * 2 ^ 51)
+    end
+
+    local now = os.time()
+    local self = setmetatable({
+        name = name,
+        spool_dir = string.format("%s/%d", SPOOL_DIR, shard),
+        seq = 0,
+        batch_size = getenv_number("PAYLOAD_BATCH_SIZE", 500),
+        batch_bytes = getenv_number("PAYLOAD_BATCH_BYTES", 8 * 1024 * 1024),
+        flush_interval = getenv_number("PAYLOAD_FLUSH_INTERVAL", 1),
+        stats_interval = getenv_number("PAYLOAD_STATS_INTERVAL", 60),
+        flow_id_offset = flow_id_offset,
+        rows = {},
+        hours = {},
+        pending_bytes = 0,
+        last_flush = now,
+        last_stats = now,
+        -- throughput counters
+        chunks = 0,
+        bytes = 0,
+        batches = 0,
+        errors = 0,
+    }, writer)
+    -- Lua states of other packet threads share the spool, the address of this
+    -- table is unique in the process and the start time across restarts
+    self.file_prefix = string.format("%s/%s-%d-%s-", self.spool_dir, name:lower(), now, tostring(self):match("0x(%x+)") or "0")
+    return self
+end
+
+-- Write one batch file to the spool, `lines` being the statements of the batch.
+function writer:spool (lines)
+    self.seq = self.seq + 1
+    local path = string.format("%s%d.sql", self.file_prefix, self.seq)
+    local file, err = io.open(path .. ".tmp", "wb")
+    if file then
+        local ok
+        ok, err = file:write(table.concat(lines, "\n"), "\n")
+        -- close reports write errors of buffered data, e.g. a full disk
+        local closed, close_err = file:close()
+        if ok and closed then
+            ok, err = os.rename(path .. ".tmp", path)
+            if ok then
+                return true
+            end
+        else
+            err = err or close_err
+        end
+        os.remove(path .. ".tmp")
+    end
+    SCLogError(self.name .. " payloads: failed to spool a batch: " .. tostring(err))
+    return false
+end
+
+-- Queue one payload chunk, flushing the batch if needed.
+function writer:push (flow_id, ts_start, count, direction, data)
+    -- flow ids fit in 51 bits, "%.0f" keeps every digit where tostring would not
+    self.rows[#self.rows + 1] = string.format("(%.0f%s, %.0f, %d, %d, %s)", flow_id, self.flow_id_offset, ts_start, count, direction, bytea_literal(data))
+    self.hours[ts_start - ts_start % PARTITION_LENGTH] = true
+    self.pending_bytes = self.pending_bytes + #data
+    self.chunks = self.chunks + 1
+    self.bytes = self.bytes + #data
+
+    if #self.rows >= self.batch_size or self.pending_bytes >= self.batch_bytes then
+        self:flush()
+    end
+    self:tick()
+end
+
+-- Flush a partial batch older than the flush interval, to be called on every
+-- output callback, including those without payload, so that the last chunks of
+-- a quiet service do not wait for the next chunk.
+function writer:tick ()
+    local now = os.time()
+    if now - self.last_flush >= self.flush_interval then
+        self:flush()
+    end
+    if self.stats_interval > 0 and now - self.last_stats >= self.stats_interval then
+        self:log_stats()
+        self.last_stats = now
+    end
+end
+
+-- Spool all queued chunks in one statement.
+function writer:flush ()
+    self.last_flush = os.time()
+    if #self.rows == 0 then
+        return
+    end
+
+    local hours = {}
+    for hour in pairs(self.hours) do
+        hours[#hours + 1] = string.format("%.0f", hour)
+    end
+    local lines = {
+        string.format("-- %d %d", #self.rows, self.pending_bytes),
+        "SELECT create_time_partitions(h) FROM unnest(ARRAY[" .. table.concat(hours, ",") .. "]::bigint[]) h;",
+        "WITH chunk (flow_id, ts_start, count, server_to_client, blob) AS (VALUES " .. table.concat(self.rows, ",") .. "), "
+        .. "hashes AS (SELECT DISTINCT ON (sha256(blob)) sha256(blob) AS hash, blob FROM chunk), "
+        .. "locked AS (SELECT hash FROM raw_blob WHERE hash IN (SELECT hash FROM hashes) FOR KEY SHARE), "
+        .. "blobs AS (INSERT INTO raw_blob (hash, blob) SELECT hash, blob FROM hashes WHERE hash NOT IN (SELECT hash FROM locked) ON CONFLICT DO NOTHING) "
+        .. "INSERT INTO raw (flow_id, ts_start, count, server_to_client, blob_hash) SELECT flow_id, ts_start, count, server_to_client, sha256(blob) FROM chunk ON CONFLICT DO NOTHING;",
+    }
+    if self:spool(lines) then
+        self.batches = self.batches + 1
+    else
+        self.errors = self.errors + 1
+        SCLogError(self.name .. " payloads: lost " .. #self.rows .. " chunks")
+    end
+
+    self.rows = {}
+    self.hours = {}
+    self.pending_bytes = 0
+end
+
+-- Counters of this packet thread only: batches spooled, and batches that failed
+-- to be. The counters of ingest_stats, shared by the packet threads, are published
+-- by the payload loaders.
+function writer:log_stats ()
+    SCLogNotice(string.format("%s payloads: chunks=%d bytes=%d batches=%d errors=%d pending=%d", self.name, self.chunks, self.bytes, self.batches, self.errors, #self.rows))
+end
+
+-- Spool the last batch, loaded by the EVE output plugin before it exits, or at
+-- the next start.
+function writer:close ()
+    self:flush()
+    self:log_stats()
+end
+
+return writer
@@ -1,218 +1,502 @@
 // Copyright (C) 2024  ANSSI
 // SPDX-License-Identifier: GPL-2.0-or-later
 
-use diesel::{Connection, ConnectionError, PgConnection, QueryResult, RunQueryDsl};
+use diesel::r2d2::{ConnectionManager, Pool, PoolError};
+use diesel::sql_types::{Array, BigInt, Jsonb, Text};
+use diesel::{Connection, PgConnection, QueryResult, RunQueryDsl};
 use diesel_migrations::{embed_migrations, EmbeddedMigrations, MigrationHarness};
-use std::collections::HashMap;
-use std::sync::Mutex;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::mpsc::Receiver;
+use std::sync::{Arc, Mutex, MutexGuard, PoisonError};
+use std::thread::JoinHandle;
 use std::{thread, time};
 
-use crate::models::{NewAlert, NewAnomaly, NewAppEvent, NewFileinfo, NewFlow};
+use crate::eve::{parse_timestamp, Event, FlowTimes};
+use crate::metrics::Histogram;
+use crate::models::{NewAlert, NewAnomaly, NewAppEvent, NewFileinfo, NewFlow, RawJson};
+use crate::pcap_cache::FlowPcapCache;
 use crate::schema::{alert, anomaly, app_event, fileinfo, flow};
 
 const MIGRATIONS: EmbeddedMigrations = embed_migrations!();
 
-lazy_static::lazy_static! {
-    static ref FLOW_PCAP: Mutex<HashMap<i64, String>> = Mutex::new(HashMap::new());
+/// Rows parsed from one batch of Eve events, grouped by target table.
+#[derive(Default)]
+struct Rows<'a> {
+    flows: Vec<NewFlow<'a>>,
+    alerts: Vec<NewAlert<'a>>,
+    anomalies: Vec<NewAnomaly<'a>>,
+    fileinfos: Vec<NewFileinfo<'a>>,
+    app_events: Vec<NewAppEvent<'a>>,
+    /// Flows written without the pcap filename of their app events
+    unmatched_flows: Vec<i64>,
+    /// Pcap filenames of app events parsed after their flow was written
+    late_pcaps: Vec<(i64, String)>,
+    /// Events that failed to parse
+    invalid: usize,
 }
 
-/// Add one Eve event to the SQL database
-fn write_event(conn: &mut PgConnection, buf: &str) -> QueryResult<usize> {
-    // Parse EVE JSON to untyped JSON object
-    // After some benchmarks, it was concluded that serde_json parsing is around 30x faster than regex_lite (crate originally used in shovel) captures.
-    // regex create is generally faster compared to serde_json (1.5x-2x times) but having an already parsed JSON is more convinient.
-    // Parsing to generic type serde_json::Value is slower than parsing into a typed struct
-    // TODO: Create struct for parsing EVE JSON format
-    let Ok(eve_json): Result<serde_json::Value, serde_json::Error> = serde_json::from_str(buf) else {
-        log::warn!("Failed to parse EVE JSON.");
-        return Ok(0);
-    };
+// Rows per INSERT statement, PostgreSQL accepts at most 65535 bind parameters per statement.
+const ROWS_PER_STATEMENT: usize = 1000;
+
+// Suricata flow ids fit in 51 bits, upper bits hold the shard of parallel ingestion.
+const FLOW_ID_BITS: u32 = 51;
+pub const MAX_FLOW_ID_SHARD: u16 = (1 << (63 - FLOW_ID_BITS)) - 1;
+
+// Flows, payloads and flow events are partitioned by hour, in microseconds.
+const PARTITION_LENGTH: i64 = 3_600_000_000;
+
+// Serialize migrations of concurrent Suricata instances sharing the database.
+const MIGRATIONS_LOCK_ID: i64 = 0x64696767;
+
+// Time PostgreSQL is given to accept connections when Suricata starts.
+const READY_TIMEOUT: time::Duration = time::Duration::from_secs(60);
+const READY_RETRY_DELAY: time::Duration = time::Duration::from_millis(250);
 
+/// Offset added to the flow ids of a shard, so that Suricata instances ingesting
+/// in parallel never write the same flow ids.
+pub fn flow_id_base(shard: u16) -> i64 {
+    assert!(shard <= MAX_FLOW_ID_SHARD, "Flow id shard must be at most {MAX_FLOW_ID_SHARD}");
+    (shard as i64) << FLOW_ID_BITS
+}
+
+/// Lock a mutex shared by writers, a writer that panicked while holding it
+/// does not stop the others.
+pub(crate) fn lock<T>(mutex: &Mutex<T>) -> MutexGuard<'_, T> {
+    mutex.lock().unwrap_or_else(PoisonError::into_inner)
+}
+
+/// Convert one Eve event to a table row, events missing a column are rejected.
+fn push_event<'a>(rows: &mut Rows<'a>, pcap_cache: &mut FlowPcapCache, flow_id_base: i64, event: Event<'a>) -> Result<(), &'static str> {
     // Ignore events that don't have event_type field, such as stats.
-    let event_type = match eve_json.get("event_type") {
-        Some(v) => v.as_str().unwrap(),
-        None => return Ok(0)
+    let Some(event_type) = event.event_type else {
+        return Ok(());
     };
 
-    let timestamp = chrono::DateTime::parse_from_str(eve_json.get("timestamp").expect("Missing timestamp.").as_str().unwrap(), "%Y-%m-%dT%H:%M:%S%.6f%z").unwrap().timestamp_micros();
-    let flow_id = match eve_json.get("flow_id") {
-        Some(v) => v.as_i64().unwrap(),
-        None => return Ok(0)
+    let timestamp = parse_timestamp(&event.timestamp.ok_or("missing timestamp")?).ok_or("invalid timestamp")?;
+    let Some(flow_id) = event.flow_id.map(|id| id | flow_id_base) else {
+        return Ok(());
     };
 
     // HACK: collect pcap_filename from app events, then use it later when writing flow event.
     // `pcap_filename` pointed by flow events seem wrong, this is maybe a Suricata bug.
+    // The JSON representation (with quotes) is stored, as the frontend expects.
     if event_type != "flow" {
-        if let Some(pcap_filename) = eve_json.get("pcap_filename") {
-            if let Ok(ref mut m) = FLOW_PCAP.try_lock() {
-                m.insert(flow_id, pcap_filename.to_string());
-            }
-            else {
-                log::warn!("Failed to lock FLOW_PCAP mutex, skipping insertion.");
+        if let Some(pcap_filename) = event.pcap_filename {
+            if pcap_cache.insert(flow_id, pcap_filename.get(), timestamp) {
+                rows.late_pcaps.push((flow_id, pcap_filename.get().to_string()));
             }
         }
     }
 
-    match event_type {
+    let extra_data = event.data.map(RawJson);
+    match event_type.as_ref() {
         "flow" => {
-            let src_ip = eve_json.get("src_ip").expect("Missing src_ip").as_str().unwrap();
-            let src_port: Option<i32> = match eve_json.get("src_port") {
-                Some(v) => Some(v.as_i64().unwrap().try_into().unwrap()),
-                None => None
-            };
-            let dest_ip = eve_json.get("dest_ip").expect("Missing dest_ip").as_str().unwrap();
-            let dest_port: Option<i32> = match eve_json.get("dest_port") {
-                Some(v) => Some(v.as_i64().unwrap().try_into().unwrap()),
-                None => None
-            };
-            
-            let flow_pcap_local = FLOW_PCAP.lock().unwrap();
-            let pcap_filename = match flow_pcap_local.get(&flow_id) {
-                Some(v) => Some(v.as_str()),
-                None => match eve_json.get("pcap_filename") {
-                    Some(p) => Some(p.as_str().unwrap()),
-                    None => Some("")
-                }
-            };
+            let times = FlowTimes::parse(event.flow.ok_or("missing flow")?).map_err(|_| "missing flow timestamps")?;
+            let ts_start = parse_timestamp(&times.start).ok_or("invalid flow start")?;
+            let ts_end = parse_timestamp(&times.end).ok_or("invalid flow end")?;
+            let src_ip = event.src_ip.ok_or("missing src_ip")?;
+            let dest_ip = event.dest_ip.ok_or("missing dest_ip")?;
+            let proto = event.proto.ok_or("missing proto")?;
 
-            let proto = eve_json.get("proto").unwrap().as_str().unwrap();
-            let app_proto = match eve_json.get("app_proto") {
-                Some(v) => Some(v.as_str().unwrap()),
-                None => None
+            let pcap_filename = match pcap_cache.take(flow_id) {
+                Some(v) => Some(v.to_string()),
+                None => {
+                    rows.unmatched_flows.push(flow_id);
+                    Some(event.pcap_filename.map(|p| p.get().to_string()).unwrap_or_default())
+                }
             };
-            let metadata = eve_json.get("metadata").cloned();
-            let extra_data = eve_json.get("flow").cloned();
-
-            let ts_start = chrono::DateTime::parse_from_str(extra_data.as_ref().unwrap().get("start").expect("Missing start timestamp.").as_str().unwrap(), "%Y-%m-%dT%H:%M:%S%.6f%z").unwrap().timestamp_micros();
-            let ts_end = chrono::DateTime::parse_from_str(extra_data.as_ref().unwrap().get("end").expect("Missing end timestamp.").as_str().unwrap(), "%Y-%m-%dT%H:%M:%S%.6f%z").unwrap().timestamp_micros();
 
-            let new_flow = NewFlow {
+            rows.flows.push(NewFlow {
                 id: flow_id,
                 ts_start,
                 ts_end,
                 src_ip,
-                src_port,
+                src_port: event.src_port,
                 dest_ip,
-                dest_port,
+                dest_port: event.dest_port,
                 pcap_filename,
                 proto,
-                app_proto,
-                metadata,
+                app_proto: event.app_proto,
+                metadata: event.metadata.map(RawJson),
                 extra_data,
-            };
-
-            diesel::insert_into(flow::table)
-                .values(&new_flow)
-                .on_conflict_do_nothing()
-                .execute(conn)
+            });
         },
-        "alert" => {
-            let new_alert = NewAlert {
-                flow_id,
-                timestamp,
-                extra_data: eve_json.get("alert").cloned()
-            };
+        "alert" => rows.alerts.push(NewAlert { flow_id, timestamp, extra_data }),
+        "anomaly" => rows.anomalies.push(NewAnomaly { flow_id, timestamp, extra_data }),
+        "fileinfo" => rows.fileinfos.push(NewFileinfo { flow_id, timestamp, extra_data }),
+        _ => rows.app_events.push(NewAppEvent {
+            flow_id,
+            timestamp,
+            app_proto: event_type,
+            extra_data,
+        }),
+    }
+    Ok(())
+}
 
-            diesel::insert_into(alert::table)
-                .values(&new_alert)
-                .on_conflict_do_nothing()
-                .execute(conn)
-        },
-        "anomaly" => {
-            let new_anomaly = NewAnomaly {
-                flow_id,
-                timestamp,
-                extra_data: eve_json.get("anomaly").cloned()
-            };
+/// Parse a batch of Eve events to rows borrowing from `bufs`.
+fn parse_batch<'a>(pcap_cache: &mut FlowPcapCache, flow_id_base: i64, bufs: &'a [String]) -> Rows<'a> {
+    // Parse EVE JSON to typed events borrowing from `bufs`, see `benches/eve_parse.rs`.
+    // Only column fields are decoded, JSON subtrees are passed through to JSONB as-is.
+    let mut rows = Rows::default();
+    for buf in bufs {
+        let result = Event::parse(buf)
+            .map_err(|_| "invalid JSON")
+            .and_then(|event| push_event(&mut rows, pcap_cache, flow_id_base, event));
+        if let Err(err) = result {
+            rows.invalid += 1;
+            log::warn!("Failed to parse EVE event: {err}.");
+        }
+    }
+    rows
+}
 
-            diesel::insert_into(anomaly::table)
-                .values(&new_anomaly)
-                .on_conflict_do_nothing()
-                .execute(conn)
-        },
-        "fileinfo" => {
-            let new_fileinfo = NewFileinfo {
-                flow_id,
-                timestamp,
-                extra_data: eve_json.get("fileinfo").cloned()
-            };
+/// Hours covered by the partitioned rows of a batch.
+fn partition_hours(rows: &Rows) -> Vec<i64> {
+    let mut hours: Vec<i64> = rows.flows.iter().map(|r| r.ts_start)
+        .chain(rows.anomalies.iter().map(|r| r.timestamp))
+        .chain(rows.fileinfos.iter().map(|r| r.timestamp))
+        .chain(rows.app_events.iter().map(|r| r.timestamp))
+        .map(|ts| ts - ts.rem_euclid(PARTITION_LENGTH))
+        .collect();
+    hours.sort_unstable();
+    hours.dedup();
+    hours
+}
 
-            diesel::insert_into(fileinfo::table)
-                .values(&new_fileinfo)
-                .on_conflict_do_nothing()
-                .execute(conn)
-        },
-        _ => {
-            let new_app_event = NewAppEvent {
-                flow_id,
-                timestamp,
-                app_proto: event_type.to_string(),
-                extra_data: eve_json.get(event_type).cloned()
-            };
+/// Write rows using one multi-row INSERT per table inside a single transaction.
+fn insert_rows(conn: &mut PgConnection, rows: &Rows) -> QueryResult<usize> {
+    // Partitions are created outside of the batch transaction, so that concurrent
+    // writers only wait for each other while a partition is being created.
+    let hours = partition_hours(rows);
+    if !hours.is_empty() {
+        diesel::sql_query("SELECT create_time_partitions(h) FROM unnest($1) h")
+            .bind::<Array<BigInt>, _>(&hours)
+            .execute(conn)?;
+    }
+
+    conn.transaction(|conn| {
+        let mut inserted = 0;
+        for chunk in rows.flows.chunks(ROWS_PER_STATEMENT) {
+            inserted += diesel::insert_into(flow::table).values(chunk).on_conflict_do_nothing().execute(conn)?;
+        }
+        for chunk in rows.alerts.chunks(ROWS_PER_STATEMENT) {
+            inserted += diesel::insert_into(alert::table).values(chunk).on_conflict_do_nothing().execute(conn)?;
+        }
+        for chunk in rows.anomalies.chunks(ROWS_PER_STATEMENT) {
+            inserted += diesel::insert_into(anomaly::table).values(chunk).on_conflict_do_nothing().execute(conn)?;
+        }
+        for chunk in rows.fileinfos.chunks(ROWS_PER_STATEMENT) {
+            inserted += diesel::insert_into(fileinfo::table).values(chunk).on_conflict_do_nothing().execute(conn)?;
+        }
+        for chunk in rows.app_events.chunks(ROWS_PER_STATEMENT) {
+            inserted += diesel::insert_into(app_event::table).values(chunk).on_conflict_do_nothing().execute(conn)?;
+        }
+        // Flows of late app events were committed by earlier batches
+        update_pcap_filenames(conn, &rows.late_pcaps)?;
+        Ok(inserted)
+    })
+}
+
+/// Write the pcap filenames of app events parsed after the event of their flow.
+fn update_pcap_filenames(conn: &mut PgConnection, pcaps: &[(i64, String)]) -> QueryResult<usize> {
+    if pcaps.is_empty() {
+        return Ok(0);
+    }
+    let (ids, names): (Vec<i64>, Vec<&str>) = pcaps.iter().map(|(id, name)| (*id, name.as_str())).unzip();
+    diesel::sql_query("UPDATE flow SET pcap_filename = p.name FROM unnest($1, $2) AS p(id, name) WHERE flow.id = p.id")
+        .bind::<Array<BigInt>, _>(&ids)
+        .bind::<Array<Text>, _>(&names)
+        .execute(conn)
+}
+
+/// Add a batch of Eve events to the SQL database, using one multi-row INSERT
+/// per table inside a single transaction.
+pub fn write_batch(conn: &mut PgConnection, pcap_cache: &mut FlowPcapCache, flow_id_base: i64, bufs: &[String]) -> QueryResult<usize> {
+    let rows = parse_batch(pcap_cache, flow_id_base, bufs);
+    let inserted = insert_rows(conn, &rows)?;
+    let late = pcap_cache.written_without_pcap(&rows.unmatched_flows);
+    update_pcap_filenames(conn, &late)?;
+    Ok(inserted)
+}
+
+pub type Batch = Vec<String>;
 
-            diesel::insert_into(app_event::table)
-                .values(&new_app_event)
-                .on_conflict_do_nothing()
-                .execute(conn)
+/// Ingest counters, published to the `ingest_stats` table for `./start.py top`
+/// and served to Prometheus, see [`crate::metrics`].
+#[derive(Default)]
+pub struct Counters {
+    /// Events received from Suricata
+    pub received: AtomicUsize,
+    /// Batches waiting in the channel to the writers
+    pub queued: AtomicUsize,
+    /// Events handled by writers
+    pub written: AtomicUsize,
+    /// Rows inserted, conflicting rows are skipped
+    pub inserted: AtomicUsize,
+    /// Events of batches that failed to be written
+    pub failed: AtomicUsize,
+    /// Events that failed to parse or to be sent to the writers
+    pub dropped: AtomicUsize,
+    /// Time to parse and insert each batch
+    pub batch_latency: Histogram,
+}
+
+/// Wait until PostgreSQL accepts connections, at most `timeout`.
+/// Compose already starts Suricata once PostgreSQL is healthy, this covers other deployments.
+fn wait_ready(url: &str, timeout: time::Duration) {
+    let deadline = time::Instant::now() + timeout;
+    loop {
+        match PgConnection::establish(url) {
+            Ok(_) => return,
+            Err(err) if time::Instant::now() < deadline => {
+                log::debug!("Waiting for PostgreSQL: {err}");
+                thread::sleep(READY_RETRY_DELAY);
+            }
+            Err(err) => {
+                log::warn!("PostgreSQL is not ready after {}s: {err}", timeout.as_secs());
+                return;
+            }
         }
     }
 }
 
+/// Pool of database writers sharing a connection pool and the flow pcap cache.
+#[derive(Clone)]
 pub struct Database {
-    conn: PgConnection,
-    rx: std::sync::mpsc::Receiver<String>,
-    count: usize,
-    count_inserted: usize,
+    pool: Pool<ConnectionManager<PgConnection>>,
+    pcap_cache: Arc<Mutex<FlowPcapCache>>,
+    flow_id_base: i64,
+    pub counters: Arc<Counters>,
 }
 
 impl Database {
-    /// Open Postgres database connection.
-    pub fn new(
-        url: String,
-        rx: std::sync::mpsc::Receiver<String>,
-    ) -> Result<Self, ConnectionError> {
-        // Lazy, ait for PostgreSQL container to start
-        thread::sleep(time::Duration::from_secs(5));
-
-        let mut conn = PgConnection::establish(&url)?;
+    /// Open Postgres connection pool and run migrations.
+    /// Flow ids are offset by `flow_id_base`, see [`flow_id_base`].
+    pub fn new(url: String, pool_size: u32, pcap_cache: FlowPcapCache, flow_id_base: i64) -> Result<Self, PoolError> {
+        wait_ready(&url, READY_TIMEOUT);
+
+        let pool = Pool::builder()
+            .max_size(pool_size)
+            .build(ConnectionManager::<PgConnection>::new(url))?;
+        let mut conn = pool.get()?;
+        diesel::sql_query(format!("SELECT pg_advisory_lock({MIGRATIONS_LOCK_ID})")).execute(&mut conn).unwrap();
         conn.run_pending_migrations(MIGRATIONS).unwrap();
+        diesel::sql_query(format!("SELECT pg_advisory_unlock({MIGRATIONS_LOCK_ID})")).execute(&mut conn).unwrap();
 
         Ok(Self {
-            conn,
-            rx,
-            count: 0,
-            count_inserted: 0,
+            pool,
+            pcap_cache: Arc::new(Mutex::new(pcap_cache)),
+            flow_id_base,
+            counters: Arc::new(Counters::default()),
         })
     }
 
-    fn batch_write_events(&mut self) -> Result<(), diesel::result::Error> {
-        while let Ok(buf) = self.rx.recv() {
-            // Insert first event
-            self.count += 1;
-            self.count_inserted += write_event(&mut self.conn, &buf)?;
-
-            // Insert remaining events
-            let batch = self
-                .rx
-                .try_iter()
-                .map(|buf| write_event(&mut self.conn, &buf))
-                .collect::<Result<Vec<_>, _>>()?;
-            self.count += batch.len();
-            self.count_inserted += batch.iter().sum::<usize>();
-        }
+    /// Start `n` writer threads consuming batches from `rx` until it is closed.
+    pub fn spawn_writers(&self, n: usize, rx: Receiver<Batch>) -> Vec<JoinHandle<()>> {
+        let rx = Arc::new(Mutex::new(rx));
+        (0..n)
+            .map(|i| {
+                let writer = Writer {
+                    id: i,
+                    pool: self.pool.clone(),
+                    rx: rx.clone(),
+                    pcap_cache: self.pcap_cache.clone(),
+                    flow_id_base: self.flow_id_base,
+                    counters: self.counters.clone(),
+                };
+                thread::spawn(move || writer.run())
+            })
+            .collect()
+    }
+
+    /// Connection pool, shared with the payload loaders.
+    pub fn pool(&self) -> Pool<ConnectionManager<PgConnection>> {
+        self.pool.clone()
+    }
+
+    /// Flows in the flow pcap cache.
+    pub fn pcap_cache_size(&self) -> usize {
+        lock(&self.pcap_cache).len()
+    }
+
+    /// Write counters to the `ingest_stats` row of `source`.
+    pub fn publish_stats(&self, source: &str) -> Result<(), String> {
+        let counters = &self.counters;
+        let pcap_cache_size = self.pcap_cache_size();
+        let stats = serde_json::json!({
+            "received": counters.received.load(Ordering::Relaxed),
+            "queued": counters.queued.load(Ordering::Relaxed),
+            "written": counters.written.load(Ordering::Relaxed),
+            "inserted": counters.inserted.load(Ordering::Relaxed),
+            "failed": counters.failed.load(Ordering::Relaxed),
+            "dropped": counters.dropped.load(Ordering::Relaxed),
+            "pcap_cache_size": pcap_cache_size,
+        });
+
+        let mut conn = self.pool.get().map_err(|e| e.to_string())?;
+        diesel::sql_query(
+            "INSERT INTO ingest_stats (source, stats, updated_at) VALUES ($1, $2, now()) \
+             ON CONFLICT (source) DO UPDATE SET stats = EXCLUDED.stats, updated_at = EXCLUDED.updated_at",
+        )
+        .bind::<Text, _>(source)
+        .bind::<Jsonb, _>(stats)
+        .execute(&mut conn)
+        .map_err(|e| e.to_string())?;
         Ok(())
     }
 
-    /// Database thread entry
-    pub fn run(&mut self) {
-        log::debug!("Database thread started");
-        if let Err(err) = self.batch_write_events() {
-            log::error!("Failed to write batch of events: {err:?}");
-        }
+    /// Log counters, to be called once writers are finished.
+    pub fn log_stats(&self) {
+        log::info!(
+            "Database writers finished: count={} inserted={} failed={} dropped={}",
+            self.counters.written.load(Ordering::Relaxed),
+            self.counters.inserted.load(Ordering::Relaxed),
+            self.counters.failed.load(Ordering::Relaxed),
+            self.counters.dropped.load(Ordering::Relaxed)
+        );
+        let pcap_cache = lock(&self.pcap_cache);
         log::info!(
-            "Database thread finished: count={} inserted={}",
-            self.count,
-            self.count_inserted
+            "Flow pcap cache: size={} hits={} misses={} evictions={} late={}",
+            pcap_cache.len(),
+            pcap_cache.hits,
+            pcap_cache.misses,
+            pcap_cache.evictions,
+            pcap_cache.late
         );
     }
 }
+
+struct Writer {
+    id: usize,
+    pool: Pool<ConnectionManager<PgConnection>>,
+    rx: Arc<Mutex<Receiver<Batch>>>,
+    pcap_cache: Arc<Mutex<FlowPcapCache>>,
+    flow_id_base: i64,
+    counters: Arc<Counters>,
+}
+
+impl Writer {
+    fn write(&self, batch: &Batch) -> Result<usize, String> {
+        let mut conn = self.pool.get().map_err(|e| e.to_string())?;
+        // Hold the cache lock only while parsing
+        let rows = parse_batch(&mut lock(&self.pcap_cache), self.flow_id_base, batch);
+        self.counters.dropped.fetch_add(rows.invalid, Ordering::Relaxed);
+        let inserted = insert_rows(&mut conn, &rows).map_err(|e| e.to_string())?;
+        // Once committed, flows written without pcap filename get the ones parsed meanwhile
+        let late = lock(&self.pcap_cache).written_without_pcap(&rows.unmatched_flows);
+        update_pcap_filenames(&mut conn, &late).map_err(|e| e.to_string())?;
+        Ok(inserted)
+    }
+
+    /// Writer thread entry
+    fn run(self) {
+        log::debug!("Database writer {} started", self.id);
+        loop {
+            // Only one idle writer waits on the channel at a time
+            let batch = match lock(&self.rx).recv() {
+                Ok(batch) => batch,
+                Err(_) => break,
+            };
+            self.counters.queued.fetch_sub(1, Ordering::Relaxed);
+            self.counters.written.fetch_add(batch.len(), Ordering::Relaxed);
+            let start = time::Instant::now();
+            let result = self.write(&batch);
+            self.counters.batch_latency.observe(start.elapsed());
+            match result {
+                Ok(inserted) => {
+                    self.counters.inserted.fetch_add(inserted, Ordering::Relaxed);
+                }
+                Err(err) => {
+                    self.counters.failed.fetch_add(batch.len(), Ordering::Relaxed);
+                    log::error!("Failed to write batch of {} events: {err}", batch.len());
+                }
+            }
+        }
+        log::debug!("Database writer {} finished", self.id);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const FLOW: &str = r#"{"timestamp":"2024-05-04T10:01:01.000000+0000","flow_id":7,"pcap_filename":"b.pcap","event_type":"flow","src_ip":"10.60.1.1","src_port":41234,"dest_ip":"10.60.2.1","dest_port":8080,"proto":"TCP","app_proto":"http","flow":{"start":"2024-05-04T10:00:01.000000+0000","end":"2024-05-04T10:00:02.000000+0000"}}"#;
+    const HTTP: &str = r#"{"timestamp":"2024-05-04T10:00:01.500000+0000","flow_id":7,"pcap_filename":"a.pcap","event_type":"http","src_ip":"10.60.1.1","dest_ip":"10.60.2.1","proto":"TCP","http":{"url":"/a\"b","http_user_agent":"Agent"}}"#;
+    const ALERT: &str = r#"{"timestamp":"2024-05-04T10:00:01.600000+0000","flow_id":7,"event_type":"alert","alert":{"signature":"FLAG OUT"}}"#;
+
+    fn parse(events: &[&str]) -> (Vec<String>, FlowPcapCache) {
+        let bufs = events.iter().map(|e| e.to_string()).collect();
+        (bufs, FlowPcapCache::new(100, time::Duration::from_secs(60)))
+    }
+
+    #[test]
+    fn parses_events_by_table() {
+        let (bufs, mut cache) = parse(&[HTTP, ALERT, FLOW]);
+        let rows = parse_batch(&mut cache, 0, &bufs);
+        assert_eq!((rows.flows.len(), rows.alerts.len(), rows.app_events.len(), rows.invalid), (1, 1, 1, 0));
+
+        let flow = &rows.flows[0];
+        assert_eq!((flow.id, flow.ts_start, flow.ts_end), (7, 1_714_816_801_000_000, 1_714_816_802_000_000));
+        assert_eq!((flow.src_ip.as_ref(), flow.dest_port, flow.proto.as_ref()), ("10.60.1.1", Some(8080), "TCP"));
+        // pcap_filename of app events wins over the flow event one
+        assert_eq!(flow.pcap_filename.as_deref(), Some("\"a.pcap\""));
+        assert!(cache.is_empty());
+
+        let app_event = &rows.app_events[0];
+        assert_eq!((app_event.app_proto.as_ref(), app_event.timestamp), ("http", 1_714_816_801_500_000));
+        assert_eq!(app_event.extra_data.unwrap().0.get(), r#"{"url":"/a\"b","http_user_agent":"Agent"}"#);
+    }
+
+    #[test]
+    fn reports_app_events_parsed_after_their_flow() {
+        let (bufs, mut cache) = parse(&[FLOW, HTTP]);
+        let flow_batch = parse_batch(&mut cache, 0, &bufs[..1]);
+        assert_eq!(flow_batch.flows[0].pcap_filename.as_deref(), Some("\"b.pcap\""));
+        assert_eq!(flow_batch.unmatched_flows, vec![7]);
+
+        // Committed after the app event was parsed by another writer
+        let app_batch = parse_batch(&mut cache, 0, &bufs[1..]);
+        assert!(app_batch.late_pcaps.is_empty());
+        assert_eq!(cache.written_without_pcap(&flow_batch.unmatched_flows), vec![(7, "\"a.pcap\"".to_string())]);
+
+        // Parsed once the flow was committed
+        cache.written_without_pcap(&[8]);
+        let bufs = vec![HTTP.replace(r#""flow_id":7"#, r#""flow_id":8"#)];
+        let late = parse_batch(&mut cache, 0, &bufs);
+        assert_eq!(late.late_pcaps, vec![(8, "\"a.pcap\"".to_string())]);
+    }
+
+    #[test]
+    fn offsets_flow_ids_of_shard() {
+        let (bufs, mut cache) = parse(&[FLOW, ALERT]);
+        let rows = parse_batch(&mut cache, flow_id_base(3), &bufs);
+        assert_eq!(rows.flows[0].id, (3 << FLOW_ID_BITS) | 7);
+        assert_eq!(rows.alerts[0].flow_id, (3 << FLOW_ID_BITS) | 7);
+    }
+
+    #[test]
+    fn skips_malformed_events() {
+        let (bufs, mut cache) = parse(&[
+            "{not json",
+            r#"{"event_type":"alert","flow_id":7,"alert":{}}"#,
+            r#"{"event_type":"alert","flow_id":7,"timestamp":"yesterday"}"#,
+            &FLOW.replace(r#""src_ip":"10.60.1.1","#, ""),
+            &FLOW.replace(r#""start":"2024-05-04T10:00:01.000000+0000","#, ""),
+            // Stats and events without flow are not stored
+            r#"{"timestamp":"2024-05-04T10:00:01.000000+0000","stats":{}}"#,
+            r#"{"timestamp":"2024-05-04T10:00:01.000000+0000","event_type":"dns"}"#,
+            ALERT,
+        ]);
+        let rows = parse_batch(&mut cache, 0, &bufs);
+        assert_eq!(rows.invalid, 5);
+        assert_eq!((rows.flows.len(), rows.alerts.len(), rows.app_events.len()), (0, 1, 0));
+    }
+
+    #[test]
+    fn groups_partition_hours() {
+        let (bufs, mut cache) = parse(&[FLOW, HTTP, ALERT]);
+        let rows = parse_batch(&mut cache, 0, &bufs);
+        assert_eq!(partition_hours(&rows), vec![1_714_816_800_000_000]);
+    }
+}
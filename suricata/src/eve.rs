@@ -0,0 +1,214 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Typed and borrowing Eve JSON parsing.
+//!
+//! Only the fields stored in dedicated columns are decoded, every JSON subtree
+//! is kept as a [`RawValue`] slice of the input buffer and written as-is to JSONB.
+//! Strings borrow from the input, unless they contain JSON escapes, e.g. an
+//! escaped quote in an HTTP URI, which are unescaped to an owned copy.
+
+use serde::de::{Deserializer, MapAccess, Visitor};
+use serde::Deserialize;
+use serde_json::value::RawValue;
+use std::borrow::Cow;
+use std::fmt;
+
+/// One Eve event, borrowing from the JSON line it was parsed from.
+#[derive(Default)]
+pub struct Event<'a> {
+    pub event_type: Option<Cow<'a, str>>,
+    pub timestamp: Option<Cow<'a, str>>,
+    pub flow_id: Option<i64>,
+    pub pcap_filename: Option<&'a RawValue>,
+    pub src_ip: Option<Cow<'a, str>>,
+    pub src_port: Option<i32>,
+    pub dest_ip: Option<Cow<'a, str>>,
+    pub dest_port: Option<i32>,
+    pub proto: Option<Cow<'a, str>>,
+    pub app_proto: Option<Cow<'a, str>>,
+    pub metadata: Option<&'a RawValue>,
+    pub flow: Option<&'a RawValue>,
+    /// Subtree named after `event_type`, e.g. `alert` or `http`.
+    pub data: Option<&'a RawValue>,
+}
+
+impl<'a> Event<'a> {
+    /// Parse one Eve JSON line.
+    pub fn parse(buf: &'a str) -> serde_json::Result<Self> {
+        serde_json::from_str(buf)
+    }
+}
+
+impl<'de> Deserialize<'de> for Event<'de> {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Self, D::Error> {
+        deserializer.deserialize_map(EventVisitor)
+    }
+}
+
+/// String borrowed from the input when it has no escape, `Cow<str>` alone always copies.
+#[derive(Deserialize)]
+struct Str<'a>(#[serde(borrow)] Cow<'a, str>);
+
+fn next_str<'de, A: MapAccess<'de>>(map: &mut A) -> Result<Option<Cow<'de, str>>, A::Error> {
+    Ok(Some(map.next_value::<Str<'de>>()?.0))
+}
+
+struct EventVisitor;
+
+impl<'de> Visitor<'de> for EventVisitor {
+    type Value = Event<'de>;
+
+    fn expecting(&self, formatter: &mut fmt::Formatter) -> fmt::Result {
+        formatter.write_str("an Eve JSON object")
+    }
+
+    fn visit_map<A: MapAccess<'de>>(self, mut map: A) -> Result<Self::Value, A::Error> {
+        let mut event = Event::default();
+        // `event_type` is not guaranteed to come before its subtree
+        let mut subtrees: Vec<(Cow<'de, str>, &'de RawValue)> = Vec::new();
+
+        while let Some(Str(key)) = map.next_key::<Str<'de>>()? {
+            match key.as_ref() {
+                "event_type" => event.event_type = next_str(&mut map)?,
+                "timestamp" => event.timestamp = next_str(&mut map)?,
+                "flow_id" => event.flow_id = Some(map.next_value()?),
+                "pcap_filename" => event.pcap_filename = Some(map.next_value()?),
+                "src_ip" => event.src_ip = next_str(&mut map)?,
+                "src_port" => event.src_port = Some(map.next_value()?),
+                "dest_ip" => event.dest_ip = next_str(&mut map)?,
+                "dest_port" => event.dest_port = Some(map.next_value()?),
+                "proto" => event.proto = next_str(&mut map)?,
+                "app_proto" => event.app_proto = next_str(&mut map)?,
+                "metadata" => event.metadata = Some(map.next_value()?),
+                "flow" => event.flow = Some(map.next_value()?),
+                _ => subtrees.push((key, map.next_value()?)),
+            }
+        }
+
+        event.data = match event.event_type.as_deref() {
+            Some("flow") => event.flow,
+            Some(t) => subtrees.into_iter().find(|(k, _)| k == t).map(|(_, v)| v),
+            None => None,
+        };
+        Ok(event)
+    }
+}
+
+/// Start and end timestamps of a flow event `flow` subtree.
+#[derive(Deserialize)]
+pub struct FlowTimes<'a> {
+    #[serde(borrow)]
+    pub start: Cow<'a, str>,
+    #[serde(borrow)]
+    pub end: Cow<'a, str>,
+}
+
+impl<'a> FlowTimes<'a> {
+    pub fn parse(raw: &'a RawValue) -> serde_json::Result<Self> {
+        serde_json::from_str(raw.get())
+    }
+}
+
+/// Parse an Eve timestamp such as `2023-09-23T15:00:00.123456+0200` to microseconds since epoch.
+///
+/// Suricata always writes this fixed-width format, so it is decoded by hand.
+/// Anything else falls back to chrono.
+pub fn parse_timestamp(s: &str) -> Option<i64> {
+    fn digits(b: &[u8]) -> Option<i64> {
+        b.iter().try_fold(0i64, |acc, c| match c {
+            b'0'..=b'9' => Some(acc * 10 + (c - b'0') as i64),
+            _ => None,
+        })
+    }
+
+    let b = s.as_bytes();
+    let fast = || -> Option<i64> {
+        if b.len() != 31 || b[4] != b'-' || b[7] != b'-' || b[10] != b'T' || b[13] != b':' || b[16] != b':' || b[19] != b'.' {
+            return None;
+        }
+        let (year, month, day) = (digits(&b[0..4])?, digits(&b[5..7])?, digits(&b[8..10])?);
+        let (hour, minute, second) = (digits(&b[11..13])?, digits(&b[14..16])?, digits(&b[17..19])?);
+        let micros = digits(&b[20..26])?;
+        let offset = (digits(&b[27..29])? * 3600 + digits(&b[29..31])? * 60)
+            * match b[26] {
+                b'+' => 1,
+                b'-' => -1,
+                _ => return None,
+            };
+        if !(1..=12).contains(&month) || !(1..=31).contains(&day) {
+            return None;
+        }
+
+        // Days since epoch in the proleptic Gregorian calendar
+        let y = if month <= 2 { year - 1 } else { year };
+        let era = y.div_euclid(400);
+        let yoe = y - era * 400;
+        let doy = (153 * ((month + 9) % 12) + 2) / 5 + day - 1;
+        let doe = yoe * 365 + yoe / 4 - yoe / 100 + doy;
+        let days = era * 146097 + doe - 719468;
+
+        Some((days * 86400 + hour * 3600 + minute * 60 + second - offset) * 1_000_000 + micros)
+    };
+
+    fast().or_else(|| {
+        chrono::DateTime::parse_from_str(s, "%Y-%m-%dT%H:%M:%S%.6f%z")
+            .ok()
+            .map(|t| t.timestamp_micros())
+    })
+}
+
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn parses_fixed_width_timestamps() {
+        assert_eq!(parse_timestamp("1970-01-01T00:00:00.000001+0000"), Some(1));
+        assert_eq!(parse_timestamp("1970-01-01T02:00:00.000000+0200"), Some(0));
+        assert_eq!(parse_timestamp("1969-12-31T23:30:00.000000-0030"), Some(0));
+        assert_eq!(parse_timestamp("2000-02-29T12:00:00.500000+0000"), Some(951_825_600_500_000));
+
+        let s = "2023-09-23T15:00:00.123456+0200";
+        let expected = chrono::DateTime::parse_from_str(s, "%Y-%m-%dT%H:%M:%S%.6f%z").unwrap().timestamp_micros();
+        assert_eq!(parse_timestamp(s), Some(expected));
+    }
+
+    #[test]
+    fn rejects_invalid_timestamps() {
+        assert_eq!(parse_timestamp(""), None);
+        assert_eq!(parse_timestamp("not a timestamp"), None);
+        assert_eq!(parse_timestamp("2023-13-23T15:00:00.123456+0200"), None);
+        assert_eq!(parse_timestamp("2023-09-23T15:00:00.12345a+0200"), None);
+    }
+
+    #[test]
+    fn borrows_strings_without_escapes() {
+        let buf = r#"{"timestamp":"2024-05-04T10:00:01.123456+0000","event_type":"http","src_ip":"10.60.1.1","http":{"url":"/"}}"#;
+        let event = Event::parse(buf).unwrap();
+        assert!(matches!(event.event_type, Some(Cow::Borrowed("http"))));
+        assert!(matches!(event.src_ip, Some(Cow::Borrowed("10.60.1.1"))));
+        assert_eq!(event.data.unwrap().get(), r#"{"url":"/"}"#);
+    }
+
+    #[test]
+    fn unescapes_strings_and_keys() {
+        let buf = r#"{"event\u005ftype":"http","app_proto":"h\u0074tp","proto":"\"TCP\"","http":{"url":"/a\"b\\c"}}"#;
+        let event = Event::parse(buf).unwrap();
+        assert_eq!(event.event_type.as_deref(), Some("http"));
+        assert!(matches!(event.app_proto, Some(Cow::Owned(ref s)) if s == "http"));
+        assert_eq!(event.proto.as_deref(), Some("\"TCP\""));
+        // Subtrees are kept as written
+        assert_eq!(event.data.unwrap().get(), r#"{"url":"/a\"b\\c"}"#);
+    }
+
+    #[test]
+    fn finds_subtree_before_event_type() {
+        let buf = r#"{"alert":{"signature":"FLAG OUT"},"event_type":"alert","flow":{"start":"s","end":"e"}}"#;
+        let event = Event::parse(buf).unwrap();
+        assert_eq!(event.data.unwrap().get(), r#"{"signature":"FLAG OUT"}"#);
+        let times = FlowTimes::parse(event.flow.unwrap()).unwrap();
+        assert_eq!((times.start.as_ref(), times.end.as_ref()), ("s", "e"));
+    }
+}
@@ -1,24 +1,48 @@
 // Copyright (C) 2024  ANSSI
 // SPDX-License-Identifier: GPL-2.0-or-later
 
-mod database;
+pub mod database;
+pub mod eve;
 mod ffi;
+pub mod metrics;
+pub mod payloads;
+pub mod pcap_cache;
 mod schema;
 mod models;
 
 use std::fmt::Debug;
 use std::os::raw::{c_char, c_int, c_void};
-use std::sync::mpsc;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{mpsc, Arc, Mutex};
 
 
 // Default configuration values.
 const DEFAULT_DATABASE_URI: &str = "postgresql://postgres@postgres:5432/postgres";
 const DEFAULT_BUFFER_SIZE: &str = "1000";
+const DEFAULT_BATCH_SIZE: &str = "1000";
+const DEFAULT_BATCH_TIMEOUT_MS: &str = "100";
+const DEFAULT_WRITERS: &str = "2";
+const DEFAULT_FLOW_PCAP_CAPACITY: &str = "100000";
+const DEFAULT_FLOW_PCAP_TTL: &str = "300";
+const DEFAULT_FLOW_ID_SHARD: &str = "0";
+const DEFAULT_STATS_INTERVAL: &str = "1";
+const DEFAULT_PAYLOAD_SPOOL_DIR: &str = "suricata/output/payloads";
+const DEFAULT_PAYLOAD_LOADERS: &str = "2";
 
 #[derive(Debug, Clone)]
 struct Config {
     db_url: String,
     buffer: usize,
+    batch_size: usize,
+    batch_timeout: std::time::Duration,
+    writers: usize,
+    flow_pcap_capacity: usize,
+    flow_pcap_ttl: std::time::Duration,
+    flow_id_shard: u16,
+    stats_interval: std::time::Duration,
+    metrics_addr: Option<String>,
+    payload_spool_dir: String,
+    payload_loaders: usize,
 }
 
 impl Config {
@@ -29,34 +53,207 @@ impl Config {
                 .unwrap_or(DEFAULT_BUFFER_SIZE.into())
                 .parse()
                 .expect("EVE_BUFFER is not an integer"),
+            batch_size: std::env::var("EVE_BATCH_SIZE")
+                .unwrap_or(DEFAULT_BATCH_SIZE.into())
+                .parse()
+                .expect("EVE_BATCH_SIZE is not an integer"),
+            batch_timeout: std::time::Duration::from_millis(
+                std::env::var("EVE_BATCH_TIMEOUT_MS")
+                    .unwrap_or(DEFAULT_BATCH_TIMEOUT_MS.into())
+                    .parse()
+                    .expect("EVE_BATCH_TIMEOUT_MS is not an integer"),
+            ),
+            writers: std::env::var("EVE_WRITERS")
+                .unwrap_or(DEFAULT_WRITERS.into())
+                .parse()
+                .expect("EVE_WRITERS is not an integer"),
+            flow_pcap_capacity: std::env::var("FLOW_PCAP_CAPACITY")
+                .unwrap_or(DEFAULT_FLOW_PCAP_CAPACITY.into())
+                .parse()
+                .expect("FLOW_PCAP_CAPACITY is not an integer"),
+            flow_pcap_ttl: std::time::Duration::from_secs(
+                std::env::var("FLOW_PCAP_TTL")
+                    .unwrap_or(DEFAULT_FLOW_PCAP_TTL.into())
+                    .parse()
+                    .expect("FLOW_PCAP_TTL is not an integer"),
+            ),
+            flow_id_shard: std::env::var("EVE_FLOW_ID_SHARD")
+                .unwrap_or(DEFAULT_FLOW_ID_SHARD.into())
+                .parse()
+                .expect("EVE_FLOW_ID_SHARD is not an integer"),
+            stats_interval: std::time::Duration::from_secs(
+                std::env::var("EVE_STATS_INTERVAL")
+                    .unwrap_or(DEFAULT_STATS_INTERVAL.into())
+                    .parse()
+                    .expect("EVE_STATS_INTERVAL is not an integer"),
+            ),
+            metrics_addr: std::env::var("EVE_METRICS_ADDR").ok().filter(|addr| !addr.is_empty()),
+            payload_spool_dir: std::env::var("PAYLOAD_SPOOL_DIR").unwrap_or(DEFAULT_PAYLOAD_SPOOL_DIR.into()),
+            payload_loaders: std::env::var("PAYLOAD_LOADERS")
+                .unwrap_or(DEFAULT_PAYLOAD_LOADERS.into())
+                .parse()
+                .expect("PAYLOAD_LOADERS is not an integer"),
+        }
+    }
+}
+
+/// Eve records written by one Suricata thread, sent to the database writers by batches.
+#[derive(Default)]
+struct EventBuffer {
+    events: Mutex<database::Batch>,
+}
+
+/// State shared between Suricata threads and the flusher thread.
+struct Shared {
+    tx: mpsc::SyncSender<database::Batch>,
+    batch_size: usize,
+    buffers: Mutex<Vec<Arc<EventBuffer>>>,
+    running: AtomicBool,
+    counters: Arc<database::Counters>,
+}
+
+impl Shared {
+    fn push(&self, buffer: &EventBuffer, text: String) {
+        let mut events = buffer.events.lock().unwrap();
+        events.push(text);
+        if events.len() >= self.batch_size {
+            let batch = std::mem::replace(&mut *events, Vec::with_capacity(self.batch_size));
+            drop(events);
+            self.send(batch);
+        }
+    }
+
+    fn flush(&self, buffer: &EventBuffer) {
+        let batch = std::mem::take(&mut *buffer.events.lock().unwrap());
+        if !batch.is_empty() {
+            self.send(batch);
+        }
+    }
+
+    fn send(&self, batch: database::Batch) {
+        self.counters.queued.fetch_add(1, Ordering::Relaxed);
+        if let Err(mpsc::SendError(batch)) = self.tx.send(batch) {
+            self.counters.queued.fetch_sub(1, Ordering::Relaxed);
+            self.counters.dropped.fetch_add(batch.len(), Ordering::Relaxed);
+            log::error!("Failed to send Eve records to database writers");
+        }
+    }
+
+    fn register(&self, buffer: Arc<EventBuffer>) {
+        self.buffers.lock().unwrap().push(buffer);
+    }
+
+    fn unregister(&self, buffer: &Arc<EventBuffer>) {
+        self.buffers.lock().unwrap().retain(|b| !Arc::ptr_eq(b, buffer));
+    }
+
+    /// Flusher thread entry, sends partial batches every `batch_timeout`
+    fn run_flusher(&self, batch_timeout: std::time::Duration) {
+        while self.running.load(Ordering::Relaxed) {
+            std::thread::sleep(batch_timeout);
+            let buffers = self.buffers.lock().unwrap().clone();
+            for buffer in &buffers {
+                self.flush(buffer);
+            }
+        }
+    }
+
+    /// Stats thread entry, publishes counters of the EVE writers and payload loaders every `interval`
+    fn run_stats(&self, database: &database::Database, spool: &payloads::Spool, source: &str, interval: std::time::Duration) {
+        while self.running.load(Ordering::Relaxed) {
+            std::thread::sleep(interval);
+            if let Err(err) = database.publish_stats(source) {
+                log::warn!("Failed to publish ingest stats: {err}");
+            }
+            if let Err(err) = spool.publish_stats() {
+                log::warn!("Failed to publish payload stats: {err}");
+            }
         }
     }
 }
 
 struct Context {
-    tx: mpsc::SyncSender<String>,
-    count: usize,
+    shared: Arc<Shared>,
+    /// Buffer used when Suricata does not call ThreadInit, e.g. without threaded EVE
+    buffer: Arc<EventBuffer>,
+    flusher: std::thread::JoinHandle<()>,
+    stats: Option<std::thread::JoinHandle<()>>,
+    stats_source: String,
+    writers: Vec<std::thread::JoinHandle<()>>,
+    database: database::Database,
+    spool: Arc<payloads::Spool>,
+    loaders: Vec<std::thread::JoinHandle<()>>,
 }
 
 extern "C" fn output_init(_conf: *const c_void, threaded: bool, data: *mut *mut c_void) -> c_int {
-    assert!(
-        !threaded,
-        "PostgreSQL output plugin does not support threaded EVE yet"
-    );
-
     // Load configuration
     let config = Config::new();
+    let stats_source = format!("eve-{}", config.flow_id_shard);
+    log::info!("PostgreSQL output started: threaded={threaded} writers={}", config.writers);
 
-    let (tx, rx) = mpsc::sync_channel(config.buffer);
-    let mut database_client = match database::Database::new(config.db_url, rx) {
-        Ok(client) => client,
+    // Channel of batches, sized to hold about `buffer` events
+    let capacity = config.buffer.div_ceil(config.batch_size).max(1);
+    let (tx, rx) = mpsc::sync_channel(capacity);
+    let pcap_cache = pcap_cache::FlowPcapCache::new(config.flow_pcap_capacity, config.flow_pcap_ttl);
+    let pool_size = (config.writers + config.payload_loaders) as u32 + 1;
+    let database = match database::Database::new(config.db_url, pool_size, pcap_cache, database::flow_id_base(config.flow_id_shard)) {
+        Ok(database) => database,
         Err(err) => {
             log::error!("Failed to initialize database client: {:?}", err);
             panic!()
         }
     };
-    std::thread::spawn(move || database_client.run());
-    let context_ptr = Box::into_raw(Box::new(Context { tx, count: 0 }));
+    let writers = database.spawn_writers(config.writers, rx);
+    // Payload batches of the Lua outputs, spooled per shard of parallel ingestion
+    let spool_dir = std::path::Path::new(&config.payload_spool_dir).join(config.flow_id_shard.to_string());
+    let spool = match payloads::Spool::new(spool_dir, config.flow_id_shard, database.pool()) {
+        Ok(spool) => Arc::new(spool),
+        Err(err) => {
+            log::error!("Failed to open payload spool {}: {err}", config.payload_spool_dir);
+            panic!()
+        }
+    };
+    let loaders = spool.spawn_loaders(config.payload_loaders);
+    // Metrics are optional, ingestion goes on if the address is taken
+    if let Some(addr) = &config.metrics_addr {
+        if let Err(err) = metrics::serve(addr, database.clone(), capacity) {
+            log::error!("Failed to serve metrics on {addr}: {err}");
+        }
+    }
+
+    let shared = Arc::new(Shared {
+        tx,
+        batch_size: config.batch_size,
+        buffers: Mutex::new(Vec::new()),
+        running: AtomicBool::new(true),
+        counters: database.counters.clone(),
+    });
+    let buffer = Arc::new(EventBuffer::default());
+    shared.register(buffer.clone());
+    let flusher = {
+        let shared = shared.clone();
+        std::thread::spawn(move || shared.run_flusher(config.batch_timeout))
+    };
+    // Counters read by `./start.py top`, one row per shard of parallel ingestion
+    let stats = (!config.stats_interval.is_zero()).then(|| {
+        let shared = shared.clone();
+        let database = database.clone();
+        let spool = spool.clone();
+        let source = stats_source.clone();
+        std::thread::spawn(move || shared.run_stats(&database, &spool, &source, config.stats_interval))
+    });
+
+    let context_ptr = Box::into_raw(Box::new(Context {
+        shared,
+        buffer,
+        flusher,
+        stats,
+        stats_source,
+        writers,
+        database,
+        spool,
+        loaders,
+    }));
 
     unsafe {
         *data = context_ptr as *mut _;
@@ -66,43 +263,87 @@ extern "C" fn output_init(_conf: *const c_void, threaded: bool, data: *mut *mut
 
 extern "C" fn output_deinit(data: *const c_void) {
     let context = unsafe { Box::from_raw(data as *mut Context) };
-    log::info!("PostgreSQL output finished: count={}", context.count);
-    std::mem::drop(context);
+    let Context { shared, buffer, flusher, stats, stats_source, writers, database, spool, loaders } = *context;
+
+    // Stop the flusher, send what is left, then close the channel and wait for writers
+    shared.running.store(false, Ordering::Relaxed);
+    let _ = flusher.join();
+    if let Some(stats) = stats {
+        let _ = stats.join();
+    }
+    shared.flush(&buffer);
+    for remaining in shared.buffers.lock().unwrap().iter() {
+        shared.flush(remaining);
+    }
+    let received = shared.counters.received.load(Ordering::Relaxed);
+    std::mem::drop(shared);
+    for writer in writers {
+        let _ = writer.join();
+    }
+
+    // Payload batches spooled until now are loaded, later ones at the next start
+    spool.stop();
+    for loader in loaders {
+        let _ = loader.join();
+    }
+
+    log::info!("PostgreSQL output finished: count={received}");
+    database.log_stats();
+    spool.log_stats();
+    if let Err(err) = database.publish_stats(&stats_source) {
+        log::warn!("Failed to publish ingest stats: {err}");
+    }
+    if let Err(err) = spool.publish_stats() {
+        log::warn!("Failed to publish payload stats: {err}");
+    }
 }
 
 extern "C" fn output_write(
     buffer: *const c_char,
     buffer_len: c_int,
     data: *const c_void,
-    _thread_data: *const c_void,
+    thread_data: *const c_void,
 ) -> c_int {
     // Handle FFI arguments
-    let context = unsafe { &mut *(data as *mut Context) };
-    let text_cstr = unsafe {
-        std::ffi::CStr::from_bytes_with_nul_unchecked(std::slice::from_raw_parts(
-            buffer as *const u8,
-            buffer_len as usize + 1,
-        ))
+    let context = unsafe { &*(data as *const Context) };
+    let event_buffer = if thread_data.is_null() {
+        &context.buffer
+    } else {
+        unsafe { &*(thread_data as *const EventBuffer) }
     };
-    let text = text_cstr.to_string_lossy().into_owned();
+    let bytes = unsafe { std::slice::from_raw_parts(buffer as *const u8, buffer_len as usize) };
+    // Single copy out of the Suricata buffer, which is reused after this call
+    let text = String::from_utf8_lossy(bytes).into_owned();
 
-    // Send text buffer to database thread
-    context.count += 1;
-    if let Err(_err) = context.tx.send(text.to_string()) {
-        log::error!("Failed to send Eve record to database thread");
-    }
+    // Buffer text, full batches are sent to database writers
+    context.shared.counters.received.fetch_add(1, Ordering::Relaxed);
+    context.shared.push(event_buffer, text);
     0
 }
 
 extern "C" fn output_thread_init(
-    _data: *const c_void,
+    data: *const c_void,
     _thread_id: std::os::raw::c_int,
-    _thread_data: *mut *mut c_void,
+    thread_data: *mut *mut c_void,
 ) -> c_int {
+    let context = unsafe { &*(data as *const Context) };
+    let buffer = Arc::new(EventBuffer::default());
+    context.shared.register(buffer.clone());
+    unsafe {
+        *thread_data = Arc::into_raw(buffer) as *mut _;
+    }
     0
 }
 
-extern "C" fn output_thread_deinit(_data: *const c_void, _thread_data: *mut c_void) {}
+extern "C" fn output_thread_deinit(data: *const c_void, thread_data: *mut c_void) {
+    if thread_data.is_null() {
+        return;
+    }
+    let context = unsafe { &*(data as *const Context) };
+    let buffer = unsafe { Arc::from_raw(thread_data as *const EventBuffer) };
+    context.shared.flush(&buffer);
+    context.shared.unregister(&buffer);
+}
 
 extern "C" fn plugin_init() {
     // Init Rust logger
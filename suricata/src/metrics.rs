@@ -0,0 +1,99 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Prometheus metrics of the EVE output.
+//!
+//! Counters are rendered in the Prometheus text exposition format and served
+//! over plain HTTP on `EVE_METRICS_ADDR`, any request path returns them.
+
+use std::fmt::Write as _;
+use std::io::{Read, Write};
+use std::net::{TcpListener, TcpStream};
+use std::sync::atomic::{AtomicU64, AtomicUsize, Ordering};
+use std::thread::JoinHandle;
+use std::time::Duration;
+
+use crate::database::Database;
+
+/// Upper bounds of the batch latency histogram buckets, in seconds.
+const LATENCY_BUCKETS: [f64; 12] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0];
+
+/// Latency histogram updated without locking by concurrent writers.
+#[derive(Default)]
+pub struct Histogram {
+    /// Observations per bucket, not cumulative
+    buckets: [AtomicU64; LATENCY_BUCKETS.len()],
+    sum_us: AtomicU64,
+    count: AtomicU64,
+}
+
+impl Histogram {
+    pub fn observe(&self, duration: Duration) {
+        let seconds = duration.as_secs_f64();
+        if let Some(i) = LATENCY_BUCKETS.iter().position(|&le| seconds <= le) {
+            self.buckets[i].fetch_add(1, Ordering::Relaxed);
+        }
+        self.sum_us.fetch_add(duration.as_micros() as u64, Ordering::Relaxed);
+        self.count.fetch_add(1, Ordering::Relaxed);
+    }
+
+    fn render(&self, out: &mut String, name: &str, help: &str) {
+        let _ = writeln!(out, "# HELP {name} {help}\n# TYPE {name} histogram");
+        let mut cumulative = 0;
+        for (le, bucket) in LATENCY_BUCKETS.iter().zip(&self.buckets) {
+            cumulative += bucket.load(Ordering::Relaxed);
+            let _ = writeln!(out, "{name}_bucket{{le=\"{le}\"}} {cumulative}");
+        }
+        let count = self.count.load(Ordering::Relaxed);
+        let _ = writeln!(out, "{name}_bucket{{le=\"+Inf\"}} {count}");
+        let _ = writeln!(out, "{name}_sum {}", self.sum_us.load(Ordering::Relaxed) as f64 / 1e6);
+        let _ = writeln!(out, "{name}_count {count}");
+    }
+}
+
+fn render_metric(out: &mut String, name: &str, kind: &str, help: &str, value: usize) {
+    let _ = writeln!(out, "# HELP {name} {help}\n# TYPE {name} {kind}\n{name} {value}");
+}
+
+/// Render the metrics of `database`, whose channel holds at most `capacity` batches.
+pub fn render(database: &Database, capacity: usize) -> String {
+    let counters = &database.counters;
+    let mut out = String::new();
+    let counter = |out: &mut String, name: &str, help: &str, value: &AtomicUsize| {
+        render_metric(out, name, "counter", help, value.load(Ordering::Relaxed))
+    };
+    counter(&mut out, "shovel_eve_events_received_total", "EVE events received from Suricata.", &counters.received);
+    counter(&mut out, "shovel_eve_events_written_total", "EVE events handled by database writers.", &counters.written);
+    counter(&mut out, "shovel_eve_rows_inserted_total", "Rows inserted, conflicting rows are skipped.", &counters.inserted);
+    counter(&mut out, "shovel_eve_events_failed_total", "EVE events of batches that failed to be written.", &counters.failed);
+    counter(&mut out, "shovel_eve_events_dropped_total", "EVE events that could not be parsed or queued.", &counters.dropped);
+    render_metric(&mut out, "shovel_eve_channel_batches", "gauge", "Batches waiting for a database writer.", counters.queued.load(Ordering::Relaxed));
+    render_metric(&mut out, "shovel_eve_channel_capacity", "gauge", "Batches the channel to database writers holds.", capacity);
+    render_metric(&mut out, "shovel_eve_pcap_cache_size", "gauge", "Flows in the flow pcap filename cache.", database.pcap_cache_size());
+    counters.batch_latency.render(&mut out, "shovel_eve_batch_duration_seconds", "Time to parse and insert one batch.");
+    out
+}
+
+fn respond(mut stream: TcpStream, body: &str) -> std::io::Result<()> {
+    // The request is not routed, only read so that the client sees a clean close
+    stream.set_read_timeout(Some(Duration::from_secs(1)))?;
+    let _ = stream.read(&mut [0; 1024]);
+    write!(
+        stream,
+        "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {}\r\nConnection: close\r\n\r\n{body}",
+        body.len()
+    )
+}
+
+/// Serve metrics on `addr` from a background thread, until the process exits.
+pub fn serve(addr: &str, database: Database, capacity: usize) -> std::io::Result<JoinHandle<()>> {
+    let listener = TcpListener::bind(addr)?;
+    log::info!("Serving metrics on http://{addr}/metrics");
+    Ok(std::thread::spawn(move || {
+        for stream in listener.incoming().flatten() {
+            if let Err(err) = respond(stream, &render(&database, capacity)) {
+                log::debug!("Failed to send metrics: {err}");
+            }
+        }
+    }))
+}
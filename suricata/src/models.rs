@@ -1,7 +1,26 @@
+use diesel::pg::Pg;
 use diesel::prelude::*;
+use diesel::serialize::{self, IsNull, Output, ToSql};
+use diesel::sql_types::Jsonb;
+use serde_json::value::RawValue;
+use std::borrow::Cow;
+use std::io::Write;
 
 use crate::schema::{alert, anomaly, app_event, fileinfo, flow};
 
+/// JSON subtree borrowed from an Eve event, sent to PostgreSQL without re-serialization.
+#[derive(Debug, Clone, Copy, AsExpression)]
+#[diesel(sql_type = Jsonb)]
+pub struct RawJson<'a>(pub &'a RawValue);
+
+impl ToSql<Jsonb, Pg> for RawJson<'_> {
+    fn to_sql<'b>(&'b self, out: &mut Output<'b, '_, Pg>) -> serialize::Result {
+        // JSONB binary format version
+        out.write_all(&[1])?;
+        out.write_all(self.0.get().as_bytes())?;
+        Ok(IsNull::No)
+    }
+}
 
 #[derive(Insertable)]
 #[diesel(table_name = flow)]
@@ -9,46 +28,46 @@ pub struct NewFlow<'a> {
     pub id: i64,
     pub ts_start: i64,
     pub ts_end: i64,
-    pub src_ip: &'a str,
+    pub src_ip: Cow<'a, str>,
     pub src_port: Option<i32>,
-    pub dest_ip: &'a str,
+    pub dest_ip: Cow<'a, str>,
     pub dest_port: Option<i32>,
-    pub pcap_filename: Option<&'a str>,
-    pub proto: &'a str,
-    pub app_proto: Option<&'a str>,
-    pub metadata: Option<serde_json::Value>,
-    pub extra_data: Option<serde_json::Value>
+    pub pcap_filename: Option<String>,
+    pub proto: Cow<'a, str>,
+    pub app_proto: Option<Cow<'a, str>>,
+    pub metadata: Option<RawJson<'a>>,
+    pub extra_data: Option<RawJson<'a>>
 }
 
 #[derive(Insertable)]
 #[diesel(table_name = alert)]
-pub struct NewAlert {
+pub struct NewAlert<'a> {
     pub flow_id: i64,
     pub timestamp: i64,
-    pub extra_data: Option<serde_json::Value>
+    pub extra_data: Option<RawJson<'a>>
 }
 
 #[derive(Insertable)]
 #[diesel(table_name = anomaly)]
-pub struct NewAnomaly {
+pub struct NewAnomaly<'a> {
     pub flow_id: i64,
     pub timestamp: i64,
-    pub extra_data: Option<serde_json::Value>
+    pub extra_data: Option<RawJson<'a>>
 }
 
 #[derive(Insertable)]
 #[diesel(table_name = fileinfo)]
-pub struct NewFileinfo {
+pub struct NewFileinfo<'a> {
     pub flow_id: i64,
     pub timestamp: i64,
-    pub extra_data: Option<serde_json::Value>
+    pub extra_data: Option<RawJson<'a>>
 }
 
 #[derive(Insertable)]
 #[diesel(table_name = app_event)]
-pub struct NewAppEvent {
+pub struct NewAppEvent<'a> {
     pub flow_id: i64,
     pub timestamp: i64,
-    pub app_proto: String,
-    pub extra_data: Option<serde_json::Value>
-}
\ No newline at end of file
+    pub app_proto: Cow<'a, str>,
+    pub extra_data: Option<RawJson<'a>>
+}
@@ -0,0 +1,271 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Loader of the payload batches spooled by the Lua payload outputs.
+//!
+//! Lua outputs run in Suricata packet threads, which must not wait for the
+//! database: each batch is written as an SQL file to the spool directory, see
+//! `payload-postgres-writer.lua`, then run by loader threads sharing the
+//! connection pool of the EVE writers. Batches left in the spool when Suricata
+//! exits, e.g. while PostgreSQL is down, are loaded at the next start.
+//!
+//! Batch files are named `<writer>-<...>.sql`, e.g. `tcp-...`, and start with a
+//! `-- <chunks> <bytes>` line. Loaders count them per writer, published as one
+//! `payload-<writer>-<shard>` row of `ingest_stats` whatever the packet threads.
+
+use diesel::connection::SimpleConnection;
+use diesel::r2d2::{ConnectionManager, Pool};
+use diesel::result::{DatabaseErrorKind, Error};
+use diesel::sql_types::{Jsonb, Text};
+use diesel::{PgConnection, RunQueryDsl};
+use std::collections::{BTreeMap, BTreeSet};
+use std::io::BufRead;
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::JoinHandle;
+use std::{fs, io, thread, time};
+
+use crate::database::lock;
+
+// Time between two scans of an empty spool.
+const POLL_INTERVAL: time::Duration = time::Duration::from_millis(100);
+
+// Complete batches, batches claimed by a loader, and batches being written by Lua.
+const BATCH_EXTENSION: &str = "sql";
+const CLAIMED_EXTENSION: &str = "loading";
+const PARTIAL_EXTENSION: &str = "tmp";
+
+/// Outcome of loading one batch.
+enum Load {
+    Written { chunks: usize, bytes: usize },
+    Failed,
+    /// PostgreSQL is unreachable, the batch is left in the spool
+    Retry,
+}
+
+/// Counters of one payload writer.
+#[derive(Default, Clone, Copy)]
+struct WriterCounters {
+    /// Chunks and bytes of the batches written
+    chunks: usize,
+    bytes: usize,
+    /// Batches written
+    batches: usize,
+    /// Batches that failed to be written, they are not retried
+    errors: usize,
+}
+
+/// Writer of a batch file, e.g. `tcp` for `tcp-<...>.sql`.
+fn writer_name(path: &Path) -> String {
+    let name = path.file_name().and_then(|name| name.to_str()).unwrap_or_default();
+    name.split('-').next().unwrap_or_default().to_string()
+}
+
+/// Chunks and bytes of a batch, read from its `-- <chunks> <bytes>` first line.
+fn batch_size(header: &str) -> (usize, usize) {
+    let mut fields = header.trim_end().strip_prefix("-- ").unwrap_or_default().split(' ');
+    let mut next = || fields.next().and_then(|field| field.parse().ok()).unwrap_or(0);
+    (next(), next())
+}
+
+/// Spool directory of the payload batches of one shard, and its loaders.
+pub struct Spool {
+    dir: PathBuf,
+    shard: u16,
+    pool: Pool<ConnectionManager<PgConnection>>,
+    running: AtomicBool,
+    writers: Mutex<BTreeMap<String, WriterCounters>>,
+}
+
+impl Spool {
+    /// Open the spool in `dir`, created if needed. Batches claimed by a loader that
+    /// did not finish are queued again, and partial batches are removed: packet
+    /// threads, which write them, are only started after the outputs.
+    pub fn new(dir: PathBuf, shard: u16, pool: Pool<ConnectionManager<PgConnection>>) -> io::Result<Self> {
+        fs::create_dir_all(&dir)?;
+        for entry in fs::read_dir(&dir)? {
+            let path = entry?.path();
+            if path.extension().is_some_and(|ext| ext == CLAIMED_EXTENSION) {
+                fs::rename(&path, path.with_extension(BATCH_EXTENSION))?;
+            } else if path.extension().is_some_and(|ext| ext == PARTIAL_EXTENSION) {
+                fs::remove_file(&path)?;
+            }
+        }
+        Ok(Self {
+            dir,
+            shard,
+            pool,
+            running: AtomicBool::new(true),
+            writers: Mutex::new(BTreeMap::new()),
+        })
+    }
+
+    /// Start `n` loader threads, running spooled batches until [`Spool::stop`].
+    pub fn spawn_loaders(self: &Arc<Self>, n: usize) -> Vec<JoinHandle<()>> {
+        (0..n)
+            .map(|i| {
+                let spool = self.clone();
+                thread::spawn(move || spool.run_loader(i))
+            })
+            .collect()
+    }
+
+    /// Stop loaders once the batches already spooled are loaded.
+    pub fn stop(&self) {
+        self.running.store(false, Ordering::Relaxed);
+    }
+
+    /// Chunks of the batches waiting in the spool, per writer.
+    fn pending(&self) -> BTreeMap<String, usize> {
+        let mut pending = BTreeMap::new();
+        for entry in fs::read_dir(&self.dir).into_iter().flatten().flatten() {
+            let path = entry.path();
+            if !path.extension().is_some_and(|ext| ext == BATCH_EXTENSION || ext == CLAIMED_EXTENSION) {
+                continue;
+            }
+            // Batches loaded meanwhile are gone
+            let mut header = String::new();
+            if fs::File::open(&path).and_then(|file| io::BufReader::new(file).read_line(&mut header)).is_ok() {
+                *pending.entry(writer_name(&path)).or_default() += batch_size(&header).0;
+            }
+        }
+        pending
+    }
+
+    /// Write the counters of each writer to its `payload-<writer>-<shard>` row of `ingest_stats`.
+    pub fn publish_stats(&self) -> Result<(), String> {
+        let writers = lock(&self.writers).clone();
+        let pending = self.pending();
+        let names: BTreeSet<&String> = writers.keys().chain(pending.keys()).collect();
+
+        let mut conn = self.pool.get().map_err(|e| e.to_string())?;
+        for name in names {
+            let counters = writers.get(name).copied().unwrap_or_default();
+            let stats = serde_json::json!({
+                "chunks": counters.chunks,
+                "bytes": counters.bytes,
+                "batches": counters.batches,
+                "errors": counters.errors,
+                "pending": pending.get(name).copied().unwrap_or(0),
+            });
+            diesel::sql_query(
+                "INSERT INTO ingest_stats (source, stats, updated_at) VALUES ($1, $2, now()) \
+                 ON CONFLICT (source) DO UPDATE SET stats = EXCLUDED.stats, updated_at = EXCLUDED.updated_at",
+            )
+            .bind::<Text, _>(format!("payload-{name}-{}", self.shard))
+            .bind::<Jsonb, _>(stats)
+            .execute(&mut conn)
+            .map_err(|e| e.to_string())?;
+        }
+        Ok(())
+    }
+
+    /// Log counters, to be called once loaders are finished.
+    pub fn log_stats(&self) {
+        for (name, counters) in lock(&self.writers).iter() {
+            log::info!(
+                "Payload loaders finished: writer={name} chunks={} bytes={} batches={} errors={}",
+                counters.chunks,
+                counters.bytes,
+                counters.batches,
+                counters.errors
+            );
+        }
+    }
+
+    /// Loader thread entry
+    fn run_loader(&self, id: usize) {
+        log::debug!("Payload loader {id} started");
+        loop {
+            // Batches spooled before the stop are still loaded
+            let running = self.running.load(Ordering::Relaxed);
+            if self.load_spooled() == 0 {
+                if !running {
+                    break;
+                }
+                thread::sleep(POLL_INTERVAL);
+            }
+        }
+        log::debug!("Payload loader {id} finished");
+    }
+
+    /// Load the batches found in the spool, returning how many were handled.
+    fn load_spooled(&self) -> usize {
+        let entries = match fs::read_dir(&self.dir) {
+            Ok(entries) => entries,
+            Err(err) => {
+                log::error!("Failed to read payload spool {}: {err}", self.dir.display());
+                return 0;
+            }
+        };
+
+        let mut handled = 0;
+        for entry in entries.flatten() {
+            let path = entry.path();
+            if !path.extension().is_some_and(|ext| ext == BATCH_EXTENSION) {
+                continue;
+            }
+            // Loaders claim a batch by renaming it, only one of them succeeds
+            let claimed = path.with_extension(CLAIMED_EXTENSION);
+            if fs::rename(&path, &claimed).is_err() {
+                continue;
+            }
+
+            let outcome = self.load(&claimed);
+            if let Load::Retry = outcome {
+                let _ = fs::rename(&claimed, &path);
+                return handled;
+            }
+            {
+                let mut writers = lock(&self.writers);
+                let counters = writers.entry(writer_name(&path)).or_default();
+                match outcome {
+                    Load::Written { chunks, bytes } => {
+                        counters.chunks += chunks;
+                        counters.bytes += bytes;
+                        counters.batches += 1;
+                    }
+                    _ => counters.errors += 1,
+                }
+            }
+            if let Err(err) = fs::remove_file(&claimed) {
+                log::error!("Failed to remove payload batch {}: {err}", claimed.display());
+            }
+            handled += 1;
+        }
+        handled
+    }
+
+    /// Run the statements of one batch, one per line, each in its own transaction.
+    /// Statements are idempotent, a batch interrupted by a lost connection is run again.
+    fn load(&self, path: &Path) -> Load {
+        let sql = match fs::read_to_string(path) {
+            Ok(sql) => sql,
+            Err(err) => {
+                log::error!("Failed to read payload batch {}: {err}", path.display());
+                return Load::Failed;
+            }
+        };
+        let mut conn = match self.pool.get() {
+            Ok(conn) => conn,
+            Err(err) => {
+                log::warn!("Postponing payload batch {}: {err}", path.display());
+                return Load::Retry;
+            }
+        };
+
+        let (chunks, bytes) = batch_size(sql.lines().next().unwrap_or_default());
+        for statement in sql.lines().filter(|line| !line.is_empty() && !line.starts_with("--")) {
+            match conn.batch_execute(statement) {
+                Ok(()) => {}
+                Err(Error::DatabaseError(DatabaseErrorKind::ClosedConnection, _)) => return Load::Retry,
+                Err(err) => {
+                    log::error!("Failed to write payload batch {}: {err}", path.display());
+                    return Load::Failed;
+                }
+            }
+        }
+        Load::Written { chunks, bytes }
+    }
+}
@@ -0,0 +1,238 @@
+// Copyright (C) 2024  ANSSI
+// SPDX-License-Identifier: GPL-2.0-or-later
+
+//! Bounded flow to pcap filename cache.
+//!
+//! Suricata writes the right `pcap_filename` in app events but not always in
+//! the closing flow event, so it is remembered per flow until the flow event
+//! is written. Entries are removed at that point, or evicted once they are
+//! older than the flow timeout (in event time) or the cache is full.
+//!
+//! Writers parse batches concurrently, so an app event may be parsed after the
+//! event of its flow. Flows written without pcap filename are remembered once
+//! committed, the filename of a late app event is then written to the flow row.
+
+use std::collections::{HashMap, HashSet, VecDeque};
+
+/// Cache entry, `seen` is the last event timestamp in microseconds.
+struct Entry {
+    pcap: u32,
+    seen: i64,
+}
+
+pub struct FlowPcapCache {
+    /// Interned pcap filenames, indexed by id
+    names: Vec<String>,
+    name_ids: HashMap<String, u32>,
+    entries: HashMap<i64, Entry>,
+    /// Flows in insertion order with the timestamp they were queued at
+    queue: VecDeque<(i64, i64)>,
+    /// Flows committed without pcap filename, in commit order, at most `capacity`
+    written: HashSet<i64>,
+    written_queue: VecDeque<i64>,
+    capacity: usize,
+    ttl: i64,
+    pub hits: u64,
+    pub misses: u64,
+    pub evictions: u64,
+    /// Flows whose pcap filename arrived after they were written
+    pub late: u64,
+}
+
+impl FlowPcapCache {
+    /// Create a cache holding at most `capacity` flows for `ttl` of event time.
+    pub fn new(capacity: usize, ttl: std::time::Duration) -> Self {
+        Self {
+            names: Vec::new(),
+            name_ids: HashMap::new(),
+            entries: HashMap::new(),
+            queue: VecDeque::new(),
+            written: HashSet::new(),
+            written_queue: VecDeque::new(),
+            capacity,
+            ttl: ttl.as_micros() as i64,
+            hits: 0,
+            misses: 0,
+            evictions: 0,
+            late: 0,
+        }
+    }
+
+    /// Remember the pcap filename of a flow seen at `timestamp`. Returns true if
+    /// the flow was already written without it, the caller then updates the flow row.
+    pub fn insert(&mut self, flow_id: i64, pcap_filename: &str, timestamp: i64) -> bool {
+        if self.written.remove(&flow_id) {
+            self.late += 1;
+            return true;
+        }
+
+        let pcap = match self.name_ids.get(pcap_filename) {
+            Some(&id) => id,
+            None => {
+                let id = self.names.len() as u32;
+                self.names.push(pcap_filename.to_string());
+                self.name_ids.insert(pcap_filename.to_string(), id);
+                id
+            }
+        };
+
+        match self.entries.get_mut(&flow_id) {
+            Some(entry) => {
+                entry.pcap = pcap;
+                entry.seen = entry.seen.max(timestamp);
+            }
+            None => {
+                self.entries.insert(flow_id, Entry { pcap, seen: timestamp });
+                self.queue.push_back((flow_id, timestamp));
+            }
+        }
+        self.evict(timestamp);
+        false
+    }
+
+    /// Remove a flow from the cache and return its pcap filename.
+    pub fn take(&mut self, flow_id: i64) -> Option<&str> {
+        match self.entries.remove(&flow_id) {
+            Some(entry) => {
+                self.hits += 1;
+                Some(&self.names[entry.pcap as usize])
+            }
+            None => {
+                self.misses += 1;
+                None
+            }
+        }
+    }
+
+    /// Remember flows committed after missing the cache. Returns the pcap filenames
+    /// inserted since their flow event was parsed, to be written to the flow rows.
+    pub fn written_without_pcap(&mut self, flow_ids: &[i64]) -> Vec<(i64, String)> {
+        let mut late = Vec::new();
+        for &flow_id in flow_ids {
+            match self.entries.remove(&flow_id) {
+                Some(entry) => late.push((flow_id, self.names[entry.pcap as usize].clone())),
+                None => {
+                    if self.written.insert(flow_id) {
+                        self.written_queue.push_back(flow_id);
+                    }
+                }
+            }
+        }
+        // Flow ids are not reused, ids removed by a late insert are skipped
+        while self.written_queue.len() > self.capacity {
+            if let Some(flow_id) = self.written_queue.pop_front() {
+                self.written.remove(&flow_id);
+            }
+        }
+        self.late += late.len() as u64;
+        late
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.entries.is_empty()
+    }
+
+    /// Drop expired flows, and the oldest ones while over capacity.
+    /// Flows seen again since they were queued get a second chance.
+    fn evict(&mut self, now: i64) {
+        while let Some(&(flow_id, queued)) = self.queue.front() {
+            let full = self.entries.len() > self.capacity;
+            if !full && queued + self.ttl > now {
+                break;
+            }
+            self.queue.pop_front();
+            // Already taken by its flow event
+            let Some(entry) = self.entries.get(&flow_id) else {
+                continue;
+            };
+            if !full && entry.seen + self.ttl > now {
+                self.queue.push_back((flow_id, entry.seen));
+                continue;
+            }
+            self.entries.remove(&flow_id);
+            self.evictions += 1;
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Duration;
+
+    const SECOND: i64 = 1_000_000;
+
+    #[test]
+    fn take_removes_flow() {
+        let mut cache = FlowPcapCache::new(10, Duration::from_secs(60));
+        cache.insert(1, "\"a.pcap\"", 0);
+        assert_eq!(cache.take(1), Some("\"a.pcap\""));
+        assert_eq!(cache.take(1), None);
+        assert_eq!((cache.hits, cache.misses), (1, 1));
+        assert!(cache.is_empty());
+    }
+
+    #[test]
+    fn evicts_oldest_over_capacity() {
+        let mut cache = FlowPcapCache::new(2, Duration::from_secs(60));
+        for flow_id in 1..=3 {
+            cache.insert(flow_id, "\"a.pcap\"", 0);
+        }
+        assert_eq!(cache.len(), 2);
+        assert_eq!(cache.evictions, 1);
+        assert_eq!(cache.take(1), None);
+        assert_eq!(cache.take(3), Some("\"a.pcap\""));
+    }
+
+    #[test]
+    fn evicts_expired_flows() {
+        let mut cache = FlowPcapCache::new(10, Duration::from_secs(10));
+        cache.insert(1, "\"a.pcap\"", 0);
+        cache.insert(2, "\"b.pcap\"", 11 * SECOND);
+        assert_eq!(cache.take(1), None);
+        assert_eq!(cache.take(2), Some("\"b.pcap\""));
+        assert_eq!(cache.evictions, 1);
+    }
+
+    #[test]
+    fn keeps_flows_seen_again() {
+        let mut cache = FlowPcapCache::new(10, Duration::from_secs(10));
+        cache.insert(1, "\"a.pcap\"", 0);
+        cache.insert(1, "\"b.pcap\"", 8 * SECOND);
+        cache.insert(2, "\"a.pcap\"", 11 * SECOND);
+        assert_eq!(cache.take(1), Some("\"b.pcap\""));
+        assert_eq!(cache.evictions, 0);
+
+        // Expired once its last event is older than the ttl
+        cache.insert(3, "\"a.pcap\"", 12 * SECOND);
+        cache.insert(4, "\"a.pcap\"", 30 * SECOND);
+        assert_eq!(cache.take(3), None);
+    }
+
+    #[test]
+    fn reports_late_pcap_filenames() {
+        let mut cache = FlowPcapCache::new(10, Duration::from_secs(60));
+        assert_eq!(cache.take(1), None);
+        assert_eq!(cache.take(2), None);
+        // Parsed by another writer before flow 2 was committed
+        assert!(!cache.insert(2, "\"b.pcap\"", 0));
+        assert_eq!(cache.written_without_pcap(&[1, 2]), vec![(2, "\"b.pcap\"".to_string())]);
+
+        // Parsed once flow 1 was committed
+        assert!(cache.insert(1, "\"a.pcap\"", 0));
+        assert!(!cache.insert(1, "\"a.pcap\"", 0));
+        assert_eq!(cache.late, 2);
+    }
+
+    #[test]
+    fn bounds_written_flows() {
+        let mut cache = FlowPcapCache::new(2, Duration::from_secs(60));
+        assert!(cache.written_without_pcap(&[1, 2, 3]).is_empty());
+        assert!(!cache.insert(1, "\"a.pcap\"", 0));
+        assert!(cache.insert(3, "\"a.pcap\"", 0));
+    }
+}
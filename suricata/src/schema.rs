@@ -71,6 +71,8 @@ diesel::table! {
         app_proto -> Nullable<Text>,
         metadata -> Nullable<Jsonb>,
         extra_data -> Nullable<Jsonb>,
+        seq -> Nullable<Int8>,
+        xid -> Nullable<Int8>,
     }
 }
 
@@ -81,6 +83,7 @@ diesel::table! {
         count -> Nullable<Int4>,
         server_to_client -> Nullable<Int4>,
         blob -> Nullable<Bytea>,
+        ts_start -> Int8,
     }
 }
 
@@ -13,22 +13,15 @@ end
 function setup (args)
     SCLogNotice("Initializing plugin TCP payload PostgreSQL Output; author=ANSSI; license=GPL-2.0")
 
-    -- Open database connection
-    luasql = require("luasql.postgres")
-    env = assert(luasql.postgres())
-    con = assert(env:connect("postgres", "postgres", "", "postgres"))
+    -- Open database connection, payloads are written in batches
+    package.path = "suricata/?.lua;" .. package.path
+    writer = require("payload-postgres-writer").new("TCP")
 
     -- packer counter for each flow
     flow_pkt_count = {}
     flow_pkt_count_total = 0
 end
 
-encode_bytea = function(str)
-  return string.format("%s", str:gsub('.', function(byte)
-    return string.format('%02x', string.byte(byte))
-  end))
-end
-
 function log (args)
     -- create log entry
     local flow_id = SCFlowId()
@@ -41,6 +34,8 @@ function log (args)
     flow_pkt_count_total = flow_pkt_count_total + 1
     local data, sb_open, sb_close, sb_ts, sb_tc = SCStreamingBuffer()
     if #data == 0 then
+        -- stream ends, e.g. on flow timeout, also flush the last chunks of quiet services
+        writer:tick()
         return
     end
     local direction = 0
@@ -48,10 +43,14 @@ function log (args)
         direction = 1
     end
 
-    assert(con:execute(string.format([[INSERT INTO raw (flow_id, count, server_to_client, blob) VALUES (%s, %s, %s, decode('%s', 'hex')) ON CONFLICT (id) DO NOTHING;]], flow_id, count, direction, encode_bytea(data))))
+    -- payloads are stored with the start of their flow, which partitions them
+    local startts, lastts, startts_us = SCFlowTimestamps()
+    local ts_start = startts * 1000000 + startts_us
+
+    writer:push(flow_id, ts_start, count, direction, data)
 end
 
 function deinit (args)
     SCLogNotice("TCP payloads logged: " .. flow_pkt_count_total)
-    database:close()
+    writer:close()
 end
@@ -12,23 +12,19 @@ end
 function setup (args)
     SCLogNotice("Initializing plugin UDP payload PostgreSQL Output; author=ANSSI; license=GPL-2.0")
 
-    -- Open database connection
-    luasql = require("luasql.postgres")
-    env = assert(luasql.postgres())
-    con = assert(env:connect("postgres", "postgres", "", "postgres"))
+    -- Open database connection, payloads are written in batches
+    package.path = "suricata/?.lua;" .. package.path
+    writer = require("payload-postgres-writer").new("UDP")
 
     -- packer counter for each flow
     flow_pkt_count = {}
     flow_pkt_count_total = 0
 end
 
-encode_bytea = function(str)
-  return string.format("%s", str:gsub('.', function(byte)
-    return string.format('%02x', string.byte(byte))
-  end))
-end
-
 function log (args)
+    -- called for every packet, flush partial batches even without UDP traffic
+    writer:tick()
+
     -- drop if not UDP (17)
     -- https://www.iana.org/assignments/protocol-numbers/protocol-numbers.xhtml
     local ipver, srcip, dstip, proto, sp, dp = SCPacketTuple()
@@ -57,10 +53,14 @@ function log (args)
         return
     end
     
-    assert(con:execute(string.format([[INSERT INTO raw (flow_id, count, server_to_client, blob) VALUES (%s, %s, %s, decode('%s', 'hex')) ON CONFLICT (id) DO NOTHING;]], flow_id, count, direction, encode_bytea(data))))
+    -- payloads are stored with the start of their flow, which partitions them
+    local startts, lastts, startts_us = SCFlowTimestamps()
+    local ts_start = startts * 1000000 + startts_us
+
+    writer:push(flow_id, ts_start, count, direction, data)
 end
 
 function deinit (args)
     SCLogNotice("UDP payloads logged: " .. flow_pkt_count_total)
-    database:close()
+    writer:close()
 end
@@ -3,8 +3,55 @@
 PCAP_BROKER_IP="$(dig +short ${PCAP_TCP_DOMAIN})"
 PCAP_BROKER_PORT="${PCAP_TCP_PORT}"
 
-touch "/dump-pcap/${PCAP_FILE_NAME}.pcap"
+DUMP_DIR="/dump-pcap"
+# Start date and tick length pushed by `./start.py config set` override the environment
+CAPTURE_ENV="/config/capture.env"
+[ -f "$CAPTURE_ENV" ] && . "$CAPTURE_ENV"
+TICK_LENGTH="${CTF_TICK_LENGTH:-60}"
 
-echo "Starting capturing $PCAP_BROKER_IP:$PCAP_BROKER_PORT on /dump-pcap/${PCAP_FILE_NAME}.pcap"
+# Segments are switched every tick, or earlier once they reach PCAP_ROTATE_SIZE megabytes.
+# tshark aligns switches on multiples of the tick length since the epoch, which match
+# the CTF ticks as long as the start date is aligned on the tick length too.
+RING_OPTS=(-b "interval:${TICK_LENGTH}" -b printname:stdout)
+if [ -n "${PCAP_ROTATE_SIZE}" ] && [ "${PCAP_ROTATE_SIZE}" -gt 0 ]; then
+    RING_OPTS+=(-b "filesize:$((PCAP_ROTATE_SIZE * 1000))")
+fi
 
-tshark -i "TCP@${PCAP_BROKER_IP}:${PCAP_BROKER_PORT}" -w "/dump-pcap/${PCAP_FILE_NAME}.pcap"
\ No newline at end of file
+# Rename a closed segment after the tick it starts in, then optionally compress it.
+# tshark names segments <prefix>_<index>_<YYYYmmddHHMMSS>.pcap, `./start.py clear --pcap`
+# only ever deletes renamed segments.
+close_segment() {
+    local file="$1"
+    local name="$(basename "$file")"
+    [[ "$name" =~ _([0-9]{4})([0-9]{2})([0-9]{2})([0-9]{2})([0-9]{2})([0-9]{2})\.pcap$ ]] || return
+
+    local stamp="${BASH_REMATCH[1]}${BASH_REMATCH[2]}${BASH_REMATCH[3]}T${BASH_REMATCH[4]}${BASH_REMATCH[5]}${BASH_REMATCH[6]}"
+    local ts="$(date -u -d "${BASH_REMATCH[1]}-${BASH_REMATCH[2]}-${BASH_REMATCH[3]} ${BASH_REMATCH[4]}:${BASH_REMATCH[5]}:${BASH_REMATCH[6]}" +%s)"
+
+    # Segments are named after the current config, the rotation interval needs a restart
+    [ -f "$CAPTURE_ENV" ] && . "$CAPTURE_ENV"
+    local tick_length="${CTF_TICK_LENGTH:-60}"
+    local ctf_start="$(date -d "${CTF_START_DATE}" +%s 2>/dev/null || echo 0)"
+    local tick=$(( (ts - ctf_start) / tick_length ))
+    [ "$tick" -lt 0 ] && tick=0
+
+    local dest="${DUMP_DIR}/${PCAP_FILE_NAME}-tick$(printf '%06d' "$tick")-${stamp}.pcap"
+    mv "$file" "$dest" || return
+    echo "Closed $dest"
+
+    if [ "${PCAP_COMPRESS}" = "zstd" ]; then
+        nice zstd -q --rm "$dest" || echo "Failed to compress $dest"
+    fi
+}
+
+# Segments left open by a previous run
+for file in "${DUMP_DIR}/${PCAP_FILE_NAME}"_*.pcap; do
+    [ -e "$file" ] && close_segment "$file"
+done
+
+echo "Starting capturing $PCAP_BROKER_IP:$PCAP_BROKER_PORT on ${DUMP_DIR}/${PCAP_FILE_NAME}_*.pcap"
+
+TZ=UTC tshark -l -i "TCP@${PCAP_BROKER_IP}:${PCAP_BROKER_PORT}" -F pcap "${RING_OPTS[@]}" -w "${DUMP_DIR}/${PCAP_FILE_NAME}.pcap" \
+    | while read -r file; do
+        close_segment "$file"
+    done